@@ -0,0 +1,192 @@
+import argparse
+import json
+import time
+
+from ext.tf_vgg import vgg19
+from lazy import lazy_import
+
+tf = lazy_import('tensorflow')
+
+###########################################################
+# Frozen objective graphs.
+#
+# export() builds Transfer's full objective (VGG, grams, losses and their
+# gradients) for one size and layer configuration, optimizes it and writes
+# it as a single GraphDef file. Transfer(..., artifact=path) imports it
+# instead of loading vgg19.npy and rebuilding the graph.
+###########################################################
+
+METADATA_NODE = 'artifact_metadata'
+
+# Transfer attributes baked into the graph
+CONFIG_KEYS = ('width', 'height', 'content_layers', 'style_layers', 'precision',
+               'gram_sampling', 'gram_sample_fraction', 'checkpoint_every', 'backbone')
+
+
+class FrozenVgg(vgg19.Vgg19):
+  '''
+    Stands in for Vgg19 on an imported graph: exposes the layers the
+    objective needs plus the toBGR / toRGB conversions, without the weights.
+  '''
+
+  def __init__(self, layers):
+    self.__dict__.update(layers)
+
+
+def _placeholder_node(name, shape):
+  node = tf.NodeDef()
+  node.op = 'Placeholder'
+  node.name = name
+  node.attr['dtype'].type = tf.float32.as_datatype_enum
+  node.attr['shape'].shape.CopyFrom(tf.TensorShape(shape).as_proto())
+  return node
+
+
+def _metadata_node(metadata):
+  node = tf.NodeDef()
+  node.op = 'Const'
+  node.name = METADATA_NODE
+  node.attr['dtype'].type = tf.string.as_datatype_enum
+  node.attr['value'].tensor.CopyFrom(tf.make_tensor_proto(json.dumps(metadata)))
+  return node
+
+
+def _fold_constants(graph_def, inputs, outputs):
+  try:
+    from tensorflow.tools.graph_transforms import TransformGraph
+  except ImportError:
+    print('graph_transforms is not available, skipping constant folding')
+    return graph_def
+  return TransformGraph(graph_def, inputs, outputs,
+                        ['fold_constants(ignore_errors=true)',
+                         'sort_by_execution_order'])
+
+
+def _remap(graph_def, outputs):
+  # Grappler's remapper fuses Conv2D + BiasAdd + Relu into a single op. The
+  # dependency and memory optimizers stay off: they would drop the control
+  # dependencies that delay recomputation in checkpointed graphs.
+  try:
+    from tensorflow.python.grappler import tf_optimizer
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.import_graph_def(graph_def, name = '')
+      meta_graph = tf.train.export_meta_graph(graph = graph)
+    meta_graph.collection_def['train_op'].node_list.value.extend(outputs)
+
+    config = tf.ConfigProto()
+    config.graph_options.rewrite_options.optimizers.extend(
+        ['pruning', 'constfold', 'arithmetic', 'remap'])
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+  except Exception as e:
+    print('Skipping conv + bias + relu fusion: {}'.format(e))
+    return graph_def
+
+
+def export(path, width = 240, height = 240, **transfer_args):
+  '''
+    Writes the optimized objective graph for the given size and Transfer
+    arguments (layers, precision, gram sampling, checkpointing) to 'path'.
+  '''
+  from transfer import Transfer
+  transfer = Transfer(None, None, width, height, display = False, **transfer_args)
+
+  tensors = transfer.objective_tensors()
+  gram_names = [G.name for G in transfer.gram_matrix_functions]
+  content_names = dict((layer, transfer.vgg[layer].name) for layer in transfer.content_layers)
+
+  # The targets become placeholders, which load_artifact maps back onto
+  # fresh variables
+  targets = {}
+  for layer, v in transfer.target_content_variables.items():
+    targets['content_' + layer] = (v.op.name, v.get_shape().as_list())
+  for layer, v in zip(transfer.style_layers, transfer.target_gram_variables):
+    targets['gram_' + layer] = (v.op.name, v.get_shape().as_list())
+  targets['style_layer_weights'] = (transfer.style_layer_weights.op.name,
+                                    transfer.style_layer_weights.get_shape().as_list())
+
+  outputs = [t.op.name for t in tensors.values()] \
+            + [name.split(':')[0] for name in gram_names] \
+            + [name.split(':')[0] for name in content_names.values()]
+  inputs = [tensors[role].op.name for role in ('image', 'alpha', 'beta')] \
+           + [name for name, _ in targets.values()]
+
+  graph_def = transfer.graph.as_graph_def()
+  target_ops = dict(targets.values())
+  for i, node in enumerate(graph_def.node):
+    if node.name in target_ops:
+      graph_def.node[i].CopyFrom(_placeholder_node(node.name, target_ops[node.name]))
+
+  graph_def = tf.graph_util.extract_sub_graph(graph_def, outputs)
+  graph_def = _fold_constants(graph_def, inputs, outputs)
+  graph_def = _remap(graph_def, outputs)
+
+  metadata = dict((key, getattr(transfer, key)) for key in CONFIG_KEYS)
+  metadata.update({
+    'tensors' : dict((role, t.name) for role, t in tensors.items()),
+    'grams' : gram_names,
+    'content' : content_names,
+    'targets' : targets
+  })
+  graph_def.node.extend([_metadata_node(metadata)])
+  transfer.close()
+
+  with open(path, 'wb') as f:
+    f.write(graph_def.SerializeToString())
+
+
+def load_artifact(transfer, path):
+  '''
+    Imports an exported graph into the current default graph and sets the
+    attributes Transfer normally creates in _build_graph.
+  '''
+  graph_def = tf.GraphDef()
+  with open(path, 'rb') as f:
+    graph_def.ParseFromString(f.read())
+
+  metadata_node = [n for n in graph_def.node if n.name == METADATA_NODE][0]
+  metadata = json.loads(tf.make_ndarray(metadata_node.attr['value'].tensor).item().decode())
+  for key in CONFIG_KEYS:
+    if key in metadata:     # artifacts from before a key was added
+      setattr(transfer, key, metadata[key])
+
+  variables = {}
+  input_map = {}
+  for key, (name, shape) in metadata['targets'].items():
+    variables[key] = transfer._target_variable(shape, name)
+    input_map[name + ':0'] = variables[key].value()
+
+  roles = sorted(metadata['tensors'])
+  layers = sorted(metadata['content'])
+  names = [metadata['tensors'][r] for r in roles] + metadata['grams'] \
+          + [metadata['content'][l] for l in layers]
+  imported = tf.import_graph_def(graph_def, input_map = input_map,
+                                 return_elements = names, name = 'artifact')
+
+  for role, tensor in zip(roles, imported):
+    setattr(transfer, role, tensor)
+  grams = imported[len(roles):len(roles) + len(metadata['grams'])]
+  transfer.gram_matrix_functions = grams
+  transfer.synthetic_gram_functions = None
+  transfer.vgg = FrozenVgg(dict(zip(layers, imported[len(roles) + len(grams):])))
+
+  transfer.target_content_variables = dict(
+      (layer, variables['content_' + layer]) for layer in transfer.content_layers)
+  transfer.target_gram_variables = [variables['gram_' + layer]
+                                    for layer in transfer.style_layers]
+  transfer.style_layer_weights = variables['style_layer_weights']
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Export a frozen, optimized objective graph.')
+  parser.add_argument('path', help='output file, e.g. transfer_240.pb')
+  parser.add_argument('--width', type=int, default=240)
+  parser.add_argument('--height', type=int, default=240)
+  parser.add_argument('--precision', default='float32', choices=vgg19.PRECISIONS)
+  parser.add_argument('--backbone', default='vgg19')
+  args = parser.parse_args()
+
+  start = time.time()
+  export(args.path, args.width, args.height, precision = args.precision,
+         backbone = args.backbone)
+  print('Exported {} in {:.1f}s'.format(args.path, time.time() - start))
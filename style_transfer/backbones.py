@@ -0,0 +1,108 @@
+import os
+
+import numpy as np
+
+from ext.tf_vgg import vgg19
+
+###########################################################
+# Feature backbones for Transfer.
+#
+# Every backbone is a vgg19.Vgg19 with another set of layers or weights, so
+# reduced precision, checkpointing and artifacts work the same on all of
+# them. Layers are named as in VGG19; each backbone maps those names onto
+# its own (map_layer).
+###########################################################
+
+WEIGHTS_DIR = os.path.dirname(os.path.abspath(vgg19.__file__))
+
+VGG16_LAYERS = (
+    'conv1_1', 'conv1_2', 'pool1',
+    'conv2_1', 'conv2_2', 'pool2',
+    'conv3_1', 'conv3_2', 'conv3_3', 'pool3',
+    'conv4_1', 'conv4_2', 'conv4_3', 'pool4',
+    'conv5_1', 'conv5_2', 'conv5_3', 'pool5',
+)
+
+
+class Vgg16(vgg19.Vgg19):
+  '''
+    VGG16 features from ext/tf_vgg/vgg16.npy: one conv layer fewer in each
+    of the last three blocks than VGG19.
+  '''
+  layers = VGG16_LAYERS
+
+  def __init__(self, npy_path = None, precision = 'float32'):
+    vgg19.Vgg19.__init__(self, npy_path or os.path.join(WEIGHTS_DIR, 'vgg16.npy'),
+                         precision)
+
+  @classmethod
+  def map_layer(cls, name):
+    # VGG19's convX_4 is the last conv of its block, which is convX_3 here
+    if name not in cls.layers and name.endswith('_4'):
+      name = name[:-1] + '3'
+    if name not in cls.layers:
+      raise ValueError('Unknown layer ' + str(name))
+    return name
+
+
+def prune_channels(data_dict, layers, keep):
+  '''
+    Keeps the 'keep' fraction of output channels of every conv layer with
+    the largest L1 filter norm, and drops the matching input channels of
+    the next conv layer. Pooling keeps the channels as they are.
+  '''
+  pruned = dict(data_dict)
+  kept = None
+  for name in layers:
+    if name.startswith('pool'):
+      continue
+    filt, bias = data_dict[name][:2]
+    if kept is not None:
+      filt = filt[:, :, kept, :]
+    importance = np.abs(filt).sum(axis = (0, 1, 2))
+    count = max(1, int(np.ceil(keep * len(importance))))
+    kept = np.sort(np.argsort(-importance)[:count])
+    pruned[name] = [filt[:, :, :, kept], bias[kept]]
+  return pruned
+
+
+class PrunedVgg19(vgg19.Vgg19):
+  '''
+    VGG19 with the least important output channels of every conv layer
+    removed (see prune_channels). Style and content layers keep their names
+    but have fewer channels, so grams are smaller and convolutions cheaper.
+  '''
+
+  def __init__(self, npy_path = None, precision = 'float32', keep = 0.5):
+    vgg19.Vgg19.__init__(self, npy_path, precision)
+    self.keep = keep
+    self.data_dict = prune_channels(self.data_dict, self.layers, keep)
+
+
+# name -> (class, keyword arguments)
+BACKBONES = {
+  'vgg19' : (vgg19.Vgg19, {}),
+  'vgg16' : (Vgg16, {}),
+  'vgg19_pruned50' : (PrunedVgg19, {'keep' : 0.5}),
+  'vgg19_pruned25' : (PrunedVgg19, {'keep' : 0.25})
+}
+
+
+def backbone_class(name):
+  if name not in BACKBONES:
+    raise ValueError('Unknown backbone {}, expected one of {}'.format(
+                     name, ', '.join(sorted(BACKBONES))))
+  return BACKBONES[name][0]
+
+
+def create(name, precision = 'float32'):
+  cls, options = BACKBONES[name]
+  return cls(precision = precision, **options)
+
+
+def map_layers(name, layers):
+  '''
+    The backbone's layer names for VGG19 layer names.
+  '''
+  cls = backbone_class(name)
+  return [cls.map_layer(layer) for layer in layers]
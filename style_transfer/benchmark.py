@@ -0,0 +1,670 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import subprocess
+import sys
+import time
+
+try:
+  import queue as Queue
+except ImportError:
+  import Queue
+
+from ext.tf_vgg import vgg19
+
+###########################################################
+# Benchmarks for the style transfer pipeline.
+#
+# Run from this directory, e.g.
+#   python benchmark.py precision --size 240 --iters 20
+# Every configuration runs in a fresh process so that timings and peak
+# memory are not polluted by earlier runs.
+###########################################################
+
+DATA_INPUT = 'data/input/'
+STYLE_IMAGE = os.path.join(DATA_INPUT, 'style/vangogh.jpg')
+CONTENT_IMAGE = os.path.join(DATA_INPUT, 'content/baker.jpg')
+
+BENCH_PARAMS = {
+  'type' : 'adadelta',
+  'step_size' : 1.0,
+  'gamma' : 0.9,
+  'eps' : 1e-6,
+  'verbose' : False
+}
+
+
+def _child(queue, fn, args):
+  try:
+    result = fn(*args)
+  except Exception as e:
+    result = {'error' : '{}: {}'.format(type(e).__name__, e)}
+  # ru_maxrss is reported in kilobytes on Linux
+  result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+  queue.put(result)
+
+
+def in_subprocess(fn, *args):
+  '''
+    Runs fn(*args) in a new process and returns its result dict, with the
+    process' peak resident memory added as 'peak_rss_mb'. If fn raises or
+    the process dies (e.g. killed for running out of memory) the dict has
+    an 'error' entry instead.
+  '''
+  queue = multiprocessing.Queue()
+  process = multiprocessing.Process(target=_child, args=(queue, fn, args))
+  process.start()
+  while True:
+    try:
+      result = queue.get(timeout=1)
+      break
+    except Queue.Empty:
+      if not process.is_alive():
+        result = {'error' : 'exit code {}'.format(process.exitcode)}
+        break
+  process.join()
+  return result
+
+
+def time_iterations(transfer, iters, alpha = 1, beta = 1e3, params = {}):
+  '''
+    Optimizes from the current initial image and returns the seconds per
+    iteration, the loss curve and the step size of the first iteration (None
+    for adadelta). One untimed evaluation warms up the session.
+  '''
+  transfer.loss_and_gradient(transfer.synthetic, alpha, beta)
+
+  run_params = dict(BENCH_PARAMS)
+  run_params.update(params)
+  run_params.update({'iters' : iters, 'save' : lambda p: p})
+
+  start = time.time()
+  result = transfer.transfer_style_to_image(alpha = alpha, beta = beta,
+                                            params = run_params)
+  seconds = time.time() - start
+  return {
+    'seconds_per_iter' : seconds / max(result['iter'], 1),
+    'loss' : result['loss'],
+    'theta' : result['theta'],
+    'step_size' : result['metrics'][0].get('step_size') if result['metrics'] else None
+  }
+
+
+def print_table(columns, rows):
+  widths = [max(len(c), 12) for c in columns]
+  print('  '.join(c.rjust(w) for c, w in zip(columns, widths)))
+  for row in rows:
+    cells = []
+    for value, w in zip(row, widths):
+      if isinstance(value, float):
+        cells.append('{:.4g}'.format(value).rjust(w))
+      else:
+        cells.append(str(value).rjust(w))
+    print('  '.join(cells))
+
+
+###########################################################
+# Reduced precision VGG
+###########################################################
+
+def _run_precision(precision, size, iters):
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      precision = precision)
+  _, c_loss, s_loss = transfer.loss_and_gradient(transfer.synthetic)
+  result = time_iterations(transfer, iters)
+  return {
+    'precision' : transfer.precision,
+    'initial_loss' : float(c_loss + 1e3 * s_loss),
+    'final_loss' : float(result['loss'][-1]),
+    'seconds_per_iter' : result['seconds_per_iter'],
+    'weight_mb' : transfer.vgg.weight_bytes / 2.0 ** 20
+  }
+
+
+def bench_precision(args):
+  rows = []
+  reference = None
+  for precision in vgg19.PRECISIONS:
+    r = in_subprocess(_run_precision, precision, args.size, args.iters)
+    if 'error' in r:
+      print('{} failed: {}'.format(precision, r['error']))
+      if precision == 'float32':
+        return      # nothing to compare against
+      continue
+    if precision == 'float32':
+      reference = r
+    if r['precision'] != precision:
+      print('{} not available, skipped'.format(precision))
+      continue
+    rows.append([
+      precision,
+      abs(r['initial_loss'] - reference['initial_loss']) / reference['initial_loss'],
+      abs(r['final_loss'] - reference['final_loss']) / reference['final_loss'],
+      r['seconds_per_iter'],
+      reference['seconds_per_iter'] / r['seconds_per_iter'],
+      r['weight_mb'],
+      r['peak_rss_mb']
+    ])
+  print_table(['precision', 'init_loss_diff', 'final_loss_diff', 's/iter',
+               'speedup', 'weights_mb', 'peak_rss_mb'], rows)
+  print('\nweights_mb are the weight constants in the graph')
+
+
+###########################################################
+# Thread and core placement
+###########################################################
+
+def _run_placement(queue, placement_args, size, iters):
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      **placement_args)
+  transfer.loss_and_gradient(transfer.synthetic)
+  start = time.time()
+  for _ in range(iters):
+    transfer.loss_and_gradient(transfer.synthetic)
+  queue.put((start, time.time(), iters))
+
+
+def _throughput(placements, size, iters):
+  # Runs one worker per placement concurrently and returns iterations per
+  # second over the window in which they were all optimizing
+  queue = multiprocessing.Queue()
+  processes = [multiprocessing.Process(target=_run_placement,
+                                       args=(queue, p, size, iters))
+               for p in placements]
+  for p in processes:
+    p.start()
+  results = [queue.get() for _ in processes]
+  for p in processes:
+    p.join()
+  start = min(r[0] for r in results)
+  end = max(r[1] for r in results)
+  return sum(r[2] for r in results) / (end - start)
+
+
+def bench_threads(args):
+  import placement
+  cpus = placement.available_cpus()
+  workers = [n for n in args.workers if n <= len(cpus)]
+
+  rows = []
+  for n in workers:
+    defaults = _throughput([{}] * n, args.size, args.iters)
+    partitioned = _throughput(placement.partition_cores(n, cpus), args.size, args.iters)
+    rows.append([n, len(cpus) // n, defaults, partitioned, partitioned / defaults])
+  print('{} cores available'.format(len(cpus)))
+  print_table(['workers', 'cores/worker', 'default it/s', 'pinned it/s', 'gain'], rows)
+
+
+###########################################################
+# Sampled gram estimation
+###########################################################
+
+def _run_gram(mode, fraction, size, iters, out_dir):
+  import skimage.io
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      gram_sampling = mode, gram_sample_fraction = fraction)
+  result = time_iterations(transfer, iters)
+
+  # Score every run with the exact objective
+  image = transfer._as_image(result['theta'])
+  c_loss, s_loss = transfer.sess.run([transfer.content_loss, transfer.exact_style_loss],
+                                     {transfer.image : image})
+  if out_dir is not None:
+    out = transfer.vgg.toRGB(image)[0].clip(0, 1)
+    skimage.io.imsave(os.path.join(out_dir, 'gram_{}_{}.png'.format(mode, size)), out)
+  return {
+    'seconds_per_iter' : result['seconds_per_iter'],
+    'exact_loss' : float(c_loss + 1e3 * s_loss)
+  }
+
+
+def bench_gram(args):
+  rows = []
+  for size in args.sizes:
+    exact = None
+    for mode in (None, 'random', 'grid'):
+      r = in_subprocess(_run_gram, mode, args.fraction, size, args.iters, args.out_dir)
+      if exact is None:
+        exact = r
+      rows.append([
+        size, str(mode), r['seconds_per_iter'],
+        exact['seconds_per_iter'] / r['seconds_per_iter'],
+        r['exact_loss'],
+        (r['exact_loss'] - exact['exact_loss']) / exact['exact_loss'],
+        r['peak_rss_mb']
+      ])
+  print_table(['size', 'sampling', 's/iter', 'speedup', 'final_loss',
+               'loss_vs_exact', 'peak_rss_mb'], rows)
+
+
+###########################################################
+# Gradient checkpointing
+###########################################################
+
+def _run_checkpoint(checkpoint_every, size, iters):
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      checkpoint_every = checkpoint_every)
+  return time_iterations(transfer, iters)
+
+
+def bench_checkpoint(args):
+  # Peak RSS includes the ~550MB of VGG19 weights loaded from the npy file
+  rows = []
+  for size in args.sizes:
+    for checkpoint_every in [None] + args.every:
+      r = in_subprocess(_run_checkpoint, checkpoint_every, size, args.iters)
+      if 'error' in r:
+        rows.append([size, str(checkpoint_every), '-', r['peak_rss_mb'], r['error']])
+      else:
+        rows.append([size, str(checkpoint_every), r['seconds_per_iter'],
+                     r['peak_rss_mb'], ''])
+  print_table(['size', 'checkpoint', 's/iter', 'peak_rss_mb', 'error'], rows)
+
+
+###########################################################
+# First-order optimizers and step sizes
+###########################################################
+
+OPTIMIZER_CONFIGS = [
+  ('momentum 1e-6', {'type' : 'momentum', 'step_size' : 1e-6, 'gamma' : 0.9}),
+  ('adadelta', {'type' : 'adadelta', 'gamma' : 0.9}),
+  ('momentum auto', {'type' : 'momentum', 'step_size' : 'auto', 'gamma' : 0.9}),
+  ('adam 1.0', {'type' : 'adam', 'step_size' : 1.0}),
+  ('adam auto', {'type' : 'adam', 'step_size' : 'auto'}),
+  ('adam auto cosine', {'type' : 'adam', 'step_size' : 'auto', 'lr_schedule' : 'cosine'}),
+  ('adam auto step', {'type' : 'adam', 'step_size' : 'auto', 'lr_schedule' : 'step',
+                      'decay_every' : 25})
+]
+
+
+# The weights run.py uses with the first-order optimizers
+OPTIMIZER_ALPHA, OPTIMIZER_BETA = 5e5, 1
+
+
+def _run_optimizer(params, size, iters):
+  import numpy as np
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False)
+  np.random.seed(0)
+  transfer.set_random_initial_img()
+  _, c_loss, s_loss = transfer.loss_and_gradient(transfer.synthetic)
+  result = time_iterations(transfer, iters, OPTIMIZER_ALPHA, OPTIMIZER_BETA, params)
+  return {
+    'initial_loss' : float(OPTIMIZER_ALPHA * c_loss + OPTIMIZER_BETA * s_loss),
+    'loss' : [float(l) for l in result['loss']],
+    'seconds_per_iter' : result['seconds_per_iter'],
+    'step_size' : result['step_size']
+  }
+
+
+def bench_optimizers(args):
+  # All runs start from the same seeded noise; the target is a fraction of
+  # its loss
+  results = []
+  for name, params in OPTIMIZER_CONFIGS:
+    results.append((name, in_subprocess(_run_optimizer, params, args.size, args.iters)))
+
+  rows = []
+  for name, r in results:
+    if 'error' in r:
+      rows.append([name, '-', '-', '-', '-', r['error']])
+      continue
+    target = args.target * r['initial_loss']
+    reached = [i + 1 for i, l in enumerate(r['loss']) if l <= target]
+    iters = reached[0] if reached else '>{}'.format(args.iters)
+    rows.append([name, str(r['step_size']), iters, r['loss'][-1] / r['initial_loss'],
+                 r['seconds_per_iter'], ''])
+  print_table(['optimizer', 'step_size', 'iters_to_target', 'final/initial',
+               's/iter', 'error'], rows)
+
+
+###########################################################
+# Hybrid first-order / L-BFGS schedules
+###########################################################
+
+HYBRID_CONFIGS = [
+  ('adadelta', [{'type' : 'adadelta', 'iters' : 300, 'gamma' : 0.9}]),
+  ('adam auto', [{'type' : 'adam', 'iters' : 300, 'step_size' : 'auto'}]),
+  ('lbfgs', [{'type' : 'lbfgs', 'iters' : 300}]),
+  ('adadelta > lbfgs', [{'type' : 'adadelta', 'iters' : 50, 'gamma' : 0.9, 'tol' : 1e-3},
+                        {'type' : 'lbfgs', 'iters' : 250}]),
+  ('adam > lbfgs', [{'type' : 'adam', 'iters' : 30, 'step_size' : 'auto', 'tol' : 1e-3},
+                    {'type' : 'lbfgs', 'iters' : 270}])
+]
+
+
+def _run_hybrid(phases, size):
+  import numpy as np
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False)
+  np.random.seed(0)
+  transfer.set_random_initial_img()
+  _, c_loss, s_loss = transfer.loss_and_gradient(transfer.synthetic, 1, 1e3)
+
+  result = transfer.transfer_style_hybrid(alpha = 1, beta = 1e3, phases = phases,
+                                          params = {'save' : lambda p: p,
+                                                    'verbose' : False})
+  elapsed = np.cumsum([row['seconds'] for row in result['metrics']])
+  return {
+    'initial_loss' : float(c_loss + 1e3 * s_loss),
+    'loss' : [row['loss'] for row in result['metrics']],
+    'elapsed' : [float(t) for t in elapsed],
+    'phases' : result['phases']
+  }
+
+
+def bench_hybrid(args):
+  rows = []
+  for name, phases in HYBRID_CONFIGS:
+    r = in_subprocess(_run_hybrid, phases, args.size)
+    if 'error' in r:
+      rows.append([name, '-', '-', '-', '-', r['error']])
+      continue
+    target = args.target * r['initial_loss']
+    reached = [i for i, l in enumerate(r['loss']) if l <= target]
+    if reached:
+      iters, seconds = reached[0] + 1, r['elapsed'][reached[0]]
+    else:
+      iters, seconds = '-', '-'
+    split = ' + '.join('{}x{}'.format(p['iters'], p['type']) for p in r['phases'])
+    rows.append([name, iters, seconds, r['loss'][-1] / r['initial_loss'], split, ''])
+  print_table(['schedule', 'iters_to_target', 's_to_target', 'final/initial',
+               'phases', 'error'], rows)
+
+
+###########################################################
+# Streaming previews
+###########################################################
+
+def _run_stream(size, pyramid, iters):
+  from transfer import Transfer, stream_pyramid
+  start = time.time()
+  if pyramid:
+    sizes = [s for s in (size // 4, size // 2) if s >= 32] + [size]
+    previews = stream_pyramid(STYLE_IMAGE, CONTENT_IMAGE, sizes, (1, iters))
+  else:
+    transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False)
+    previews = transfer.stream(1, 1e3, (1, iters), params = {
+      'type' : 'adam', 'step_size' : 'auto', 'iters' : iters})
+
+  first = None
+  count = skipped = 0
+  for preview in previews:
+    if first is None:
+      first = time.time() - start
+    count += 1
+    skipped += preview['skipped']
+  return {
+    'first_preview' : first,
+    'total' : time.time() - start,
+    'previews' : count,
+    'skipped' : skipped,
+    'final_loss' : preview['loss']
+  }
+
+
+def bench_stream(args):
+  rows = []
+  for size in args.sizes:
+    for pyramid in (False, True):
+      r = in_subprocess(_run_stream, size, pyramid, args.iters)
+      if 'error' in r:
+        rows.append([size, str(pyramid), '-', '-', '-', r['error']])
+      else:
+        rows.append([size, str(pyramid), r['first_preview'], r['total'],
+                     r['previews'], ''])
+  print_table(['size', 'pyramid', 's_to_first', 's_total', 'previews', 'error'], rows)
+
+
+###########################################################
+# Feature backbones
+###########################################################
+
+def _run_backbone(backbone, size, iters):
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      backbone = backbone)
+  result = time_iterations(transfer, iters)
+  return {
+    'seconds_per_iter' : result['seconds_per_iter'],
+    'weight_mb' : transfer.vgg.weight_bytes / 2.0 ** 20,
+    'image' : transfer.output_image(result['theta'])[0]
+  }
+
+
+def _score_vgg19(images, size):
+  # Every backbone optimizes its own features; quality is compared on the
+  # full VGG19 objective
+  from transfer import Transfer
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False)
+  losses = {}
+  for backbone, image in images.items():
+    _, c_loss, s_loss = transfer.loss_and_gradient(transfer.vgg.toBGR(image[None]), 1, 1e3)
+    losses[backbone] = float(c_loss + 1e3 * s_loss)
+  return losses
+
+
+def bench_backbones(args):
+  from backbones import BACKBONES
+  names = ['vgg19'] + sorted(b for b in BACKBONES if b != 'vgg19')
+  runs = dict((b, in_subprocess(_run_backbone, b, args.size, args.iters)) for b in names)
+  images = dict((b, r['image']) for b, r in runs.items() if 'error' not in r)
+  losses = in_subprocess(_score_vgg19, images, args.size)
+
+  reference = runs['vgg19']
+  if 'vgg19' not in losses:
+    print('The VGG19 reference failed: {}'.format(reference.get('error', losses.get('error'))))
+    return
+  rows = []
+  for b in names:
+    r = runs[b]
+    if 'error' in r or b not in losses:
+      rows.append([b, '-', '-', '-', '-', r.get('error', losses.get('error', ''))])
+      continue
+    rows.append([b, r['seconds_per_iter'],
+                 reference['seconds_per_iter'] / r['seconds_per_iter'],
+                 losses[b], (losses[b] - losses['vgg19']) / losses['vgg19'], ''])
+  print_table(['backbone', 's/iter', 'speedup', 'vgg19_loss', 'loss_vs_vgg19', 'error'], rows)
+
+
+###########################################################
+# Cold start
+###########################################################
+
+STARTUP_SCRIPT = '''
+import time
+start = time.time()
+from transfer import Transfer
+transfer = Transfer({style!r}, {content!r}, {size}, {size}, display = False,
+                    artifact = {artifact!r})
+transfer.loss_and_gradient(transfer.synthetic)
+print(time.time() - start)
+'''
+
+
+def _cold_start(size, artifact):
+  # Wall time from launching a new interpreter to the end of the first
+  # iteration, and the part of it spent after the interpreter was up
+  script = STARTUP_SCRIPT.format(style=STYLE_IMAGE, content=CONTENT_IMAGE,
+                                 size=size, artifact=artifact)
+  start = time.time()
+  output = subprocess.check_output([sys.executable, '-c', script])
+  total = time.time() - start
+  return total, float(output.decode().strip().split('\n')[-1])
+
+
+def _export(path, size):
+  import artifact
+  artifact.export(path, size, size)
+  return {}
+
+
+def bench_startup(args):
+  path = args.artifact or 'transfer_{}.pb'.format(args.size)
+  if not os.path.exists(path):
+    start = time.time()
+    in_subprocess(_export, path, args.size)
+    print('Exported {} in {:.1f}s'.format(path, time.time() - start))
+
+  rows = []
+  for name, artifact_path in (('build', None), ('artifact', path)):
+    runs = [_cold_start(args.size, artifact_path) for _ in range(args.repeat)]
+    rows.append([name, min(r[0] for r in runs), min(r[1] for r in runs)])
+  print_table(['graph', 'process_s', 'in_python_s'], rows)
+
+
+###########################################################
+# Import time
+###########################################################
+
+# Must not be imported just by importing one of our modules
+HEAVY_MODULES = ('tensorflow', 'matplotlib', 'scipy', 'skimage')
+
+IMPORT_SCRIPT = '''
+import sys, time
+start = time.time()
+import {module}
+print(time.time() - start)
+print(' '.join(sorted(m for m in sys.modules if m.split('.')[0] in {heavy!r})))
+'''
+
+
+def _import_time(module):
+  script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+  output = subprocess.check_output([sys.executable, '-c', script]).decode()
+  lines = output.strip().split('\n')
+  heavy = lines[-1].split() if len(lines) > 1 else []
+  return float(lines[-2] if heavy else lines[-1]), heavy
+
+
+def _import_breakdown(module, top):
+  # Python 3.7+ reports per-module import times on stderr
+  output = subprocess.check_output([sys.executable, '-X', 'importtime', '-c',
+                                    'import ' + module],
+                                   stderr=subprocess.STDOUT).decode()
+  times = []
+  for line in output.split('\n'):
+    parts = line.split('|')
+    if not line.startswith('import time:') or len(parts) != 3:
+      continue
+    try:
+      self_us = int(parts[0].split(':')[1])
+    except ValueError:
+      continue      # header line
+    times.append((self_us, parts[2].strip()))
+  return sorted(times, reverse=True)[:top]
+
+
+def bench_imports(args):
+  failed = False
+  rows = []
+  for module in args.modules:
+    seconds = min(_import_time(module)[0] for _ in range(args.repeat))
+    heavy = _import_time(module)[1]
+    over = seconds * 1000 > args.budget_ms or bool(heavy)
+    failed = failed or over
+    rows.append([module, seconds * 1000, ' '.join(heavy) or '-',
+                 'OVER BUDGET' if over else 'ok'])
+  print_table(['module', 'import_ms', 'heavy_imports', 'status'], rows)
+
+  if sys.version_info >= (3, 7):
+    for module in args.modules:
+      print('\nSlowest imports under {}:'.format(module))
+      for self_us, name in _import_breakdown(module, args.top):
+        print('  {:>8.1f} ms  {}'.format(self_us / 1000.0, name))
+
+  if failed:
+    print('\nImport budget of {} ms (and no {}) exceeded'.format(
+          args.budget_ms, '/'.join(HEAVY_MODULES)))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Style transfer benchmarks.')
+  subparsers = parser.add_subparsers(dest='command')
+
+  precision = subparsers.add_parser('precision',
+      help='float32 vs bfloat16 VGG')
+  precision.add_argument('--size', type=int, default=240)
+  precision.add_argument('--iters', type=int, default=20)
+  precision.set_defaults(func=bench_precision)
+
+  threads = subparsers.add_parser('threads',
+      help='throughput of N workers per node, default vs partitioned cores')
+  threads.add_argument('--size', type=int, default=240)
+  threads.add_argument('--iters', type=int, default=20)
+  threads.add_argument('--workers', type=lambda s: [int(n) for n in s.split(',')],
+                       default=[1, 2, 4, 8])
+  threads.set_defaults(func=bench_threads)
+
+  gram = subparsers.add_parser('gram',
+      help='exact vs sampled gram estimation at high resolution')
+  gram.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')],
+                    default=[1024])
+  gram.add_argument('--fraction', type=float, default=0.25)
+  gram.add_argument('--iters', type=int, default=20)
+  gram.add_argument('--out-dir', default=None,
+                    help='save the final images here for visual comparison')
+  gram.set_defaults(func=bench_gram)
+
+  checkpoint = subparsers.add_parser('checkpoint',
+      help='peak memory and time per iteration with activation recomputation')
+  checkpoint.add_argument('--sizes', type=lambda s: [int(n) for n in s.split(',')],
+                          default=[256, 512, 1024, 1536, 2048])
+  checkpoint.add_argument('--every', type=lambda s: [int(n) for n in s.split(',')],
+                          default=[1, 2],
+                          help='checkpoint every k pool layers')
+  checkpoint.add_argument('--iters', type=int, default=5)
+  checkpoint.set_defaults(func=bench_checkpoint)
+
+  startup = subparsers.add_parser('startup',
+      help='time to first iteration from a cold process, built vs frozen graph')
+  startup.add_argument('--size', type=int, default=240)
+  startup.add_argument('--artifact', default=None,
+                       help='exported graph to use, created if missing')
+  startup.add_argument('--repeat', type=int, default=3)
+  startup.set_defaults(func=bench_startup)
+
+  optimizers = subparsers.add_parser('optimizers',
+      help='iterations to reach a target loss from noise per optimizer')
+  optimizers.add_argument('--size', type=int, default=200)
+  optimizers.add_argument('--iters', type=int, default=100)
+  optimizers.add_argument('--target', type=float, default=0.05,
+                          help='target loss as a fraction of the initial loss')
+  optimizers.set_defaults(func=bench_optimizers)
+
+  hybrid = subparsers.add_parser('hybrid',
+      help='time to a target loss of first-order, L-BFGS and hybrid schedules')
+  hybrid.add_argument('--size', type=int, default=200)
+  hybrid.add_argument('--target', type=float, default=0.02,
+                      help='target loss as a fraction of the initial loss')
+  hybrid.set_defaults(func=bench_hybrid)
+
+  stream = subparsers.add_parser('stream',
+      help='time to the first streamed preview, with and without a pyramid')
+  stream.add_argument('--sizes', type=int, nargs='+', default=[240, 480])
+  stream.add_argument('--iters', type=int, default=50)
+  stream.set_defaults(func=bench_stream)
+
+  backbone = subparsers.add_parser('backbones',
+      help='speed and VGG19 loss of VGG16 and pruned VGG19 backbones')
+  backbone.add_argument('--size', type=int, default=240)
+  backbone.add_argument('--iters', type=int, default=50)
+  backbone.set_defaults(func=bench_backbones)
+
+  imports = subparsers.add_parser('imports',
+      help='import time of the entry points, fails when over budget')
+  imports.add_argument('--modules', nargs='+',
+                       default=['run', 'transfer', 'video', 'sweep', 'fast'])
+  imports.add_argument('--budget-ms', type=float, default=500)
+  imports.add_argument('--repeat', type=int, default=3)
+  imports.add_argument('--top', type=int, default=10)
+  imports.set_defaults(func=bench_imports)
+
+  args = parser.parse_args()
+  args.func(args)
@@ -0,0 +1,374 @@
+import collections
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+
+def hash_array(array):
+  # Hash of the exact pixel values, independent of where they were read from
+  array = np.ascontiguousarray(array)
+  h = hashlib.sha1(array.tobytes())
+  h.update(str(array.shape).encode())
+  h.update(str(array.dtype).encode())
+  return h.hexdigest()
+
+
+def source_hash(image):
+  '''
+    Hash of an input image given as a path (its file bytes) or an array.
+  '''
+  if isinstance(image, np.ndarray):
+    return hash_array(image)
+  h = hashlib.sha1()
+  with open(image, 'rb') as f:
+    for block in iter(lambda: f.read(2 ** 20), b''):
+      h.update(block)
+  return h.hexdigest()
+
+
+def job_fingerprint(content, style, width, height, content_layers, style_layers,
+                    style_weights = None, params = None, seed = None):
+  '''
+    Deterministic key of a transfer job: the bytes of the content and style
+    images (paths or arrays), the size, layers and style weights, the
+    optimizer params (alpha, beta, type, step size, ...) and the seed.
+  '''
+  styles = style if isinstance(style, (list, tuple)) else [style]
+  job = {
+    'content' : source_hash(content),
+    'style' : [source_hash(s) for s in styles],
+    'size' : [width, height],
+    'layers' : [list(content_layers), list(style_layers)],
+    'style_weights' : style_weights,
+    'params' : params or {},
+    'seed' : seed
+  }
+  return hashlib.sha1(json.dumps(job, sort_keys = True).encode()).hexdigest()
+
+
+class FeatureCache:
+  '''
+    LRU cache of VGG activations, keyed by image hash, size and layers.
+
+    Entries are dicts of layer name -> numpy array. At most 'max_bytes' are
+    held in memory; if 'spill_dir' is given, entries evicted from memory are
+    written there as one directory of .npy files per key and read back as
+    memory-mapped arrays. The spill directory is capped at 'spill_bytes',
+    removing the least recently used entries first.
+
+    With 'write_through', every entry is written to spill_dir as soon as it
+    is put, so that processes sharing the directory (e.g. workers on other
+    nodes) can read it.
+  '''
+
+  def __init__(self, max_bytes = 256 * 2 ** 20, spill_dir = None, write_through = False,
+               spill_bytes = 2048 * 2 ** 20):
+    self.max_bytes = max_bytes
+    self.spill_dir = spill_dir
+    self.spill_bytes = spill_bytes
+    self.write_through = write_through and spill_dir is not None
+    self.entries = collections.OrderedDict()
+    self.bytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.lock = threading.Lock()
+    if spill_dir is not None and not os.path.isdir(spill_dir):
+      os.makedirs(spill_dir)
+
+  @staticmethod
+  def key(image, width, height, layers, *extra):
+    parts = [hash_array(image), str(width), str(height), ','.join(layers)]
+    parts.extend(str(e) for e in extra)
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.0
+
+  def _load_spilled(self, key):
+    if self.spill_dir is None:
+      return None
+    path = os.path.join(self.spill_dir, key)
+    if not os.path.isdir(path):
+      return None
+    entry = {}
+    try:
+      for name in os.listdir(path):
+        entry[name[:-len('.npy')]] = np.load(os.path.join(path, name), mmap_mode='r')
+      os.utime(path, None)      # mark most recently used
+    except (IOError, OSError):
+      return None               # removed by another process trimming the directory
+    return entry
+
+  def _spill(self, key, entry):
+    path = os.path.join(self.spill_dir, key)
+    if os.path.isdir(path):
+      return
+    # Write into a temporary directory and rename it so that readers never
+    # see a partial entry
+    tmp = '{}.tmp{}'.format(path, os.getpid())
+    try:
+      if not os.path.isdir(tmp):
+        os.makedirs(tmp)
+      for layer, array in entry.items():
+        np.save(os.path.join(tmp, layer + '.npy'), array)
+      try:
+        os.rename(tmp, path)
+      except OSError:
+        pass      # another process spilled the same entry first
+    except (IOError, OSError) as e:
+      # The spilled copy is optional; a full or missing disk must not fail
+      # the job that computed the features
+      print('Could not spill features to {}: {}'.format(self.spill_dir, e))
+      return
+    finally:
+      shutil.rmtree(tmp, ignore_errors = True)
+    self._trim_spilled()
+
+  def _trim_spilled(self):
+    entries = []
+    for name in os.listdir(self.spill_dir):
+      path = os.path.join(self.spill_dir, name)
+      if '.tmp' in name or not os.path.isdir(path):
+        continue
+      try:
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+      except OSError:
+        pass
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+      if total <= self.spill_bytes:
+        break
+      shutil.rmtree(path, ignore_errors = True)
+      total -= size
+
+  def _evict(self):
+    while self.bytes > self.max_bytes and self.entries:
+      key, entry = self.entries.popitem(last=False)
+      self.bytes -= sum(a.nbytes for a in entry.values())
+      if self.spill_dir is not None:
+        self._spill(key, entry)
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        self.entries[key] = self.entries.pop(key)     # mark most recently used
+      else:
+        entry = self._load_spilled(key)
+      if entry is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+      return entry
+
+  def put(self, key, entry):
+    with self.lock:
+      if key in self.entries:
+        self.bytes -= sum(a.nbytes for a in self.entries.pop(key).values())
+      self.entries[key] = entry
+      self.bytes += sum(a.nbytes for a in entry.values())
+      if self.write_through:
+        self._spill(key, entry)
+      self._evict()
+
+  def get_or_compute(self, key, compute):
+    entry = self.get(key)
+    if entry is None:
+      entry = compute()
+      self.put(key, entry)
+    return entry
+
+  def stats(self):
+    return {
+      'hits' : self.hits,
+      'misses' : self.misses,
+      'hit_rate' : self.hit_rate,
+      'entries' : len(self.entries),
+      'bytes' : self.bytes
+    }
+
+
+class ResultCache:
+  '''
+    Content-addressed cache of finished results (numpy arrays, e.g. the
+    output image) on disk, keyed by job_fingerprint.
+
+    Entries are written to a temporary file and renamed into place, and the
+    least recently used ones are removed once the directory holds more than
+    'max_bytes'. Identical jobs running at the same time compute once:
+    threads of one process wait on an event, other processes on a lock file
+    next to the entry. Lock files older than 'lock_timeout' seconds are
+    considered left behind by a crashed job and broken.
+  '''
+
+  def __init__(self, directory, max_bytes = 1024 * 2 ** 20, lock_timeout = 600,
+               poll = 0.05):
+    self.directory = directory
+    self.max_bytes = max_bytes
+    self.lock_timeout = lock_timeout
+    self.poll = poll
+    self.hits = 0
+    self.misses = 0
+    self.shared = 0
+    self.evictions = 0
+    self.lock = threading.Lock()
+    self.inflight = {}
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  @property
+  def hit_rate(self):
+    total = self.hits + self.misses
+    return float(self.hits) / total if total else 0.0
+
+  def path(self, key):
+    return os.path.join(self.directory, key + '.npy')
+
+  def _read(self, key):
+    path = self.path(key)
+    try:
+      entry = np.load(path)
+    except (IOError, OSError):
+      return None
+    try:
+      os.utime(path, None)      # mark most recently used
+    except OSError:
+      pass      # evicted in the meantime; the array is already loaded
+    return entry
+
+  def _entries(self):
+    entries = []
+    for name in os.listdir(self.directory):
+      if not name.endswith('.npy'):
+        continue
+      try:
+        stat = os.stat(os.path.join(self.directory, name))
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, name))
+    return sorted(entries)
+
+  def _evict(self):
+    entries = self._entries()
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in entries:
+      if total <= self.max_bytes:
+        break
+      try:
+        os.remove(os.path.join(self.directory, name))
+        self.evictions += 1
+      except OSError:
+        pass
+      total -= size
+
+  def peek(self, key):
+    '''
+      The entry for key, or None, without counting a hit or miss.
+    '''
+    return self._read(key)
+
+  def get(self, key):
+    entry = self._read(key)
+    with self.lock:
+      if entry is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    return entry
+
+  def put(self, key, entry):
+    tmp = '{}.tmp{}.{}'.format(self.path(key), os.getpid(), threading.current_thread().ident)
+    with open(tmp, 'wb') as f:
+      np.save(f, entry)
+    os.rename(tmp, self.path(key))
+    with self.lock:
+      self._evict()
+
+  def _lock_path(self, key):
+    return os.path.join(self.directory, key + '.lock')
+
+  def _try_lock(self, key):
+    path = self._lock_path(key)
+    try:
+      fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except OSError as e:
+      if e.errno != errno.EEXIST:
+        raise
+      try:
+        if time.time() - os.path.getmtime(path) > self.lock_timeout:
+          os.remove(path)
+      except OSError:
+        pass
+      return False
+    os.write(fd, str(os.getpid()).encode())
+    os.close(fd)
+    return True
+
+  def _compute_once(self, key, compute):
+    # Wait for another process computing the same key, or take its place
+    while not self._try_lock(key):
+      time.sleep(self.poll)
+      entry = self._read(key)
+      if entry is not None:
+        return entry, True
+    try:
+      entry = self._read(key)     # finished while we were waiting
+      if entry is not None:
+        return entry, True
+      entry = compute()
+      self.put(key, entry)
+      return entry, False
+    finally:
+      os.remove(self._lock_path(key))
+
+  def get_or_compute(self, key, compute):
+    entry = self.get(key)
+    if entry is not None:
+      return entry
+
+    with self.lock:
+      event = self.inflight.get(key)
+      owner = event is None
+      if owner:
+        event = self.inflight[key] = threading.Event()
+
+    if not owner:
+      event.wait()
+      entry = self._read(key)
+      if entry is None:
+        return self.get_or_compute(key, compute)     # the owner failed
+      with self.lock:
+        self.shared += 1
+      return entry
+
+    try:
+      entry, shared = self._compute_once(key, compute)
+      if shared:
+        with self.lock:
+          self.shared += 1
+      return entry
+    finally:
+      with self.lock:
+        del self.inflight[key]
+      event.set()
+
+  def stats(self):
+    entries = self._entries()
+    return {
+      'hits' : self.hits,
+      'misses' : self.misses,
+      'hit_rate' : self.hit_rate,
+      'shared' : self.shared,
+      'evictions' : self.evictions,
+      'entries' : len(entries),
+      'bytes' : sum(size for _, size, _ in entries)
+    }
@@ -0,0 +1,335 @@
+import argparse
+import collections
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from cache import FeatureCache, ResultCache, job_fingerprint
+from transfer import Transfer, CONTENT_LAYERS, STYLE_LAYERS
+
+###########################################################
+# Distributed workers.
+#
+# A coordinator enqueues content x style jobs into a JobQueue. Workers on
+# any node claim jobs, run them on Transfers they keep warm between jobs
+# and publish the results and heartbeats back to the queue. Jobs whose
+# worker stops sending heartbeats are put back in the queue.
+#
+# Workers share a directory (e.g. on NFS) holding the style grams and
+# content features (a write-through FeatureCache) and the output images (a
+# ResultCache), so no node recomputes another node's work.
+###########################################################
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+DEFAULT_JOB = {
+  'style_weights' : None,
+  'width' : 240,
+  'height' : 240,
+  'alpha' : 1,
+  'beta' : 1e3,
+  'params' : {'type' : 'lbfgs', 'factr' : 4e14}
+}
+
+
+class JobQueue:
+  '''
+    Interface of the queue backends. Jobs are JSON-serializable dicts.
+  '''
+
+  def enqueue(self, job):
+    '''Adds a job and returns its id.'''
+    raise NotImplementedError
+
+  def claim(self, worker):
+    '''Marks the oldest queued job as running on worker and returns
+       (job_id, job), or None if the queue is empty.'''
+    raise NotImplementedError
+
+  def heartbeat(self, worker, job_id = None):
+    raise NotImplementedError
+
+  def complete(self, job_id, result):
+    raise NotImplementedError
+
+  def fail(self, job_id, error):
+    raise NotImplementedError
+
+  def requeue_stale(self, timeout, max_attempts = 3):
+    '''Puts running jobs without a heartbeat for 'timeout' seconds back in
+       the queue, or fails them after max_attempts. Returns how many.'''
+    raise NotImplementedError
+
+  def counts(self):
+    '''Number of jobs by state.'''
+    raise NotImplementedError
+
+
+class SQLiteQueue(JobQueue):
+  '''
+    JobQueue in a SQLite database. Safe to share between processes on one
+    node, or between nodes on a filesystem with working locks.
+  '''
+
+  def __init__(self, path, timeout = 30):
+    self.path = path
+    self.timeout = timeout
+    self.local = threading.local()
+    with self._connect() as db:
+      db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                      id TEXT PRIMARY KEY, job TEXT, state TEXT, worker TEXT,
+                      attempts INTEGER DEFAULT 0, created REAL, heartbeat REAL,
+                      result TEXT, error TEXT)''')
+      db.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created)')
+      db.execute('''CREATE TABLE IF NOT EXISTS workers (
+                      worker TEXT PRIMARY KEY, heartbeat REAL, job TEXT)''')
+
+  def _connect(self):
+    # One connection per thread; heartbeats come from a background thread
+    db = getattr(self.local, 'db', None)
+    if db is None:
+      db = sqlite3.connect(self.path, timeout = self.timeout,
+                           isolation_level = 'IMMEDIATE')
+      self.local.db = db
+    return db
+
+  def enqueue(self, job):
+    job_id = uuid.uuid4().hex
+    with self._connect() as db:
+      db.execute('INSERT INTO jobs (id, job, state, created) VALUES (?, ?, ?, ?)',
+                 (job_id, json.dumps(job, sort_keys = True), QUEUED, time.time()))
+    return job_id
+
+  def claim(self, worker):
+    while True:
+      with self._connect() as db:
+        row = db.execute('SELECT id, job FROM jobs WHERE state = ? ORDER BY created LIMIT 1',
+                         (QUEUED,)).fetchone()
+        if row is None:
+          return None
+        # Another worker may have claimed it since the select
+        claimed = db.execute('''UPDATE jobs SET state = ?, worker = ?, heartbeat = ?,
+                                attempts = attempts + 1 WHERE id = ? AND state = ?''',
+                             (RUNNING, worker, time.time(), row[0], QUEUED)).rowcount
+      if claimed:
+        return row[0], json.loads(row[1])
+
+  def heartbeat(self, worker, job_id = None):
+    now = time.time()
+    with self._connect() as db:
+      db.execute('INSERT OR REPLACE INTO workers (worker, heartbeat, job) VALUES (?, ?, ?)',
+                 (worker, now, job_id))
+      if job_id is not None:
+        db.execute('UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?',
+                   (now, job_id, worker))
+
+  def complete(self, job_id, result):
+    with self._connect() as db:
+      db.execute('UPDATE jobs SET state = ?, result = ? WHERE id = ?',
+                 (DONE, json.dumps(result), job_id))
+
+  def fail(self, job_id, error):
+    with self._connect() as db:
+      db.execute('UPDATE jobs SET state = ?, error = ? WHERE id = ?',
+                 (FAILED, str(error), job_id))
+
+  def requeue_stale(self, timeout, max_attempts = 3):
+    cutoff = time.time() - timeout
+    with self._connect() as db:
+      failed = db.execute('''UPDATE jobs SET state = ?, error = 'worker lost'
+                             WHERE state = ? AND heartbeat < ? AND attempts >= ?''',
+                          (FAILED, RUNNING, cutoff, max_attempts)).rowcount
+      requeued = db.execute('''UPDATE jobs SET state = ?, worker = NULL
+                               WHERE state = ? AND heartbeat < ?''',
+                            (QUEUED, RUNNING, cutoff)).rowcount
+    return requeued + failed
+
+  def counts(self):
+    rows = self._connect().execute('SELECT state, COUNT(*) FROM jobs GROUP BY state')
+    counts = dict((state, 0) for state in (QUEUED, RUNNING, DONE, FAILED))
+    counts.update(dict(rows.fetchall()))
+    return counts
+
+  def results(self):
+    rows = self._connect().execute('SELECT id, job, result FROM jobs WHERE state = ?', (DONE,))
+    return [(job_id, json.loads(job), json.loads(result)) for job_id, job, result in rows]
+
+
+def open_queue(url):
+  '''
+    The queue backend for 'url'. Only sqlite:///path/to/db is built in;
+    other backends implement JobQueue.
+  '''
+  if url.startswith('sqlite:///'):
+    return SQLiteQueue(url[len('sqlite:///'):])
+  raise ValueError('Unknown queue ' + url)
+
+
+def enqueue_grid(queue, contents, styles, **job):
+  '''
+    Enqueues one job per content x style pair. Keyword arguments override
+    DEFAULT_JOB. Returns the job ids.
+  '''
+  ids = []
+  for content in contents:
+    for style in styles:
+      spec = dict(DEFAULT_JOB)
+      spec.update(job)
+      spec.update({'content' : content, 'style' : style})
+      ids.append(queue.enqueue(spec))
+  return ids
+
+
+class Worker:
+  '''
+    Runs jobs from 'queue', keeping up to 'max_engines' Transfers (one per
+    image size, least recently used evicted first) warm between jobs. Results, style grams and content
+    features go to the shared directory 'shared_dir'.
+  '''
+
+  def __init__(self, queue, shared_dir, name = None, heartbeat_every = 10,
+               stale_after = 60, max_engines = 2, cache_mb = 512, **transfer_args):
+    self.queue = queue
+    self.shared_dir = shared_dir
+    self.name = name or '{}-{}'.format(socket.gethostname(), os.getpid())
+    self.heartbeat_every = heartbeat_every
+    self.stale_after = stale_after
+    self.max_engines = max_engines
+    self.transfer_args = transfer_args
+    self.engines = collections.OrderedDict()
+    self.jobs_done = 0
+
+    self.features = FeatureCache(cache_mb * 2 ** 20, os.path.join(shared_dir, 'features'),
+                                 write_through = True)
+    self.results = ResultCache(os.path.join(shared_dir, 'results'))
+
+    self.job_id = None
+    self.stopped = threading.Event()
+
+  def engine(self, width, height):
+    key = (width, height)
+    if key in self.engines:
+      self.engines[key] = self.engines.pop(key)     # mark most recently used
+    else:
+      if len(self.engines) >= self.max_engines:
+        self.engines.popitem(last = False)[1].close()
+      self.engines[key] = Transfer(None, None, width, height, display = False,
+                                   feature_cache = self.features, **self.transfer_args)
+    return self.engines[key]
+
+  def _beat(self):
+    while not self.stopped.wait(self.heartbeat_every):
+      try:
+        self.queue.heartbeat(self.name, self.job_id)
+      except Exception as e:
+        print('Heartbeat failed: {}'.format(e))
+
+  def run_job(self, job_id, job):
+    transfer = self.engine(job['width'], job['height'])
+    transfer.set_style(job['style'], job['style_weights'])
+    transfer.set_content(job['content'])
+    transfer.synthetic = transfer.content
+
+    out_dir = os.path.join(self.shared_dir, 'outputs', job_id)
+    if not os.path.isdir(out_dir):
+      os.makedirs(out_dir)
+    params = dict(job['params'])
+    params.setdefault('verbose', False)
+    if params.get('type') == 'lbfgs':
+      return transfer.transfer_style_to_image_lbfgs(out_dir, job['alpha'], job['beta'], params)
+    return transfer.transfer_style_to_image(out_dir, job['alpha'], job['beta'], params)
+
+  def process(self, job_id, job):
+    start = time.time()
+    fingerprint = job_fingerprint(job['content'], job['style'], job['width'], job['height'],
+                                  self.transfer_args.get('content_layers', CONTENT_LAYERS),
+                                  self.transfer_args.get('style_layers', STYLE_LAYERS),
+                                  job['style_weights'],
+                                  dict(job['params'], alpha = job['alpha'], beta = job['beta'],
+                                       backbone = self.transfer_args.get('backbone', 'vgg19')))
+    computed = []
+    def compute():
+      computed.append(True)
+      return self.run_job(job_id, job)
+    self.results.get_or_compute(fingerprint, compute)
+    return {
+      'worker' : self.name,
+      'fingerprint' : fingerprint,
+      'result' : self.results.path(fingerprint),
+      'cached' : not computed,
+      'seconds' : time.time() - start
+    }
+
+  def run(self, poll = 1.0, exit_when_empty = False):
+    beat = threading.Thread(target = self._beat)
+    beat.daemon = True
+    beat.start()
+    try:
+      while True:
+        self.queue.requeue_stale(self.stale_after)
+        claimed = self.queue.claim(self.name)
+        if claimed is None:
+          if exit_when_empty:
+            break
+          time.sleep(poll)
+          continue
+
+        self.job_id, job = claimed
+        self.queue.heartbeat(self.name, self.job_id)
+        try:
+          result = self.process(self.job_id, job)
+          self.queue.complete(self.job_id, result)
+          self.jobs_done += 1
+          print('{} done in {:.1f}s{}'.format(self.job_id, result['seconds'],
+                ' (cached)' if result['cached'] else ''))
+        except Exception as e:
+          self.queue.fail(self.job_id, e)
+          print('{} failed: {}'.format(self.job_id, e))
+        self.job_id = None
+    finally:
+      self.stopped.set()
+      for transfer in self.engines.values():
+        transfer.close()
+
+  def stats(self):
+    return {
+      'jobs' : self.jobs_done,
+      'features' : self.features.stats(),
+      'results' : self.results.stats()
+    }
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Distributed style transfer.')
+  parser.add_argument('--queue', default='sqlite:///jobs.db')
+  subparsers = parser.add_subparsers(dest='command')
+
+  enqueue = subparsers.add_parser('enqueue', help='enqueue content x style jobs')
+  enqueue.add_argument('--content', nargs='+', required=True)
+  enqueue.add_argument('--style', nargs='+', required=True)
+  enqueue.add_argument('--width', type=int, default=DEFAULT_JOB['width'])
+  enqueue.add_argument('--height', type=int, default=DEFAULT_JOB['height'])
+
+  worker = subparsers.add_parser('worker', help='run jobs from the queue')
+  worker.add_argument('--shared-dir', required=True,
+                      help='directory shared by all workers for grams, features and results')
+  worker.add_argument('--exit-when-empty', action='store_true')
+
+  subparsers.add_parser('status', help='count jobs by state')
+  args = parser.parse_args()
+
+  queue = open_queue(args.queue)
+  if args.command == 'enqueue':
+    ids = enqueue_grid(queue, args.content, args.style, width = args.width,
+                       height = args.height)
+    print('Enqueued {} jobs'.format(len(ids)))
+  elif args.command == 'worker':
+    w = Worker(queue, args.shared_dir)
+    w.run(exit_when_empty = args.exit_when_empty)
+    print(w.stats())
+  else:
+    print(queue.counts())
@@ -1,6 +1,3 @@
-import skimage
-import skimage.io
-import skimage.transform
 import numpy as np
 
 
@@ -10,6 +7,9 @@ import numpy as np
 # returns image of shape [224, 224, 3]
 # [height, width, depth]
 def load_image(path):
+    import skimage.io
+    import skimage.transform
+
     # load image
     img = skimage.io.imread(path)
     img = img / 255.0
@@ -42,6 +42,9 @@ def print_prob(prob, file_path):
 
 
 def load_image2(path, height=None, width=None):
+    import skimage.io
+    import skimage.transform
+
     # load image
     img = skimage.io.imread(path)
     img = img / 255.0
@@ -61,6 +64,9 @@ def load_image2(path, height=None, width=None):
 
 
 def test():
+    import skimage.io
+    import skimage.transform
+
     img = skimage.io.imread("./test_data/starry_night.jpg")
     ny = 300
     nx = img.shape[1] * ny / img.shape[0]
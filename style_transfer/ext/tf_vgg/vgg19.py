@@ -1,15 +1,82 @@
 import os
-import tensorflow as tf
 
 import numpy as np
 import time
 import inspect
 
+try:
+    # defer importing tensorflow until a graph is built
+    from lazy import lazy_import
+    tf = lazy_import('tensorflow')
+except ImportError:
+    import tensorflow as tf
+
 VGG_MEAN = [103.939, 116.779, 123.68]
 
 
+# Feature layers in the order they are applied
+LAYERS = (
+    'conv1_1', 'conv1_2', 'pool1',
+    'conv2_1', 'conv2_2', 'pool2',
+    'conv3_1', 'conv3_2', 'conv3_3', 'conv3_4', 'pool3',
+    'conv4_1', 'conv4_2', 'conv4_3', 'conv4_4', 'pool4',
+    'conv5_1', 'conv5_2', 'conv5_3', 'conv5_4', 'pool5',
+)
+
+PRECISIONS = ('float32', 'bfloat16')
+
+
+def receptive_field(layer, layers=LAYERS):
+    """
+    Size in pixels of the input window that one position of layer depends on
+    """
+    size, stride = 1, 1
+    for name in layers:
+        if name.startswith('pool'):
+            size += stride
+            stride *= 2
+        else:
+            size += 2 * stride
+        if name == layer:
+            return size
+    raise ValueError('Unknown layer ' + str(layer))
+
+
+def bfloat16_supported():
+    """
+    Returns True if this TensorFlow build has CPU conv kernels for bfloat16
+    """
+    graph = tf.Graph()
+    try:
+        # Builds whose op definitions do not allow bfloat16 fail while the
+        # graph is constructed, the others when the kernels are looked up
+        with graph.as_default():
+            x = tf.ones([1, 4, 4, 1], dtype=tf.bfloat16)
+            filt = tf.ones([3, 3, 1, 1], dtype=tf.bfloat16)
+            y = tf.nn.conv2d(x, filt, [1, 1, 1, 1], padding='SAME')
+            y = tf.nn.avg_pool(tf.nn.relu(y), ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME')
+            grad = tf.gradients(y, x)[0]
+        with tf.Session(graph=graph) as sess:
+            sess.run([y, grad])
+        return True
+    except (TypeError, ValueError, tf.errors.InvalidArgumentError, tf.errors.NotFoundError):
+        return False
+
+
 class Vgg19:
-    def __init__(self, vgg19_npy_path=None):
+    # Layers build() creates; subclasses with other architectures override it
+    layers = LAYERS
+
+    def __init__(self, vgg19_npy_path=None, precision='float32'):
+        """
+        :param precision: 'float32', or 'bfloat16' to run the convolutions
+            in bfloat16. The layer tensors exposed on the object are always
+            float32.
+        """
+        if precision not in PRECISIONS:
+            raise ValueError('Unknown precision ' + str(precision))
+        self.precision = precision
+
         if vgg19_npy_path is None:
             path = inspect.getfile(Vgg19)
             path = os.path.abspath(os.path.join(path, os.pardir))
@@ -24,42 +91,113 @@ class Vgg19:
         """
         load variable from npy to build the VGG
 
-        :param rgb: rgb image [batch, height, width, 3] values scaled [0, 1]
+        :param bgr: bgr image [batch, height, width, 3] with VGG_MEAN subtracted
         """
 
         start_time = time.time()
         print("build model started")
-       
-        self.conv1_1 = self.conv_layer(bgr, "conv1_1")
-
-        self.conv1_2 = self.conv_layer(self.conv1_1, "conv1_2")
-        self.pool1 = self.avg_pool(self.conv1_2, 'pool1')
-
-        self.conv2_1 = self.conv_layer(self.pool1, "conv2_1")
-        self.conv2_2 = self.conv_layer(self.conv2_1, "conv2_2")
-        self.pool2 = self.avg_pool(self.conv2_2, 'pool2')
-
-        self.conv3_1 = self.conv_layer(self.pool2, "conv3_1")
-        self.conv3_2 = self.conv_layer(self.conv3_1, "conv3_2")
-        self.conv3_3 = self.conv_layer(self.conv3_2, "conv3_3")
-        self.conv3_4 = self.conv_layer(self.conv3_3, "conv3_4")
-        self.pool3 = self.avg_pool(self.conv3_4, 'pool3')
-
-        self.conv4_1 = self.conv_layer(self.pool3, "conv4_1")
-        self.conv4_2 = self.conv_layer(self.conv4_1, "conv4_2")
-        self.conv4_3 = self.conv_layer(self.conv4_2, "conv4_3")
-        self.conv4_4 = self.conv_layer(self.conv4_3, "conv4_4")
-        self.pool4 = self.avg_pool(self.conv4_4, 'pool4')
-
-        self.conv5_1 = self.conv_layer(self.pool4, "conv5_1")
-        self.conv5_2 = self.conv_layer(self.conv5_1, "conv5_2")
-        self.conv5_3 = self.conv_layer(self.conv5_2, "conv5_3")
-        self.conv5_4 = self.conv_layer(self.conv5_3, "conv5_4")
-        self.pool5 = self.avg_pool(self.conv5_4, 'pool5')
+
+        self.weight_bytes = 0
+        self.weights = {}
+
+        # Layers in the precision the convolutions run in
+        self.internal = {}
+        self.input = bgr
+        x = bgr
+        if self.precision == 'bfloat16':
+            x = tf.cast(x, tf.bfloat16)
+        self.internal_input = x
+
+        for name in self.layers:
+            x = self.layer(x, name)
+            self.internal[name] = x
+
+            # Losses are accumulated in float32 whatever the conv precision
+            setattr(self, name, self.to_float32(x))
 
         self.data_dict = None
         print(("build model finished: %ds" % (time.time() - start_time)))
 
+    @classmethod
+    def map_layer(cls, name):
+        """
+        This network's layer for a VGG19 layer name
+        """
+        if name not in cls.layers:
+            raise ValueError('Unknown layer ' + str(name))
+        return name
+
+    def layer(self, bottom, name):
+        if name.startswith('pool'):
+            return self.avg_pool(bottom, name)
+        return self.conv_layer(bottom, name)
+
+    def to_float32(self, x):
+        if x.dtype != tf.float32:
+            return tf.cast(x, tf.float32)
+        return x
+
+    def segments(self, checkpoint_every=1):
+        """
+        Splits self.layers into runs that end at every checkpoint_every-th pool
+        """
+        segments = [[]]
+        pools = 0
+        for name in self.layers:
+            segments[-1].append(name)
+            if name.startswith('pool'):
+                pools += 1
+                if pools % checkpoint_every == 0:
+                    segments.append([])
+        return [s for s in segments if s]
+
+    def checkpointed_gradient(self, loss, checkpoint_every=1):
+        """
+        Gradient of loss with respect to the input image that only keeps the
+        activations at segment boundaries (see segments) alive. The layers
+        inside a segment are recomputed from its input during the backward
+        pass, once the gradient flowing into the segment is available.
+
+        Larger checkpoint_every keeps fewer boundaries but recomputes longer
+        segments. loss must depend on the input only through the VGG layers.
+        """
+        exposed = [self[name] for name in self.layers]
+
+        # Partial derivatives of loss with respect to each layer, not
+        # counting the paths through the deeper layers
+        direct = dict(zip(self.layers, tf.gradients(loss, exposed, stop_gradients=exposed)))
+
+        segments = self.segments(checkpoint_every)
+        inputs = [self.internal_input] + [self.internal[s[-1]] for s in segments[:-1]]
+
+        dy = None
+        for segment, x in reversed(list(zip(segments, inputs))):
+            grads = [direct[name] for name in segment]
+            deps = [g for g in grads + [dy] if g is not None]
+            if not deps:
+                continue        # nothing in or after this segment is used
+
+            # Delay the recomputation until the backward pass reaches it
+            with tf.control_dependencies(deps):
+                y = tf.identity(x)
+            x_recomputed = y
+
+            ys = []
+            grad_ys = []
+            for name, g in zip(segment, grads):
+                y = self.layer(y, name)
+                if g is not None:
+                    ys.append(self.to_float32(y))
+                    grad_ys.append(g)
+            if dy is not None:
+                ys.append(y)
+                grad_ys.append(dy)
+            dy = tf.gradients(ys, x_recomputed, grad_ys=grad_ys)[0]
+
+        if dy is None:
+            return tf.zeros_like(self.input)
+        return tf.cast(dy, self.input.dtype)
+
     def avg_pool(self, bottom, name):
         return tf.nn.avg_pool(bottom, ksize=[1, 2, 2, 1], strides=[1, 2, 2, 1], padding='SAME', name=name)
 
@@ -68,11 +206,14 @@ class Vgg19:
 
     def conv_layer(self, bottom, name):
         with tf.variable_scope(name):
-            filt = self.get_conv_filter(name)
+            # Keep the constants so the layer can be rebuilt after data_dict
+            # is released
+            if name not in self.weights:
+                self.weights[name] = (self.get_conv_filter(name), self.get_bias(name))
+            filt, conv_biases = self.weights[name]
 
             conv = tf.nn.conv2d(bottom, filt, [1, 1, 1, 1], padding='SAME')
 
-            conv_biases = self.get_bias(name)
             bias = tf.nn.bias_add(conv, conv_biases)
 
             relu = tf.nn.relu(bias)
@@ -95,11 +236,26 @@ class Vgg19:
 
             return fc
 
+    def constant(self, value, name, dtype=None):
+        """
+        A weight constant, counted in weight_bytes at the size it is stored
+        in the graph
+        """
+        const = tf.constant(value, dtype=dtype, name=name)
+        self.weight_bytes += const.dtype.size * const.get_shape().num_elements()
+        return const
+
     def get_conv_filter(self, name):
-        return tf.constant(self.data_dict[name][0], name="filter")
+        filt = self.data_dict[name][0]
+        if self.precision == 'bfloat16':
+            return self.constant(filt, "filter", tf.bfloat16)
+        return self.constant(filt, "filter")
 
     def get_bias(self, name):
-        return tf.constant(self.data_dict[name][1], name="biases")
+        bias = self.data_dict[name][1]
+        if self.precision == 'bfloat16':
+            return self.constant(bias, "biases", tf.bfloat16)
+        return self.constant(bias, "biases")
 
     def get_fc_weight(self, name):
         return tf.constant(self.data_dict[name][0], name="weights")
@@ -0,0 +1,270 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from ext.tf_vgg import vgg19, utils
+from lazy import lazy_import
+from transfer import gram_matrix, content_loss, style_loss, NUM_CHANNELS
+
+io = lazy_import('skimage.io')
+tf = lazy_import('tensorflow')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def _rgb(image):
+  '''
+    [height, width, 3] from a grayscale (with or without alpha), RGB or RGBA
+    image.
+  '''
+  if image.ndim == 2:
+    image = image[:, :, np.newaxis]
+  if image.shape[2] < NUM_CHANNELS:
+    image = np.repeat(image[:, :, :1], NUM_CHANNELS, axis = 2)
+  return image[:, :, :NUM_CHANNELS]
+
+
+###########################################################
+# Image transformation network
+#
+# Follows Johnson et al., "Perceptual Losses for Real-Time Style Transfer and
+# Super-Resolution", ECCV 2016, with instance normalization and
+# nearest-neighbour upsampling in place of transposed convolutions.
+###########################################################
+
+def _conv(x, name, filters, size, stride = 1, relu = True):
+  with tf.variable_scope(name):
+    channels = x.get_shape().as_list()[3]
+    weights = tf.get_variable('weights', [size, size, channels, filters],
+                              initializer = tf.truncated_normal_initializer(stddev = 0.1))
+    x = tf.nn.conv2d(x, weights, [1, stride, stride, 1], padding = 'SAME')
+    x = _instance_norm(x, filters)
+    return tf.nn.relu(x) if relu else x
+
+
+def _instance_norm(x, channels):
+  mean, var = tf.nn.moments(x, [1, 2], keep_dims = True)
+  scale = tf.get_variable('scale', [channels], initializer = tf.ones_initializer())
+  shift = tf.get_variable('shift', [channels], initializer = tf.zeros_initializer())
+  return scale * (x - mean) / tf.sqrt(var + 1e-5) + shift
+
+
+def _residual(x, name, filters):
+  with tf.variable_scope(name):
+    y = _conv(x, 'conv1', filters, 3)
+    y = _conv(y, 'conv2', filters, 3, relu = False)
+    return x + y
+
+
+def _upsample(x, name, filters):
+  shape = tf.shape(x)
+  x = tf.image.resize_nearest_neighbor(x, [2 * shape[1], 2 * shape[2]])
+  return _conv(x, name, filters, 3)
+
+
+def transform_net(rgb):
+  '''
+    Maps an RGB batch in [0, 1] to a stylized RGB batch in [0, 1].
+  '''
+  with tf.variable_scope('transform'):
+    x = _conv(rgb, 'conv1', 32, 9)
+    x = _conv(x, 'conv2', 64, 3, 2)
+    x = _conv(x, 'conv3', 128, 3, 2)
+    for i in range(5):
+      x = _residual(x, 'residual{}'.format(i + 1), 128)
+    x = _upsample(x, 'up1', 64)
+    x = _upsample(x, 'up2', 32)
+    x = _conv(x, 'conv4', NUM_CHANNELS, 9, relu = False)
+    return tf.nn.sigmoid(x)
+
+
+def to_bgr(rgb):
+  # Tensor version of Vgg19.toBGR
+  red, green, blue = tf.split(rgb * 255, 3, axis = 3)
+  return tf.concat([blue - vgg19.VGG_MEAN[0],
+                    green - vgg19.VGG_MEAN[1],
+                    red - vgg19.VGG_MEAN[2]], axis = 3)
+
+
+def _variables():
+  return tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope = 'transform')
+
+
+###########################################################
+# Training
+###########################################################
+
+class FastStyleTrainer:
+  '''
+    Trains a transformation network for one style image against the same
+    VGG19 content and gram losses that Transfer optimizes per image.
+  '''
+
+  def __init__(self, style, size = 256, batch_size = 4, alpha = 1, beta = 1e3,
+               tv_weight = 1e-2, learning_rate = 1e-3,
+               content_layers = ["conv4_2"],
+               style_layers = ["conv1_1","conv2_1",
+                               "conv3_1","conv4_1",
+                               "conv5_1"]):
+    self.size = size
+    self.batch_size = batch_size
+
+    self.graph = tf.Graph()
+    self.sess = tf.Session(graph = self.graph)
+
+    with self.graph.as_default():
+      self.content = tf.placeholder('float', [batch_size, size, size, NUM_CHANNELS])
+      self.output = transform_net(self.content)
+
+      # Run the output and the content through one VGG by stacking them
+      self.images = tf.concat([to_bgr(self.output), to_bgr(self.content)], axis = 0)
+      self.vgg = vgg19.Vgg19()
+      self.vgg.build(self.images)
+
+      output_features = {}
+      target_features = {}
+      for layer in content_layers:
+        output_features[layer], target = tf.split(self.vgg[layer], 2, axis = 0)
+        target_features[layer] = tf.stop_gradient(target)
+
+      # The style targets come from feeding the style image straight into
+      # the stacked VGG input
+      grams = [gram_matrix(self.vgg[layer]) for layer in style_layers]
+      style_image = utils.load_image2(style, size, size).reshape((1, size, size, NUM_CHANNELS))
+      style_image = np.repeat(self.vgg.toBGR(style_image), 2 * batch_size, axis = 0)
+      targets = self.sess.run(grams, {self.images : style_image})
+      output_grams = [G[:batch_size] for G in grams]
+
+      dy = self.output[:, 1:, :, :] - self.output[:, :-1, :, :]
+      dx = self.output[:, :, 1:, :] - self.output[:, :, :-1, :]
+      tv_loss = tf.reduce_mean(tf.square(dy)) + tf.reduce_mean(tf.square(dx))
+
+      self.content_loss = content_loss(output_features, target_features, content_layers)
+      self.style_loss = style_loss(output_grams, [T[0] for T in targets])
+      self.loss = alpha * self.content_loss + beta * self.style_loss \
+                  + tv_weight * tv_loss
+
+      self.train_step = tf.train.AdamOptimizer(learning_rate).minimize(
+          self.loss, var_list = _variables())
+      self.sess.run(tf.global_variables_initializer())
+
+  def _batches(self, content_dir, epochs):
+    paths = sorted(os.path.join(content_dir, f) for f in os.listdir(content_dir)
+                   if f.lower().endswith(IMAGE_EXTENSIONS))
+    for _ in range(epochs):
+      np.random.shuffle(paths)
+      for i in range(0, len(paths) - self.batch_size + 1, self.batch_size):
+        yield np.stack([_rgb(utils.load_image2(p, self.size, self.size))
+                        for p in paths[i:i + self.batch_size]])
+
+  def train(self, content_dir, epochs = 2, log_every = 100):
+    start = time.time()
+    for step, batch in enumerate(self._batches(content_dir, epochs)):
+      _, loss, c_loss, s_loss = self.sess.run(
+          [self.train_step, self.loss, self.content_loss, self.style_loss],
+          {self.content : batch})
+      if step % log_every == 0:
+        print('Step {} ({:.0f}s): loss = {}, content = {}, style = {}'.format(
+              step, time.time() - start, loss, c_loss, s_loss))
+
+  def save(self, path):
+    values = self.sess.run(_variables())
+    np.savez(path, **dict((v.name, value) for v, value in zip(_variables(), values)))
+
+
+###########################################################
+# Inference
+###########################################################
+
+class FastStyle:
+  '''
+    A trained transformation network. Stylizes an image of any size with a
+    single forward pass.
+  '''
+
+  def __init__(self, path):
+    self.graph = tf.Graph()
+    self.sess = tf.Session(graph = self.graph)
+    with self.graph.as_default():
+      self.image = tf.placeholder('float', [1, None, None, NUM_CHANNELS])
+      self.output = transform_net(self.image)
+      weights = np.load(path)
+      for v in _variables():
+        v.load(weights[v.name], self.sess)
+      self.graph.finalize()
+
+  def stylize(self, image):
+    '''
+      image is an RGB array in [0, 1] or a path. Returns an RGB array.
+    '''
+    if not isinstance(image, np.ndarray):
+      image = utils.load_image2(image)
+    image = _rgb(image)
+
+    # The two stride 2 convolutions need sides divisible by 4
+    image = image[:image.shape[0] // 4 * 4, :image.shape[1] // 4 * 4]
+    return self.sess.run(self.output, {self.image : image[np.newaxis]})[0]
+
+
+class StyleRegistry:
+  '''
+    Per-style weights saved as '<name>.npz' in a directory, loaded on first
+    use and kept warm afterwards.
+  '''
+
+  def __init__(self, model_dir):
+    self.model_dir = model_dir
+    self.models = {}
+
+  def available(self):
+    return sorted(f[:-len('.npz')] for f in os.listdir(self.model_dir)
+                  if f.endswith('.npz'))
+
+  def path(self, name):
+    return os.path.join(self.model_dir, name + '.npz')
+
+  def get(self, name):
+    if name not in self.models:
+      self.models[name] = FastStyle(self.path(name))
+    return self.models[name]
+
+  def stylize(self, name, image):
+    return self.get(name).stylize(image)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Train or run a feed-forward style network.')
+  subparsers = parser.add_subparsers(dest='command')
+
+  train = subparsers.add_parser('train')
+  train.add_argument('style', help='style image')
+  train.add_argument('content_dir', help='directory of training content images')
+  train.add_argument('model_dir', help='directory to save the weights to')
+  train.add_argument('--size', type=int, default=256)
+  train.add_argument('--batch-size', type=int, default=4)
+  train.add_argument('--epochs', type=int, default=2)
+
+  stylize = subparsers.add_parser('stylize')
+  stylize.add_argument('model_dir')
+  stylize.add_argument('name', help='style name, i.e. the weights file without .npz')
+  stylize.add_argument('content', help='content image')
+  stylize.add_argument('output', help='output image')
+  args = parser.parse_args()
+
+  if args.command == 'train':
+    trainer = FastStyleTrainer(args.style, args.size, args.batch_size)
+    trainer.train(args.content_dir, args.epochs)
+    name = os.path.splitext(os.path.basename(args.style))[0]
+    trainer.save(StyleRegistry(args.model_dir).path(name))
+
+  elif args.command == 'stylize':
+    registry = StyleRegistry(args.model_dir)
+    model = registry.get(args.name)
+    image = utils.load_image2(args.content)
+    model.stylize(image)      # first run allocates the buffers
+    start = time.time()
+    out = model.stylize(image)
+    print('Stylized in {:.1f} ms'.format(1000 * (time.time() - start)))
+    io.imsave(args.output, out)
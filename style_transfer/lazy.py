@@ -0,0 +1,24 @@
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+  '''
+    Placeholder for a module that is imported on first attribute access.
+    After that the real module's attributes are copied in, so later lookups
+    cost the same as on the module itself.
+  '''
+
+  def __getattr__(self, attr):
+    # Only called for attributes not found normally, i.e. before loading
+    module = importlib.import_module(self.__name__)
+    self.__dict__.update(module.__dict__)
+    return getattr(module, attr)
+
+
+def lazy_import(name):
+  '''
+    tf = lazy_import('tensorflow') defers importing tensorflow until tf is
+    first used. Use it for heavy modules that not every entry point needs.
+  '''
+  return LazyModule(name)
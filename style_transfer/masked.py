@@ -0,0 +1,152 @@
+import numpy as np
+
+import backbones
+from ext.tf_vgg import vgg19
+from lazy import lazy_import
+from transfer import Transfer, CONTENT_LAYERS, STYLE_LAYERS
+
+io = lazy_import('skimage.io')
+tf = lazy_import('tensorflow')
+
+###########################################################
+# Masked transfer.
+#
+# Only the pixels inside the mask are optimized; the rest of the frame keeps
+# the content. The graph is built for the mask's bounding box, padded by
+# half the receptive field of the deepest layer used so that the border of
+# the region sees the same context as in the full frame. Compute therefore
+# scales with the region, not with the frame.
+###########################################################
+
+
+def _unit_scale(image):
+  # Integer images are scaled by the range of their type, floats are taken
+  # to be in [0, 1] already
+  if np.issubdtype(image.dtype, np.integer):
+    return np.asarray(image, dtype = np.float32) / np.iinfo(image.dtype).max
+  return np.asarray(image, dtype = np.float32)
+
+
+def load_rgb(image):
+  '''
+    An RGB array in [0, 1] from a path or an array. Grayscale images are
+    repeated over the channels and alpha is dropped.
+  '''
+  if not isinstance(image, np.ndarray):
+    image = io.imread(image)
+  image = _unit_scale(image)
+  if image.ndim == 2:
+    image = image[:, :, np.newaxis]
+  image = image.reshape(image.shape[-3:])
+  if image.shape[2] < 3:
+    image = np.repeat(image[:, :, :1], 3, axis = 2)
+  return image[:, :, :3]
+
+
+def load_mask(mask):
+  '''
+    A [height, width] float mask in [0, 1] from a path or an array. Color
+    masks are averaged over their channels.
+  '''
+  if not isinstance(mask, np.ndarray):
+    mask = io.imread(mask)
+  mask = _unit_scale(mask)
+  if mask.ndim == 3:
+    mask = mask[:, :, :3].mean(axis = 2)
+  return mask
+
+
+def receptive_pad(layers, backbone = 'vgg19'):
+  network = backbones.backbone_class(backbone).layers
+  return max(vgg19.receptive_field(layer, network)
+             for layer in backbones.map_layers(backbone, layers)) // 2
+
+
+def bounding_box(mask, pad):
+  '''
+    (top, bottom, left, right) of the nonzero part of mask, grown by pad
+    pixels on every side and clipped to the frame.
+  '''
+  rows = np.flatnonzero(mask.any(axis = 1))
+  cols = np.flatnonzero(mask.any(axis = 0))
+  if len(rows) == 0:
+    raise ValueError('The mask is empty')
+  height, width = mask.shape
+  return (max(rows[0] - pad, 0), min(rows[-1] + 1 + pad, height),
+          max(cols[0] - pad, 0), min(cols[-1] + 1 + pad, width))
+
+
+def masked_gram_matrix(features, mask):
+  '''
+    Gram matrix of a single image's features over the masked positions only.
+    mask is [height, width] at the layer's resolution. Scaled by N / sum(mask)
+    so that it is comparable with the gram of a full image of N positions.
+  '''
+  num_feature = features.get_shape().as_list()[3]
+  A = tf.reshape(features, [-1, num_feature])
+  m = tf.reshape(mask, [-1, 1])
+  N = float(mask.get_shape().num_elements())
+  scale = N / tf.maximum(tf.reduce_sum(m), 1e-6)
+  return scale * tf.matmul(A * m, A, transpose_a = True)
+
+
+class MaskedTransfer(Transfer):
+  '''
+    Transfer restricted to mask. content is the full frame (path or RGB
+    array) and mask an array or image of the same size; soft masks blend
+    the result with the content. pad overrides the receptive field padding
+    of the crop. The remaining arguments are passed on to Transfer, whose
+    width and height become those of the crop.
+
+    Results (output_image, the saved images) are full frames.
+  '''
+
+  def __init__(self, style, content, mask, pad = None, **transfer_args):
+    if transfer_args.get('artifact') is not None:
+      raise ValueError('Artifacts are built for a fixed size and cannot be masked')
+
+    self.frame = load_rgb(content)
+    self.frame_mask = load_mask(mask)
+    if self.frame_mask.shape != self.frame.shape[:2]:
+      raise ValueError('Mask of shape {} does not match the content {}'.format(
+                       self.frame_mask.shape, self.frame.shape[:2]))
+
+    if pad is None:
+      pad = receptive_pad(transfer_args.get('content_layers', CONTENT_LAYERS)
+                          + transfer_args.get('style_layers', STYLE_LAYERS),
+                          transfer_args.get('backbone', 'vgg19'))
+    self.box = bounding_box(self.frame_mask > 0, pad)
+    top, bottom, left, right = self.box
+    self.mask = self.frame_mask[top:bottom, left:right]
+
+    Transfer.__init__(self, style, self.frame[top:bottom, left:right],
+                      bottom - top, right - left, **transfer_args)
+
+  def get_synthetic_gram_matrices(self):
+    # The synthetic grams only see the masked activations; the style
+    # targets stay the grams of the whole style image
+    grams = []
+    pixel_mask = tf.constant(self.mask[None, :, :, None])
+    for F in self.get_style_features():
+      shape = F.get_shape().as_list()[1:3]
+      grams.append(masked_gram_matrix(F, tf.image.resize_area(pixel_mask, shape)[0, :, :, 0]))
+    return grams
+
+  def _gradient(self, loss):
+    # Pixels outside the mask never move from the content
+    return Transfer._gradient(self, loss) * self.mask[None, :, :, None]
+
+  def fraction(self):
+    '''
+      Pixels in the crop relative to the full frame.
+    '''
+    top, bottom, left, right = self.box
+    return float((bottom - top) * (right - left)) / self.frame_mask.size
+
+  def output_image(self, image):
+    crop = Transfer.output_image(self, image)[0]
+    top, bottom, left, right = self.box
+    m = self.mask[:, :, None]
+    out = self.frame.copy()
+    out[top:bottom, left:right] = m * crop + (1 - m) * out[top:bottom, left:right]
+    return out[None]
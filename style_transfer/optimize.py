@@ -1,6 +1,7 @@
 import numpy as np
 import copy
-from scipy.optimize import fmin_l_bfgs_b
+import math
+import time
 
 class SGD:
   default_params = {
@@ -9,10 +10,22 @@ class SGD:
       'iters' : 10,
       'gamma' : 0,
       'eps' : 1e-6,
+      'beta1' : 0.9,
+      'beta2' : 0.999,
+      'lr_schedule' : None,
+      'schedule_iters' : None,
+      'lr_min' : 0.0,
+      'decay' : 0.5,
+      'decay_every' : 50,
+      'search_evals' : 6,
+      'search_factor' : 4.0,
+      'tol' : 0,
+      'verbose' : True,
       'name' : 'SGD',
       'init_display' : lambda *args: None,
       'update_display' : lambda *args: None,
-      'save' : lambda *args: None
+      'save' : lambda *args: None,
+      'record' : lambda *args: {}
     }
 
   required_params = ['theta', 'dJdTheta', 'J']
@@ -23,16 +36,29 @@ class SGD:
 
         name           : the name used on plots created and files saved
         type           : the type of stochastic gradient descent to use
-        step_size      : size of the update step
+        step_size      : size of the update step, or 'auto' to pick it with a
+                         short line search before the first iteration
         iterations     : how many iterations of SGD to perform 
         gamma          : used in momentum and nesterov variations of SGD
-        eps            : epsilon value used in adadelta
+        eps            : epsilon value used in adadelta and adam
+        beta1, beta2   : decay rates of adam's moment estimates
+        lr_schedule    : None, 'cosine' (anneal to lr_min * step_size over
+                         schedule_iters, default the end of the first call to
+                         optimize; resumed calls continue the same schedule) or 'step'
+                         (multiply by decay every decay_every iterations)
+        search_evals   : loss evaluations the 'auto' step size search may use
+        search_factor  : factor between the step sizes it tries
+        tol            : stop early once the relative change in loss between
+                         iterations falls below this value (0 disables)
+        verbose        : print the parameters when the optimizer is created
         theta          : the parameter that is being updated
         dJdTheta       : the gradient of the loss function with respect to theta (returns (grad, loss))
         J              : the loss function
         init_display   : a function that is called to initialize the display
         update_display : a function that given params displays the optimization problem in some way
         save           : a function that is passed params and saves the results somehow
+        record         : a function that given params returns extra values (e.g. loss
+                         terms) to add to this iteration's entry in params['metrics']
     '''
       
     for param in SGD.required_params:
@@ -43,22 +69,66 @@ class SGD:
     self.params.update(SGD.default_params)
     self.params.update(params)
     
-    for k, v in self.params.items():
-      print("{} = {}".format(k, v))
+    # Optimizer state carried between calls to optimize
+    self.state = {
+      'iter' : 0,
+      'loss' : [],
+      'update' : 0,
+      'grad_hist' : 0,
+      'update_hist' : 0,
+      'moment' : 0,
+      'adam_t' : 0,
+      'metrics' : []
+    }
+
+    if self.params['verbose']:
+      for k, v in self.params.items():
+        print("{} = {}".format(k, v))
 
 
   def optimize(self):
+    '''
+      Runs params['iters'] iterations. Calling optimize again resumes from
+      the current theta with the accumulated optimizer state, so a run can
+      be extended a few iterations at a time.
+    '''
+    self.state['interrupted'] = False
     try:
       params = copy.copy(self.params) 
-      params['loss'] = []
+      params['loss'] = self.state['loss']
+      params['iter'] = self.state['iter']
+      params['metrics'] = self.state['metrics']
       
-      update = 0
-      grad_hist = 0
-      update_hist = 0
+      update = self.state['update']
+      grad_hist = self.state['grad_hist']
+      update_hist = self.state['update_hist']
+      moment = self.state['moment']
+      adam_t = self.state['adam_t']
+
+      if params['step_size'] == 'auto' and params['type'] != 'adadelta':
+        if 'step_size' not in self.state:
+          self.state['step_size'] = self.search_step_size(params)
+          if params['verbose']:
+            print('step_size = {} ({} loss evaluations)'.format(
+                  self.state['step_size'], self.state['search_evals']))
+        params['step_size'] = self.state['step_size']
+      base_step = params['step_size']
 
       gradient, loss = (0,0)
       params['init_display'](params)
-      for i in range(1, params['iters'] + 1):
+      first = self.state['iter'] + 1
+      # Fixed on the first call, so that resumed runs follow the schedule of
+      # one continuous run
+      if 'schedule' not in self.state:
+        self.state['schedule'] = (self.state['iter'],
+                                  params['schedule_iters'] or params['iters'])
+      schedule_start, horizon = self.state['schedule']
+      for i in range(first, first + params['iters']):
+        start = time.time()
+        # adadelta has no step size to schedule
+        if params['lr_schedule'] is not None and params['type'] != 'adadelta':
+          params['step_size'] = base_step * self.schedule(params, i - schedule_start, horizon)
+
         # stochastic gradient descent
         if params['type'] == 'sgd':
           grad, loss = params['dJdTheta'](params['theta'])
@@ -103,22 +173,219 @@ class SGD:
                                           grad)
           update_hist = params['gamma'] * update_hist + (1.0 - params['gamma']) * np.square(update)
 
+        elif params['type'] == 'adam':
+          # Adam was implemented following this paper:
+          # https://arxiv.org/pdf/1412.6980.pdf
+          grad, loss = params['dJdTheta'](params['theta'])
+          moment = params['beta1'] * moment + (1.0 - params['beta1']) * grad
+          grad_hist = params['beta2'] * grad_hist + (1.0 - params['beta2']) * np.square(grad)
+          # Bias correction counts the steps since the moments were reset,
+          # not the iterations of earlier phases
+          adam_t += 1
+          m_hat = moment / (1.0 - params['beta1'] ** adam_t)
+          v_hat = grad_hist / (1.0 - params['beta2'] ** adam_t)
+          update = -params['step_size'] * m_hat / (np.sqrt(v_hat) + params['eps'])
+
+        else:
+          raise ValueError('Unknown optimizer type ' + str(params['type']))
+
         params['theta'] += update
         params['loss'].append(loss)
         params['iter'] = i
+        row = {
+          'iter' : i,
+          'loss' : float(loss),
+          'grad_norm' : float(np.linalg.norm(grad)),
+          'seconds' : time.time() - start
+        }
+        if params['type'] != 'adadelta':
+          row['step_size'] = float(params['step_size'])
+        row.update(params['record'](params))
+        params['metrics'].append(row)
+        self.state.update({
+          'iter' : i,
+          'update' : update,
+          'grad_hist' : grad_hist,
+          'update_hist' : update_hist,
+          'moment' : moment,
+          'adam_t' : adam_t
+        })
         
         params['update_display'](params)
+
+        if params['tol'] and len(params['loss']) > 1:
+          previous = params['loss'][-2]
+          if abs(previous - loss) <= params['tol'] * max(abs(previous), params['eps']):
+            break
       
       return params['save'](params)
     
     except KeyboardInterrupt:
+      # Saved like a finished run; optimize_phases stops at this phase
+      self.state['interrupted'] = True
       return params['save'](params)
 
+  def schedule(self, params, i, horizon):
+    '''
+      Multiplier of the step size at iteration i (counting from 1).
+    '''
+    if params['lr_schedule'] == 'cosine':
+      progress = min(float(i - 1) / max(horizon - 1, 1), 1.0)
+      return params['lr_min'] + (1 - params['lr_min']) * 0.5 * (1 + math.cos(math.pi * progress))
+    if params['lr_schedule'] == 'step':
+      return params['decay'] ** ((i - 1) // params['decay_every'])
+    raise ValueError('Unknown learning rate schedule ' + str(params['lr_schedule']))
+
+  def first_direction(self, params, grad):
+    '''
+      The first update of params['type'] for a step size of 1.
+    '''
+    if params['type'] == 'adam':
+      return -grad / (np.abs(grad) + params['eps'])
+    if params['type'] == 'adagrad':
+      return -grad / np.sqrt((1.0 - params['gamma']) * np.square(grad) + params['eps'])
+    return -grad
+
+  def search_step_size(self, params):
+    '''
+      Picks a step size from a few loss evaluations along the first update
+      direction. Starts from the step that changes the largest entry of
+      theta by 1, then grows it by search_factor while the loss keeps
+      dropping, or shrinks it until the loss drops at all.
+    '''
+    theta = params['theta']
+    grad, loss = params['dJdTheta'](theta)
+    direction = self.first_direction(params, grad)
+    step = 1.0 / max(np.max(np.abs(direction)), params['eps'])
+    J = lambda s: params['J'](theta + s * direction)
+
+    evals = 1
+    best_step, best_loss = None, loss
+    trial = J(step)
+    evals += 1
+    if trial < loss:
+      best_step, best_loss = step, trial
+      while evals < params['search_evals']:
+        step *= params['search_factor']
+        trial = J(step)
+        evals += 1
+        if not trial < best_loss:
+          break
+        best_step, best_loss = step, trial
+    else:
+      while evals < params['search_evals']:
+        step /= params['search_factor']
+        trial = J(step)
+        evals += 1
+        if trial < loss:
+          best_step = step
+          break
+
+    self.state['search_evals'] = evals
+    # Without any decrease, fall back to the smallest step tried
+    return step if best_step is None else best_step
+
+  def optimize_phases(self, phases):
+    '''
+      Runs one phase after the other on the same theta. Each phase is a dict
+      of params overriding the optimizer's own, e.g.
+
+        [{'type' : 'adadelta', 'iters' : 50, 'tol' : 1e-3},
+         {'type' : 'lbfgs', 'iters' : 200, 'factr' : 1e7}]
+
+      A first-order phase ends after 'iters' iterations or on a plateau, once
+      the relative change in loss drops below 'tol'. An 'lbfgs' phase runs
+      SciPy's L-BFGS on a flattened float64 copy of theta for at most 'iters'
+      evaluations of dJdTheta, which gives it the loss and gradient at once.
+
+      An interrupted (Ctrl-C) first-order phase ends the schedule there.
+      Returns the result of save. params['phases'] lists the type,
+      iterations, seconds and start and end loss of every phase, and every
+      row of params['metrics'] has the index of its 'phase'.
+    '''
+    if not phases:
+      raise ValueError('The phase schedule is empty')
+    base = self.params
+    phase_params = None
+    summaries = []
+    try:
+      for n, phase in enumerate(phases):
+        self.params = dict(base)
+        self.params.update(phase)
+        self.params['save'] = lambda p: p
+        record = self.params['record']
+        self.params['record'] = lambda p, n = n, record = record: dict(record(p), phase = n)
+
+        # Optimizer state does not carry over between algorithms
+        self.state.update({'update' : 0, 'grad_hist' : 0, 'update_hist' : 0, 'moment' : 0,
+                           'adam_t' : 0})
+        self.state.pop('step_size', None)
+        self.state.pop('schedule', None)
+
+        first, start = self.state['iter'], time.time()
+        start_loss = self.state['loss'][-1] if self.state['loss'] else None
+        if self.params['type'] == 'lbfgs':
+          phase_params = self._lbfgs_phase()
+        else:
+          phase_params = self.optimize()
+        base['theta'] = phase_params['theta']
+
+        summaries.append({
+          'phase' : n,
+          'type' : self.params['type'],
+          'iters' : self.state['iter'] - first,
+          'seconds' : time.time() - start,
+          'start_loss' : start_loss,
+          'end_loss' : self.state['loss'][-1] if self.state['loss'] else None
+        })
+        if base['verbose']:
+          print('Phase {phase} ({type}): {iters} iterations in {seconds:.1f}s, '
+                'loss {end_loss}'.format(**summaries[-1]))
+        if self.state.get('interrupted'):
+          break
+    finally:
+      self.params = base
+
+    phase_params['phases'] = summaries
+    return base['save'](phase_params)
+
+  def _lbfgs_phase(self):
+    from scipy.optimize import fmin_l_bfgs_b
+
+    params = copy.copy(self.params)
+    params['loss'] = self.state['loss']
+    params['metrics'] = self.state['metrics']
+    theta = params['theta']
+    shape, dtype = np.shape(theta), theta.dtype
+
+    def func(x):
+      start = time.time()
+      grad, loss = params['dJdTheta'](x.reshape(shape).astype(dtype))
+      self.state['iter'] += 1
+      params['iter'] = self.state['iter']
+      params['loss'].append(loss)
+      row = {
+        'iter' : params['iter'],
+        'loss' : float(loss),
+        'grad_norm' : float(np.linalg.norm(grad)),
+        'seconds' : time.time() - start
+      }
+      row.update(params['record'](params))
+      params['metrics'].append(row)
+      return float(loss), np.float64(grad).ravel()
+
+    x, f, d = fmin_l_bfgs_b(func, np.float64(theta).ravel(),
+                            factr = params.get('factr', 1e7), maxfun = params['iters'])
+    params['theta'] = x.reshape(shape).astype(dtype)
+    return params
+
   # Limited-memory BFGS
   # factr:  1e12 for low accuracy
   #         1e7 for moderate accuracy
   #         10.0 for extremely high accuracy
   def optimize_lbfgs(self, factr=1e15):
+    from scipy.optimize import fmin_l_bfgs_b
+
     params = copy.copy(self.params)
 
     func = params['J']
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+from lazy import lazy_import
+
+tf = lazy_import('tensorflow')
+
+
+def available_cpus():
+  if hasattr(os, 'sched_getaffinity'):
+    return sorted(os.sched_getaffinity(0))
+  return list(range(multiprocessing.cpu_count()))
+
+
+def set_cpu_affinity(cpus):
+  '''
+    Pins this process (and every thread it creates afterwards) to 'cpus'.
+    Must be called before the TensorFlow session spawns its thread pools.
+  '''
+  if not hasattr(os, 'sched_setaffinity'):
+    print('CPU affinity is not supported on this platform, ignoring')
+    return
+  os.sched_setaffinity(0, cpus)
+
+
+def session_config(intra_op_threads = None, inter_op_threads = None):
+  '''
+    ConfigProto with explicit thread pool sizes. None keeps TensorFlow's
+    default of one thread per core for that pool.
+  '''
+  config = tf.ConfigProto()
+  if intra_op_threads is not None:
+    config.intra_op_parallelism_threads = intra_op_threads
+  if inter_op_threads is not None:
+    config.inter_op_parallelism_threads = inter_op_threads
+  return config
+
+
+def partition_cores(num_workers, cpus = None):
+  '''
+    Splits the node's cores into 'num_workers' disjoint, contiguous sets.
+    Returns one dict per worker with the keyword arguments to pass to
+    Transfer (cpu_affinity, intra_op_threads, inter_op_threads).
+
+    The conv stack of VGG is a single chain, so there is little to run in
+    parallel between ops: each worker gets one inter-op thread and all of
+    its cores as intra-op threads.
+  '''
+  if cpus is None:
+    cpus = available_cpus()
+  if num_workers < 1 or num_workers > len(cpus):
+    raise ValueError('Cannot split {} cores across {} workers'.format(len(cpus), num_workers))
+
+  per_worker, extra = divmod(len(cpus), num_workers)
+  placements = []
+  start = 0
+  for i in range(num_workers):
+    count = per_worker + (1 if i < extra else 0)
+    placements.append({
+      'cpu_affinity' : cpus[start:start + count],
+      'intra_op_threads' : count,
+      'inter_op_threads' : 1
+    })
+    start += count
+  return placements
@@ -0,0 +1,419 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+###########################################################
+# Deadline-aware planning.
+#
+# CostModel predicts the seconds per iteration of each optimizer from the
+# number of pixels and threads, plus the setup time of a Transfer (VGG and
+# targets), from benchmark runs on the node (python planner.py calibrate).
+# plan() picks the resolution, pyramid and iteration budget with the best
+# expected quality that fits a deadline, and Controller keeps the run on
+# its deadline from the throughput it measures while optimizing.
+###########################################################
+
+DATA_INPUT = 'data/input/'
+STYLE_IMAGE = DATA_INPUT + 'style/vangogh.jpg'
+CONTENT_IMAGE = DATA_INPUT + 'content/baker.jpg'
+
+# Optimizers the planner chooses from. Both are resumable, so a run can be
+# extended or cut short a few iterations at a time.
+OPTIMIZERS = {
+  'adam' : {'type' : 'adam', 'step_size' : 'auto'},
+  'adadelta' : {'type' : 'adadelta', 'gamma' : 0.9}
+}
+
+# Candidate resolutions as fractions of the requested one
+SIZE_FRACTIONS = (1.0, 0.75, 0.5, 0.375, 0.25)
+MIN_SIZE = 32
+
+# Quality is resolution_score * convergence, with resolution_score
+# (side / requested side) ** RESOLUTION_EXPONENT and convergence
+# 1 - exp(-iterations / tau), tau fitted per optimizer. An iteration on the
+# half size level of a pyramid counts as COARSE_EFFICIENCY of a full one.
+RESOLUTION_EXPONENT = 1.0
+COARSE_EFFICIENCY = 0.5
+PYRAMID_SHARE = 0.25     # of the optimization time spent on the coarse level
+
+
+def _fit_line(x, y):
+  # [intercept, slope] of y against x; proportional if x has one value
+  if len(set(x)) < 2:
+    return [0.0, float(np.mean(y)) / max(float(np.mean(x)), 1.0)]
+  slope, intercept = np.polyfit(x, y, 1)
+  return [max(float(intercept), 0.0), max(float(slope), 0.0)]
+
+
+def convergence_tau(losses):
+  '''
+    Iterations until the loss has made 1 - 1/e of its total decrease.
+  '''
+  losses = np.asarray(losses, dtype = np.float64)
+  total = losses[0] - losses.min()
+  if len(losses) < 2 or total <= 0:
+    return float(len(losses))
+  remaining = (losses - losses.min()) / total
+  return float(np.argmax(remaining <= math.exp(-1)) + 1)
+
+
+class CostModel:
+  '''
+    fits:        'optimizer/threads' -> [a, b], seconds per iteration a + b * pixels
+    setup:       [a, b], seconds to build a Transfer and load its targets
+    convergence: optimizer -> tau in iterations
+  '''
+
+  def __init__(self, fits = None, setup = None, convergence = None):
+    self.fits = fits or {}
+    self.setup = setup or [0.0, 0.0]
+    self.convergence = convergence or {}
+
+  @staticmethod
+  def _key(optimizer, threads):
+    return '{}/{}'.format(optimizer, threads)
+
+  def fit(self, samples):
+    '''
+      samples are dicts with 'optimizer', 'threads', 'pixels',
+      'seconds_per_iter', 'setup_seconds' and the 'loss' curve.
+    '''
+    groups = {}
+    for s in samples:
+      groups.setdefault(self._key(s['optimizer'], s['threads']), []).append(s)
+    for key, group in groups.items():
+      self.fits[key] = _fit_line([s['pixels'] for s in group],
+                                 [s['seconds_per_iter'] for s in group])
+    self.setup = _fit_line([s['pixels'] for s in samples],
+                           [s['setup_seconds'] for s in samples])
+    for optimizer in set(s['optimizer'] for s in samples):
+      self.convergence[optimizer] = float(np.median(
+          [convergence_tau(s['loss']) for s in samples if s['optimizer'] == optimizer]))
+    return self
+
+  @property
+  def optimizers(self):
+    return sorted(self.convergence)
+
+  def seconds_per_iter(self, optimizer, pixels, threads = None):
+    key = self._key(optimizer, threads)
+    scale = 1.0
+    if key not in self.fits:
+      # Nearest calibrated thread count, assuming linear scaling
+      known = [int(k.split('/')[1]) for k in self.fits
+               if k.startswith(optimizer + '/') and k.split('/')[1] != 'None']
+      if known and threads is not None:
+        nearest = min(known, key = lambda t: abs(t - threads))
+        key, scale = self._key(optimizer, nearest), float(nearest) / threads
+      else:
+        key = [k for k in self.fits if k.startswith(optimizer + '/')][0]
+    a, b = self.fits[key]
+    return scale * (a + b * pixels)
+
+  def setup_seconds(self, pixels):
+    return self.setup[0] + self.setup[1] * pixels
+
+  def save(self, path):
+    with open(path, 'w') as f:
+      json.dump({'fits' : self.fits, 'setup' : self.setup,
+                 'convergence' : self.convergence}, f, indent = 2, sort_keys = True)
+
+  @staticmethod
+  def load(path):
+    with open(path) as f:
+      return CostModel(**json.load(f))
+
+
+def _pixels(level):
+  return level[0] * level[1]
+
+
+def expected_quality(model, optimizer, scale, iters, coarse_iters = 0):
+  '''
+    scale is the planned side relative to the requested one.
+  '''
+  resolution = min(scale, 1.0) ** RESOLUTION_EXPONENT
+  effective = iters + COARSE_EFFICIENCY * coarse_iters
+  return resolution * (1 - math.exp(-effective / model.convergence[optimizer]))
+
+
+def plan(model, deadline, width, height, threads = None, margin = 0.1):
+  '''
+    The plan with the best expected quality that fits in 'deadline'
+    seconds, keeping 'margin' of it in reserve: a dict with the 'optimizer',
+    'levels' as [width, height, iterations] (one, or two for a pyramid),
+    the 'predicted_seconds' and the expected 'quality'. Every level keeps
+    the aspect ratio of width x height. If nothing fits, the smallest
+    single level plan with one iteration.
+  '''
+  budget = deadline * (1 - margin)
+  best = None
+  for optimizer in model.optimizers:
+    for fraction in SIZE_FRACTIONS:
+      size = [max(MIN_SIZE, int(width * fraction)), max(MIN_SIZE, int(height * fraction))]
+      scale = float(size[0]) / width
+      for pyramid in (False, True):
+        half = [size[0] // 2, size[1] // 2]
+        if pyramid and min(half) < MIN_SIZE:
+          continue
+        sizes = [half, size] if pyramid else [size]
+        time_left = budget - sum(model.setup_seconds(_pixels(s)) for s in sizes)
+        costs = [model.seconds_per_iter(optimizer, _pixels(s), threads) for s in sizes]
+        shares = [PYRAMID_SHARE, 1 - PYRAMID_SHARE] if pyramid else [1.0]
+        iters = [int(max(time_left, 0) * share / cost) for share, cost in zip(shares, costs)]
+        if iters[-1] < 1:
+          continue
+
+        quality = expected_quality(model, optimizer, scale, iters[-1],
+                                   iters[0] if pyramid else 0)
+        if best is None or quality > best['quality']:
+          best = {
+            'optimizer' : optimizer,
+            'levels' : [s + [i] for s, i in zip(sizes, iters)],
+            'predicted_seconds' : budget - time_left + sum(i * c for i, c in zip(iters, costs)),
+            'quality' : quality
+          }
+
+  if best is None:
+    fraction = SIZE_FRACTIONS[-1]
+    size = [max(MIN_SIZE, int(width * fraction)), max(MIN_SIZE, int(height * fraction))]
+    optimizer = model.optimizers[0]
+    best = {
+      'optimizer' : optimizer,
+      'levels' : [size + [1]],
+      'predicted_seconds' : model.setup_seconds(_pixels(size))
+                            + model.seconds_per_iter(optimizer, _pixels(size), threads),
+      'quality' : expected_quality(model, optimizer, float(size[0]) / width, 1)
+    }
+  return best
+
+
+class Controller:
+  '''
+    Adjusts a plan's iteration budgets from measured throughput. The caller
+    reports every setup and chunk of iterations with its duration and asks
+    how many iterations to run next, passing the seconds elapsed since the
+    job started (so the same logic drives real runs and simulations).
+
+    The last level uses all the time left before the deadline, minus the
+    margin; earlier levels never exceed their planned iterations.
+  '''
+
+  def __init__(self, model, plan, deadline, threads = None, margin = 0.1):
+    self.model = model
+    self.plan = plan
+    self.deadline = deadline
+    self.threads = threads
+    self.margin = margin
+    self.done = [0] * len(plan['levels'])
+    self.measured = [None] * len(plan['levels'])
+    self.slowdown = 1.0    # measured / predicted, carried to later levels
+
+  def _model_per_iter(self, level):
+    return self.model.seconds_per_iter(self.plan['optimizer'],
+                                       _pixels(self.plan['levels'][level]), self.threads)
+
+  def predicted(self, level):
+    return self.slowdown * self._model_per_iter(level)
+
+  def record_setup(self, level, seconds):
+    predicted = self.model.setup_seconds(_pixels(self.plan['levels'][level]))
+    if predicted > 0:
+      self.slowdown = seconds / predicted
+
+  def record(self, level, iters, seconds):
+    self.done[level] += iters
+    self.measured[level] = seconds / iters
+    self.slowdown = self.measured[level] / self._model_per_iter(level)
+
+  def next_chunk(self, level, elapsed, chunk = 5):
+    time_left = self.deadline * (1 - self.margin) - elapsed
+    for later in range(level + 1, len(self.plan['levels'])):
+      time_left -= self.slowdown * self.model.setup_seconds(_pixels(self.plan['levels'][later]))
+      time_left -= self.plan['levels'][later][2] * self.predicted(later)
+
+    per_iter = self.measured[level] or self.predicted(level)
+    allowed = self.done[level] + int(max(time_left, 0) / per_iter)
+    if level < len(self.plan['levels']) - 1:
+      allowed = min(allowed, self.plan['levels'][level][2])
+    return max(min(chunk, allowed - self.done[level]), 0)
+
+
+def execute(model, plan, style, content, deadline, alpha = 1, beta = 1e3,
+            threads = None, chunk = 5, **transfer_args):
+  '''
+    Runs a plan, adjusting it as it goes. Returns the result as an RGB
+    image at the plan's final size, and a report of the time taken and the
+    iterations each level ran.
+  '''
+  import copy
+  from optimize import SGD
+  from transfer import Transfer
+
+  start = time.time()
+  controller = Controller(model, plan, deadline, threads)
+  initial = None
+  for level, (width, height, _) in enumerate(plan['levels']):
+    setup_start = time.time()
+    transfer = Transfer(style, content, width, height, display = False,
+                        intra_op_threads = threads, **transfer_args)
+    if initial is not None:
+      transfer.set_initial_img(initial)
+    controller.record_setup(level, time.time() - setup_start)
+
+    params = transfer.style_params('Planned Image Style Transfer', None, alpha, beta)
+    params.update(OPTIMIZERS[plan['optimizer']])
+    params.update({'save' : lambda p: p, 'verbose' : False})
+    optimizer = SGD(params)
+    result = {'theta' : copy.copy(transfer.synthetic)}
+    while True:
+      n = controller.next_chunk(level, time.time() - start, chunk)
+      if n == 0:
+        break
+      chunk_start = time.time()
+      optimizer.params['iters'] = n
+      result = optimizer.optimize()
+      controller.record(level, n, time.time() - chunk_start)
+
+    initial = transfer.output_image(result['theta'])[0]
+    transfer.close()
+
+  seconds = time.time() - start
+  return initial, {
+    'seconds' : seconds,
+    'hit' : seconds <= deadline,
+    'planned' : [level[2] for level in plan['levels']],
+    'iters' : controller.done
+  }
+
+
+def simulate(model, jobs = 1000, sizes = ((240, 240), (480, 360), (720, 480)),
+             deadlines = (5.0, 120.0), noise = 0.3, adjust = True, margin = 0.1,
+             chunk = 5, seed = 0):
+  '''
+    SLA hit rate on a synthetic workload. Every job asks for a random
+    (width, height) and a log-uniform deadline and runs on a node whose
+    speed differs from the model by a lognormal factor (sigma 'noise') that
+    the planner does not know, with per-chunk jitter on top. With 'adjust'
+    the Controller corrects the budgets mid-run; without it the plan runs
+    as planned.
+  '''
+  rng = np.random.RandomState(seed)
+  hits = 0
+  qualities = []
+  for _ in range(jobs):
+    width, height = sizes[rng.randint(len(sizes))]
+    deadline = math.exp(rng.uniform(math.log(deadlines[0]), math.log(deadlines[1])))
+    p = plan(model, deadline, width, height, margin = margin)
+    controller = Controller(model, p, deadline, margin = margin)
+    speed = rng.lognormal(0, noise)
+
+    elapsed = 0.0
+    for level, planned in enumerate(p['levels']):
+      setup = speed * model.setup_seconds(_pixels(planned))
+      elapsed += setup
+      controller.record_setup(level, setup)
+      while True:
+        if adjust:
+          n = controller.next_chunk(level, elapsed, chunk)
+        else:
+          n = min(chunk, planned[2] - controller.done[level])
+        if n == 0:
+          break
+        per_iter = speed * rng.lognormal(0, noise / 4) * model.seconds_per_iter(
+            p['optimizer'], _pixels(planned))
+        elapsed += n * per_iter
+        controller.record(level, n, n * per_iter)
+
+    hits += elapsed <= deadline
+    coarse = controller.done[0] if len(p['levels']) > 1 else 0
+    qualities.append(expected_quality(model, p['optimizer'], float(p['levels'][-1][0]) / width,
+                                      controller.done[-1], coarse))
+  return {
+    'jobs' : jobs,
+    'hit_rate' : float(hits) / jobs,
+    'mean_quality' : float(np.mean(qualities))
+  }
+
+
+###########################################################
+# Calibration
+###########################################################
+
+def _calibrate_run(optimizer, size, threads, iters):
+  from optimize import SGD
+  from transfer import Transfer
+  start = time.time()
+  transfer = Transfer(STYLE_IMAGE, CONTENT_IMAGE, size, size, display = False,
+                      intra_op_threads = threads)
+  setup = time.time() - start
+  np.random.seed(0)
+  transfer.set_random_initial_img()
+
+  params = transfer.style_params('Calibration', None, 1, 1e3)
+  params.update(OPTIMIZERS[optimizer])
+  params.update({'iters' : iters, 'save' : lambda p: p, 'verbose' : False})
+  result = SGD(params).optimize()
+  seconds = sum(row['seconds'] for row in result['metrics'])
+  return {
+    'optimizer' : optimizer,
+    'threads' : threads,
+    'pixels' : size * size,
+    'setup_seconds' : setup,
+    'seconds_per_iter' : seconds / iters,
+    'loss' : [float(l) for l in result['loss']]
+  }
+
+
+def calibrate(sizes = (120, 240, 360), threads = (None,), iters = 50):
+  from benchmark import in_subprocess
+  samples = []
+  for optimizer in sorted(OPTIMIZERS):
+    for t in threads:
+      for size in sizes:
+        r = in_subprocess(_calibrate_run, optimizer, size, t, iters)
+        if 'error' in r:
+          print('{} at {} with {} threads failed: {}'.format(optimizer, size, t, r['error']))
+          continue
+        print('{} at {} with {} threads: {:.3f} s/iter'.format(
+              optimizer, size, t, r['seconds_per_iter']))
+        samples.append(r)
+  return CostModel().fit(samples)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Deadline-aware planning of transfer jobs.')
+  parser.add_argument('--model', default='cost_model.json')
+  subparsers = parser.add_subparsers(dest='command')
+
+  cal = subparsers.add_parser('calibrate', help='fit the cost model on this node')
+  cal.add_argument('--sizes', type=int, nargs='+', default=[120, 240, 360])
+  cal.add_argument('--threads', type=int, nargs='+', default=None)
+  cal.add_argument('--iters', type=int, default=50)
+
+  show = subparsers.add_parser('plan', help='print the plan for a deadline')
+  show.add_argument('--deadline', type=float, required=True)
+  show.add_argument('--width', type=int, default=240)
+  show.add_argument('--height', type=int, default=240)
+  show.add_argument('--threads', type=int, default=None)
+
+  sim = subparsers.add_parser('simulate', help='SLA hit rate on a synthetic workload')
+  sim.add_argument('--jobs', type=int, default=1000)
+  sim.add_argument('--noise', type=float, default=0.3)
+  args = parser.parse_args()
+
+  if args.command == 'calibrate':
+    calibrate(args.sizes, args.threads or [None], args.iters).save(args.model)
+    print('Wrote ' + args.model)
+  elif args.command == 'plan':
+    print(json.dumps(plan(CostModel.load(args.model), args.deadline, args.width,
+                          args.height, args.threads), indent = 2))
+  else:
+    model = CostModel.load(args.model)
+    for adjust in (False, True):
+      r = simulate(model, args.jobs, noise = args.noise, adjust = adjust)
+      print('{:<22} hit rate {:.1%}  mean quality {:.3f}'.format(
+            'adjusted mid-run' if adjust else 'fixed plan', r['hit_rate'], r['mean_quality']))
@@ -0,0 +1,45 @@
+import argparse
+import os
+
+from results import read_metrics
+
+###########################################################
+# Offline plots of the metrics logs written by results.ResultsWriter.
+# This is the only place the loss curves are rendered.
+###########################################################
+
+
+def plot(metrics, keys, out_path, title = None):
+  import matplotlib
+  matplotlib.use('Agg')
+  import matplotlib.pyplot as plt
+
+  fig, axes = plt.subplots(len(keys), 1, sharex = True, squeeze = False,
+                           figsize = (6, 2.5 * len(keys)))
+  iters = [row['iter'] for row in metrics]
+  for ax, key in zip(axes[:, 0], keys):
+    ax.plot(iters, [row.get(key, float('nan')) for row in metrics])
+    ax.set_ylabel(key)
+    ax.set_ylim(bottom = 0)
+  axes[-1, 0].set_xlabel('iteration')
+  if title is not None:
+    axes[0, 0].set_title(title)
+  fig.savefig(out_path)
+  plt.close(fig)
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Plot metrics logs of style transfer runs.')
+  parser.add_argument('logs', nargs='+', help='*_metrics.jsonl or *_metrics.csv files')
+  parser.add_argument('--keys', nargs='+', default=['loss'],
+                      help='metrics to plot, e.g. loss content_loss style_loss grad_norm')
+  parser.add_argument('--ext', default='jpg', help='image format of the plots')
+  args = parser.parse_args()
+
+  for log in args.logs:
+    base = os.path.splitext(log)[0]
+    if base.endswith('_metrics'):
+      base = base[:-len('_metrics')]
+    out_path = '{}_loss.{}'.format(base, args.ext)
+    plot(read_metrics(log), args.keys, out_path, os.path.basename(base))
+    print('Wrote ' + out_path)
@@ -0,0 +1,84 @@
+import csv
+import json
+import os
+
+import numpy as np
+
+from lazy import lazy_import
+
+io = lazy_import('skimage.io')
+
+###########################################################
+# Results of a run: the final image plus a per-iteration metrics log.
+#
+# Nothing here touches matplotlib, so batch jobs write their results in
+# milliseconds and leak no figures. plot_metrics.py renders the loss curve
+# offline from the log.
+###########################################################
+
+IMAGE_FORMATS = ('png', 'jpg', 'webp')
+METRICS_FORMATS = ('jsonl', 'csv', 'none')
+
+
+def read_metrics(path):
+  '''
+    Reads a metrics log written by ResultsWriter back as a list of dicts.
+  '''
+  with open(path) as f:
+    if path.endswith('.csv'):
+      return [dict((k, float(v)) for k, v in row.items() if v != '')
+              for row in csv.DictReader(f)]
+    return [json.loads(line) for line in f if line.strip()]
+
+
+class ResultsWriter:
+  '''
+    Writes '<name>.<image_format>' and '<name>_metrics.<metrics_format>' to
+    out_dir. Images are RGB arrays with values in [0, 1]; metrics are a list
+    of dicts with one entry per iteration.
+  '''
+
+  def __init__(self, out_dir, name, image_format = 'jpg', metrics_format = 'jsonl'):
+    if image_format not in IMAGE_FORMATS:
+      raise ValueError('Unknown image format ' + str(image_format))
+    if metrics_format not in METRICS_FORMATS:
+      raise ValueError('Unknown metrics format ' + str(metrics_format))
+    self.out_dir = out_dir
+    self.name = name
+    self.image_format = image_format
+    self.metrics_format = metrics_format
+
+  @property
+  def image_path(self):
+    return os.path.join(self.out_dir, '{}.{}'.format(self.name, self.image_format))
+
+  @property
+  def metrics_path(self):
+    return os.path.join(self.out_dir, '{}_metrics.{}'.format(self.name, self.metrics_format))
+
+  def write_image(self, image):
+    image = np.clip(np.asarray(image), 0, 1)
+    image = (image * 255 + 0.5).astype(np.uint8)
+    io.imsave(self.image_path, image)
+    return self.image_path
+
+  def write_metrics(self, metrics):
+    if self.metrics_format == 'none':
+      return None
+
+    # Write to a temporary file first so a killed job never leaves half a log
+    tmp = self.metrics_path + '.tmp'
+    with open(tmp, 'w') as f:
+      if self.metrics_format == 'jsonl':
+        for row in metrics:
+          f.write(json.dumps(row, sort_keys = True) + '\n')
+      else:
+        keys = sorted(set(k for row in metrics for k in row))
+        writer = csv.DictWriter(f, keys)
+        writer.writeheader()
+        writer.writerows(metrics)
+    os.rename(tmp, self.metrics_path)
+    return self.metrics_path
+
+  def write(self, image, metrics):
+    return self.write_image(image), self.write_metrics(metrics)
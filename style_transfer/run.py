@@ -1,7 +1,13 @@
+import argparse
+import numpy as np
 import os
-from transfer import Transfer
+import sys
+from cache import ResultCache, job_fingerprint
+from planner import CostModel, execute, plan
+from results import IMAGE_FORMATS, METRICS_FORMATS, ResultsWriter
+from transfer import Transfer, CONTENT_LAYERS, STYLE_LAYERS
+from warmstart import ResultStore
 import time
-import skimage
 
 ###########################################################
 # Select parameters
@@ -30,13 +36,114 @@ rand = True
 # For advanced tuning, modify the parameters 'params' below
 ###########################################################
 
+def parse_args():
+  parser = argparse.ArgumentParser(description='Image style transfer.')
+  parser.add_argument('--style', nargs='+', default=[STYLE_IMAGE],
+                      help='style image(s), relative to ' + DATA_INPUT +
+                           '. Several styles are blended in one pass')
+  parser.add_argument('--style-weights', nargs='+', type=float, default=None,
+                      help='one blending weight per style image')
+  parser.add_argument('--content', default=CONTENT_IMAGE,
+                      help='content image, relative to ' + DATA_INPUT)
+  parser.add_argument('--width', type=int, default=WIDTH)
+  parser.add_argument('--height', type=int, default=HEIGHT)
+  parser.add_argument('--intra-op-threads', type=int, default=None,
+                      help='threads used inside a single op (default: all cores)')
+  parser.add_argument('--inter-op-threads', type=int, default=None,
+                      help='ops run in parallel (default: all cores)')
+  parser.add_argument('--cpus', type=lambda s: [int(c) for c in s.split(',')],
+                      default=None, help='comma separated CPUs to pin to')
+  parser.add_argument('--image-format', default='jpg', choices=IMAGE_FORMATS,
+                      help='format of the output images')
+  parser.add_argument('--metrics-format', default='jsonl', choices=METRICS_FORMATS,
+                      help='format of the per-iteration metrics logs')
+  parser.add_argument('--warm-start', default=None, metavar='DIR',
+                      help='start L-BFGS from the closest earlier result stored in DIR')
+  parser.add_argument('--cache', default=None, metavar='DIR',
+                      help='reuse the L-BFGS result of identical earlier runs from DIR '
+                           '(not with --warm-start)')
+  parser.add_argument('--cache-mb', type=int, default=1024,
+                      help='size cap of the result cache')
+  parser.add_argument('--seed', type=int, default=None,
+                      help='seed of the random initial images')
+  parser.add_argument('--deadline', type=float, default=None, metavar='SECONDS',
+                      help='plan the size, iterations and optimizer to finish in '
+                           'SECONDS instead of running the methods selected below')
+  parser.add_argument('--cost-model', default='cost_model.json',
+                      help='cost model fitted by planner.py calibrate, used with --deadline')
+  args = parser.parse_args()
+  if args.cache and args.warm_start:
+    # The warm start image depends on what the store holds at the time,
+    # which the cache fingerprint cannot capture
+    parser.error('--cache and --warm-start cannot be combined')
+  return args
+
+
 if __name__ == "__main__":
+  args = parse_args()
+  import skimage.io
+
   # Choose content and style image.
-  style_path = os.path.join(DATA_INPUT, STYLE_IMAGE)
-  content_path = os.path.join(DATA_INPUT, CONTENT_IMAGE)
+  style_paths = [os.path.join(DATA_INPUT, s) for s in args.style]
+  style_path = style_paths[0]
+  content_path = os.path.join(DATA_INPUT, args.content)
+  if args.seed is not None:
+    np.random.seed(args.seed)
+
+  # Parameters of the L-BFGS job, also used to fingerprint it for the cache
+  lbfgs_weights = {'alpha' : 1, 'beta' : 1e3}     # content and style weighting
+  lbfgs_params = {'type' : 'lbfgs', 'factr' : 4e14}
+  lbfgs_name = 'lbfgs_L-BFGS Image Style Transfer'    # as saved by Transfer
+
+  if args.deadline is not None:
+    # The output is the planned size, at most --width x --height
+    model = CostModel.load(args.cost_model)
+    job_plan = plan(model, args.deadline, args.width, args.height, args.intra_op_threads)
+    print('Plan: {}'.format(job_plan))
+    image, report = execute(model, job_plan, style_paths, content_path, args.deadline,
+                            threads = args.intra_op_threads,
+                            style_weights = args.style_weights,
+                            inter_op_threads = args.inter_op_threads,
+                            cpu_affinity = args.cpus)
+    writer = ResultsWriter(DATA_OUTPUT, 'planned_Image Style Transfer', args.image_format, 'none')
+    print('{} in {:.1f}s ({} the deadline), iterations {} of {} planned'.format(
+          writer.write_image(image), report['seconds'],
+          'met' if report['hit'] else 'missed', report['iters'], report['planned']))
+    sys.exit(0)
+
+  if args.cache:
+    # L-BFGS starts from the image the methods before it left: the content,
+    # or the n-th random image drawn after seeding
+    if style2img:
+      lbfgs_initial = 'random' if rand else 'content'
+    else:
+      lbfgs_initial = 'random' if rand2content or rand2style else 'content'
+    random_draws = [rand2content, rand2style, style2img and rand].count(True)
 
-  transfer = Transfer(style_path, content_path, WIDTH, HEIGHT,
-                      initial = None)
+    cache = ResultCache(args.cache, args.cache_mb * 2 ** 20)
+    fingerprint = job_fingerprint(content_path, style_paths, args.width, args.height,
+                                  CONTENT_LAYERS, STYLE_LAYERS, args.style_weights,
+                                  dict(lbfgs_params, initial = lbfgs_initial,
+                                       random_draws = random_draws, **lbfgs_weights),
+                                  args.seed)
+
+    # An exact repeat of the L-BFGS job alone does not need VGG at all
+    only_lbfgs = style2imgLBFGS and not (rand2content or rand2style or style2img)
+    # Peeked so that a miss is counted once, by get_or_compute below
+    cached = cache.peek(fingerprint) if only_lbfgs else None
+    if cached is not None:
+      writer = ResultsWriter(DATA_OUTPUT, lbfgs_name, args.image_format, 'none')
+      print('Cached result written to ' + writer.write_image(cached[0]))
+      sys.exit(0)
+
+  transfer = Transfer(style_paths, content_path, args.width, args.height,
+                      initial = None,
+                      style_weights = args.style_weights,
+                      intra_op_threads = args.intra_op_threads,
+                      inter_op_threads = args.inter_op_threads,
+                      cpu_affinity = args.cpus,
+                      image_format = args.image_format,
+                      metrics_format = args.metrics_format)
   transfer.set_initial_img(content_path)
 
   start = time.time()
@@ -52,7 +159,7 @@ if __name__ == "__main__":
     transfer.set_random_initial_img()
     transfer.transfer_only_content(out_dir = DATA_OUTPUT, params = {
                                   'type' : 'momentum',
-                                  'step_size' : 100,
+                                  'step_size' : 'auto',
                                   'iters' : 30,
                                   'gamma' : 0.9,
                                   'eps': 1e-6
@@ -80,20 +187,42 @@ if __name__ == "__main__":
                                    alpha = 5e5,     # content weighting
                                    beta = 1,        # style weighting
                                    params = {
-                                      'type' : 'momentum',
-                                      'step_size' : 1e-6,
-                                      'iters' : 100,
-                                      'gamma' : 0.9,
-                                      'eps' : 1e-6
+                                      'type' : 'adam',
+                                      'step_size' : 'auto',
+                                      'lr_schedule' : 'cosine',
+                                      'iters' : 100
                                    })
+  def lbfgs():
+    if args.warm_start:
+      store = ResultStore(args.warm_start)
+      key = store.key(content_path, style_paths, transfer.content_layers,
+                      transfer.style_layers, args.style_weights)
+      prior = store.warm_start(transfer, key, lbfgs_weights)
+
+    out = transfer.transfer_style_to_image_lbfgs(out_dir = DATA_OUTPUT,
+                                   alpha = lbfgs_weights['alpha'],
+                                   beta = lbfgs_weights['beta'],
+                                   params = dict(lbfgs_params))
+
+    if args.warm_start:
+      report = store.put(key, out, lbfgs_weights, args.width, args.height,
+                         transfer.iterations, prior)
+      print('{} start: {} iterations, {} saved'.format(
+            'Warm' if report['warm'] else 'Cold', report['iters'],
+            report['iters_saved']))
+    computed.append(True)
+    return out
+
   if style2imgLBFGS:
-    transfer.transfer_style_to_image_lbfgs(out_dir = DATA_OUTPUT,
-                                   alpha = 1,       # content weighting
-                                   beta = 1e3,      # style weighting
-                                   params = {
-                                     'type' : 'lbfgs',
-                                     'factr' : 4e14
-                                   },)
+    computed = []
+    if args.cache:
+      # Identical runs started at the same time wait for this one
+      out = cache.get_or_compute(fingerprint, lbfgs)
+      if not computed:
+        ResultsWriter(DATA_OUTPUT, lbfgs_name, args.image_format, 'none').write_image(out[0])
+      print('Result cache: {}'.format(cache.stats()))
+    else:
+      lbfgs()
   
   end = time.time()
   print('Total runtime: {} seconds'.format(end - start))
@@ -0,0 +1,185 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from transfer import Transfer
+
+###########################################################
+# Soak test.
+#
+# Runs many jobs back to back through Transfer / SGD on the bundled images,
+# the way a long-lived worker does, and samples resident memory, the size
+# of the TensorFlow graphs and the number of open matplotlib figures after
+# every job. Fails (exit code 1) if any of them keeps growing once the
+# first jobs have warmed up allocators and caches, e.g.
+#   python soak.py --jobs 60 --iters 50
+###########################################################
+
+DATA_INPUT = 'data/input/'
+
+
+def bundled_images(kind):
+  directory = os.path.join(DATA_INPUT, kind)
+  return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                if name.lower().endswith(('.jpg', '.jpeg', '.png')))
+
+
+def rss_mb():
+  # Current, not peak, resident memory where /proc is available
+  try:
+    with open('/proc/self/statm') as f:
+      pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2.0 ** 20
+  except (IOError, OSError, ValueError):
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def graph_nodes(transfer):
+  '''
+    Ops in the Transfer's graph plus the default graph, which nothing
+    should be adding to.
+  '''
+  import tensorflow as tf
+  return len(transfer.graph.get_operations()) + len(tf.get_default_graph().get_operations())
+
+
+def open_figures():
+  # Only look if something already imported pyplot; importing it here would
+  # be the leak
+  if 'matplotlib.pyplot' not in sys.modules:
+    return 0
+  return len(sys.modules['matplotlib.pyplot'].get_fignums())
+
+
+def slope(values):
+  '''
+    Least squares growth per sample.
+  '''
+  if len(values) < 2:
+    return 0.0
+  return float(np.polyfit(np.arange(len(values)), values, 1)[0])
+
+
+class Soak:
+  '''
+    Runs 'jobs' style transfers of 'iters' iterations each, cycling through
+    the bundled content and style images. With 'fresh', every job gets its
+    own Transfer (closed afterwards); otherwise one Transfer is reused with
+    set_style / set_content, as the distributed workers do.
+  '''
+
+  def __init__(self, jobs = 50, iters = 50, size = 120, fresh = False,
+               params = None, **transfer_args):
+    self.jobs = jobs
+    self.iters = iters
+    self.size = size
+    self.fresh = fresh
+    self.params = {'type' : 'adam', 'step_size' : 'auto', 'verbose' : False}
+    self.params.update(params or {})
+    self.transfer_args = transfer_args
+    self.samples = []
+
+  def sample(self, job, transfer, start):
+    self.samples.append({
+      'job' : job,
+      'seconds' : time.time() - start,
+      'rss_mb' : rss_mb(),
+      'graph_nodes' : graph_nodes(transfer),
+      'figures' : open_figures()
+    })
+
+  def run(self):
+    pairs = itertools.cycle(itertools.product(bundled_images('content'),
+                                              bundled_images('style')))
+    out_dir = tempfile.mkdtemp(prefix = 'soak')
+    transfer = None
+    start = time.time()
+    try:
+      for job in range(self.jobs):
+        content, style = next(pairs)
+        if transfer is None or self.fresh:
+          if transfer is not None:
+            transfer.close()
+          transfer = Transfer(style, content, self.size, self.size, display = False,
+                              **self.transfer_args)
+        else:
+          transfer.set_style(style)
+          transfer.set_content(content)
+        transfer.synthetic = transfer.content
+
+        params = dict(self.params, iters = self.iters)
+        transfer.transfer_style_to_image(out_dir, 1, 1e3, params)
+        self.sample(job, transfer, start)
+    finally:
+      if transfer is not None:
+        transfer.close()
+      shutil.rmtree(out_dir)
+    return self.samples
+
+  def check(self, warmup = 5, max_rss_mb_per_job = 1.0, max_node_growth = 0,
+            max_figures = 0):
+    '''
+      Returns a list of failures: RSS growing faster than max_rss_mb_per_job
+      after the first 'warmup' jobs, graph node count growing by more than
+      max_node_growth over the same span, or more than max_figures
+      matplotlib figures open.
+    '''
+    steady = self.samples[warmup:] or self.samples
+    failures = []
+
+    rss_growth = slope([s['rss_mb'] for s in steady])
+    if rss_growth > max_rss_mb_per_job:
+      failures.append('RSS grows {:.2f} MB per job (limit {})'.format(
+                      rss_growth, max_rss_mb_per_job))
+
+    nodes = steady[-1]['graph_nodes'] - steady[0]['graph_nodes']
+    if nodes > max_node_growth:
+      failures.append('Graph grew by {} nodes over {} jobs (limit {})'.format(
+                      nodes, len(steady) - 1, max_node_growth))
+
+    figures = max(s['figures'] for s in self.samples)
+    if figures > max_figures:
+      failures.append('{} matplotlib figures open (limit {})'.format(figures, max_figures))
+    return failures
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Soak test for memory and graph growth.')
+  parser.add_argument('--jobs', type=int, default=50)
+  parser.add_argument('--iters', type=int, default=50)
+  parser.add_argument('--size', type=int, default=120)
+  parser.add_argument('--fresh', action='store_true',
+                      help='a new Transfer per job instead of reusing one')
+  parser.add_argument('--warmup', type=int, default=5,
+                      help='jobs excluded from the growth checks')
+  parser.add_argument('--max-rss-mb-per-job', type=float, default=1.0)
+  parser.add_argument('--max-node-growth', type=int, default=0)
+  parser.add_argument('--log', default=None, help='write the samples to this JSONL file')
+  args = parser.parse_args()
+
+  soak = Soak(args.jobs, args.iters, args.size, args.fresh)
+  samples = soak.run()
+  print('{:>5} {:>9} {:>9} {:>12} {:>8}'.format('job', 'seconds', 'rss_mb',
+                                               'graph_nodes', 'figures'))
+  for s in samples:
+    print('{job:>5} {seconds:>9.1f} {rss_mb:>9.1f} {graph_nodes:>12} {figures:>8}'.format(**s))
+
+  if args.log is not None:
+    with open(args.log, 'w') as f:
+      for s in samples:
+        f.write(json.dumps(s) + '\n')
+
+  failures = soak.check(args.warmup, args.max_rss_mb_per_job, args.max_node_growth)
+  for failure in failures:
+    print('FAIL: ' + failure)
+  if failures:
+    sys.exit(1)
+  print('No growth over {} jobs of {} iterations'.format(args.jobs, args.iters))
@@ -0,0 +1,217 @@
+import argparse
+import copy
+import itertools
+import math
+import os
+
+import numpy as np
+
+from optimize import SGD
+from transfer import Transfer
+
+###########################################################
+# Hyperparameter sweeps with successive halving.
+#
+# Every configuration starts with a small iteration budget. After each rung
+# only the best 1/eta of them are kept, and the survivors resume from their
+# current image and optimizer state with eta times the budget. All of them
+# share one Transfer, so the session, VGG and targets are built once.
+###########################################################
+
+DEFAULT_CONFIG = {
+  'alpha' : 1,
+  'beta' : 1e3,
+  'type' : 'adadelta',
+  'step_size' : 1.0,
+  'gamma' : 0.9,
+  'eps' : 1e-6
+}
+
+# Parameters an optimizer type ignores, left out of its configurations so
+# that the grid does not train the same configuration several times
+UNUSED_PARAMS = {
+  'sgd' : ('gamma',),
+  'adam' : ('gamma',),
+  'adadelta' : ('step_size',)
+}
+
+
+def grid(**values):
+  '''
+    grid(alpha=[1, 10], type=['momentum', 'adadelta']) returns the list of
+    distinct combination, each filled in from DEFAULT_CONFIG and without
+    the UNUSED_PARAMS of its type.
+  '''
+  keys = sorted(values)
+  configs = []
+  for combination in itertools.product(*[values[k] for k in keys]):
+    config = dict(DEFAULT_CONFIG)
+    config.update(zip(keys, combination))
+    for key in UNUSED_PARAMS.get(config['type'], ()):
+      config.pop(key)
+    if config not in configs:
+      configs.append(config)
+  return configs
+
+
+class Candidate:
+
+  def __init__(self, transfer, config, schedule_iters = None):
+    self.transfer = transfer
+    self.config = config
+    self.losses = (None, None)
+    self.score = None
+
+    params = dict(config)
+    params.update({
+      'name' : 'Sweep',
+      'theta' : copy.copy(transfer.synthetic),
+      'dJdTheta' : self.loss_gradient,
+      'J' : self.loss,
+      'save' : lambda p: p,
+      'verbose' : False
+    })
+    # Rungs resume the run, so learning rate schedules span the whole budget
+    params.setdefault('schedule_iters', schedule_iters)
+    self.optimizer = SGD(params)
+
+  @property
+  def iters(self):
+    return self.optimizer.state['iter']
+
+  @property
+  def theta(self):
+    return self.optimizer.params['theta']
+
+  def loss_gradient(self, image):
+    alpha, beta = self.config['alpha'], self.config['beta']
+    grad, c_loss, s_loss = self.transfer.loss_and_gradient(image, alpha, beta)
+    self.losses = (c_loss, s_loss)
+    return (grad, alpha * c_loss + beta * s_loss)
+
+  def loss(self, image):
+    c_loss, s_loss = self.transfer.losses(image)
+    return self.config['alpha'] * c_loss + self.config['beta'] * s_loss
+
+  def run(self, iters):
+    self.optimizer.params['iters'] = iters
+    self.optimizer.optimize()
+
+
+###########################################################
+# Metrics: lower is better
+###########################################################
+
+def _normalized(sweep, candidate):
+  # Content and style loss relative to the initial image, so that
+  # configurations with different alpha / beta can be compared
+  c_loss, s_loss = sweep.transfer.losses(candidate.theta)
+  return c_loss / sweep.initial[0] + s_loss / sweep.initial[1]
+
+
+def _content(sweep, candidate):
+  return sweep.transfer.losses(candidate.theta)[0]
+
+
+def _style(sweep, candidate):
+  return sweep.transfer.losses(candidate.theta)[1]
+
+
+def _loss(sweep, candidate):
+  return candidate.optimizer.state['loss'][-1]
+
+
+METRICS = {
+  'normalized' : _normalized,
+  'content_loss' : _content,
+  'style_loss' : _style,
+  'loss' : _loss
+}
+
+
+class Sweep:
+  '''
+    Successive halving over configurations of Transfer's first-order
+    optimizers (the SGD types). L-BFGS keeps no resumable state and is not
+    swept.
+
+    metric is one of METRICS or a callable (sweep, candidate) -> score.
+  '''
+
+  def __init__(self, transfer, configs, metric = 'normalized', eta = 2,
+               min_iters = 10, max_iters = 160):
+    self.transfer = transfer
+    self.configs = configs
+    self.metric = METRICS[metric] if metric in METRICS else metric
+    self.eta = eta
+    self.min_iters = min_iters
+    self.max_iters = max_iters
+    self.ranking = []
+
+    c_loss, s_loss = transfer.losses(transfer.synthetic)
+    self.initial = (max(c_loss, 1e-12), max(s_loss, 1e-12))
+
+  def run(self):
+    candidates = [Candidate(self.transfer, c, self.max_iters) for c in self.configs]
+    alive = list(candidates)
+    budget = self.min_iters
+    self.rungs = []
+
+    while True:
+      for c in alive:
+        c.run(budget - c.iters)
+        c.score = self.metric(self, c)
+        if not np.isfinite(c.score):
+          c.score = float('inf')
+      alive.sort(key = lambda c: c.score)
+      self.rungs.append((budget, len(alive)))
+
+      if len(alive) == 1 or budget >= self.max_iters:
+        break
+      alive = alive[:int(math.ceil(len(alive) / float(self.eta)))]
+      budget = min(budget * self.eta, self.max_iters)
+
+    # Survivors first, then everyone else by their last score
+    self.ranking = sorted(candidates, key = lambda c: (-c.iters, c.score))
+    return self.ranking
+
+  def compute(self):
+    '''
+      Iterations used against running every configuration to max_iters.
+    '''
+    used = sum(c.iters for c in self.ranking)
+    return used, len(self.configs) * self.max_iters
+
+  def print_table(self):
+    keys = sorted(set(k for c in self.configs for k in c))
+    print('{:>4} {:>12} {:>6}  {}'.format('rank', 'score', 'iters', '  '.join(keys)))
+    for i, c in enumerate(self.ranking):
+      print('{:>4} {:>12.5g} {:>6}  {}'.format(i + 1, c.score, c.iters,
+            '  '.join(str(c.config.get(k, '-')) for k in keys)))
+    used, full = self.compute()
+    print('Used {} iterations, {:.0%} of the {} for the full grid'.format(
+          used, float(used) / full, full))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Successive halving hyperparameter sweep.')
+  parser.add_argument('--style', default=os.path.join('data/input', 'style/vangogh.jpg'))
+  parser.add_argument('--content', default=os.path.join('data/input', 'content/baker.jpg'))
+  parser.add_argument('--size', type=int, default=200)
+  parser.add_argument('--alpha', type=float, nargs='+', default=[1, 10, 100])
+  parser.add_argument('--beta', type=float, nargs='+', default=[1e2, 1e3, 1e4])
+  parser.add_argument('--type', nargs='+', default=['momentum', 'adadelta'])
+  parser.add_argument('--step-size', type=float, nargs='+', default=[1e-6, 1e-4, 1.0])
+  parser.add_argument('--gamma', type=float, nargs='+', default=[DEFAULT_CONFIG['gamma']])
+  parser.add_argument('--metric', default='normalized', choices=sorted(METRICS))
+  parser.add_argument('--min-iters', type=int, default=10)
+  parser.add_argument('--max-iters', type=int, default=160)
+  args = parser.parse_args()
+
+  transfer = Transfer(args.style, args.content, args.size, args.size, display = False)
+  configs = grid(alpha = args.alpha, beta = args.beta, type = args.type,
+                 step_size = args.step_size, gamma = args.gamma)
+  sweep = Sweep(transfer, configs, args.metric, min_iters = args.min_iters,
+                max_iters = args.max_iters)
+  sweep.run()
+  sweep.print_table()
@@ -1,97 +1,321 @@
 import copy
-import matplotlib.pyplot as plt
 import numpy as np
 import os
-import skimage.io
-import tensorflow as tf
-import pdb
+import threading
+import time
 
+from lazy import lazy_import
 from ext.tf_vgg import vgg19, utils
+import placement
+from artifact import load_artifact
+import backbones
+from cache import FeatureCache
 from optimize import SGD
+from results import ResultsWriter
+
+# Heavy modules are imported on first use. matplotlib in particular is only
+# loaded when a display is shown.
+io = lazy_import('skimage.io')
+plt = lazy_import('matplotlib.pyplot')
+tf = lazy_import('tensorflow')
+transform = lazy_import('skimage.transform')
 
 PAUSE_LEN = 0.01    # length to pause when displaying plots
 NUM_CHANNELS = 3    # number of color channels
 
+GRAM_SAMPLING_MIN_POSITIONS = 64 * 64
+
+CONTENT_LAYERS = ["conv4_2"]
+STYLE_LAYERS = ["conv1_1","conv2_1",
+                "conv3_1","conv4_1",
+                "conv5_1"]
+
+
+###########################################################
+# Losses shared by Transfer and the feed-forward network
+###########################################################
+
+def gram_matrix(features):
+  # features is [batch, height, width, channels]; returns [batch, C, C]
+  num_feature = features.get_shape().as_list()[3]
+
+  # Using '-1' flattens the spatial dimensions. So -1 = 'M_L**2' in this case.
+  A = tf.reshape(features, [tf.shape(features)[0], -1, num_feature])
+  return tf.matmul(A, A, transpose_a = True)
+
+
+def sampled_gram_matrix(features, fraction, mode = 'random'):
+  '''
+    Unbiased estimate of gram_matrix(features)[0] from a fraction of the
+    spatial positions of a single image, redrawn on every session run.
+    Layers with fewer than GRAM_SAMPLING_MIN_POSITIONS positions are cheap
+    and stay exact.
+
+    'random' draws positions uniformly with replacement and scales by N / k.
+    'grid' keeps every s-th row and column from a random offset; each
+    position is kept with probability 1 / s^2, so the scale is s^2.
+  '''
+  _, height, width, num_feature = features.get_shape().as_list()
+  N = height * width
+  if N < GRAM_SAMPLING_MIN_POSITIONS:
+    return gram_matrix(features)[0]
+
+  if mode == 'random':
+    k = max(1, int(fraction * N))
+    A = tf.reshape(features, [-1, num_feature])
+    A = tf.gather(A, tf.random_uniform([k], 0, N, dtype = tf.int32))
+    scale = float(N) / k
+  else:
+    s = max(1, int(round(1 / np.sqrt(fraction))))
+    offset = tf.random_uniform([2], 0, s, dtype = tf.int32)
+    begin = tf.stack([0, offset[0], offset[1], 0])
+    F = tf.strided_slice(features, begin, [1, height, width, num_feature], [1, s, s, 1])
+    A = tf.reshape(F, [-1, num_feature])
+    scale = float(s * s)
+  return scale * tf.matmul(A, A, transpose_a = True)
+
+
+def content_loss(features, targets, layers):
+  content_layer_loss = []
+  for layer in layers:
+    F_minus_P = features[layer] - targets[layer]
+    F_minus_P_2 = 0.5 * tf.square(F_minus_P)
+    content_layer_loss.append(tf.reduce_mean(F_minus_P_2))
+  return tf.reduce_mean(content_layer_loss)
+
+
+def style_loss(grams, targets, layer_weights = None):
+  E = []
+  for G, A in zip(grams, targets):
+    E.append(tf.reduce_mean(tf.square(G - A)))
+  if layer_weights is None:
+    return tf.reduce_mean(E)
+  return tf.reduce_sum(layer_weights * tf.stack(E)) / tf.reduce_sum(layer_weights)
+
+
+def blend_grams(grams, style_weights, layer_weights):
+  '''
+    Collapses several styles into one target per layer.
+
+    grams[s][l] is the gram matrix of style s at layer l and layer_weights[s][l]
+    is that style's weight at the layer. Since the loss is quadratic,
+
+      sum_s w_sl |G_l - A_sl|^2 = W_l |G_l - sum_s w_sl A_sl / W_l|^2 + const
+
+    with W_l = sum_s w_sl, so matching the weighted mean of the style grams
+    with layer weight W_l has the same gradient as matching every style, at
+    the cost of a single style. Returns (targets, W).
+  '''
+  targets = []
+  W = []
+  for l in range(len(grams[0])):
+    w = [style_weights[s] * layer_weights[s][l] for s in range(len(grams))]
+    W.append(sum(w))
+    targets.append(sum(w[s] * grams[s][l] for s in range(len(grams))) / W[-1])
+  return targets, np.array(W, dtype = np.float32)
+
+
+class StreamClosed(Exception):
+  '''Raised in the optimizer thread when a stream's consumer goes away.'''
+
 
 class Transfer:
 
   def __init__(self, style, content, width = 240, height = 240, initial = None, 
-               content_layers = ["conv4_2"], 
-               style_layers = ["conv1_1","conv2_1",
-                               "conv3_1","conv4_1",
-                               "conv5_1"]):
-    self.content_layers = content_layers
-    self.style_layers = style_layers
+               content_layers = CONTENT_LAYERS, style_layers = STYLE_LAYERS,
+               display = True, precision = 'float32', feature_cache = None,
+               intra_op_threads = None, inter_op_threads = None,
+               cpu_affinity = None, style_weights = None,
+               style_layer_weights = None, gram_sampling = None,
+               gram_sample_fraction = 0.25, checkpoint_every = None,
+               artifact = None, image_format = 'jpg', metrics_format = 'jsonl',
+               backbone = 'vgg19'):
+    # Feature network, one of backbones.BACKBONES. Layers are given with
+    # VGG19 names and mapped onto the backbone's.
+    self.backbone = backbone
+    self.content_layers = backbones.map_layers(backbone, content_layers)
+    self.style_layers = backbones.map_layers(backbone, style_layers)
 
     # Desired size of output image
     self.width = width
     self.height = height
 
-    self.sess = tf.Session()
-
+    # Whether to show the synthetic image with matplotlib while optimizing
+    self.display = display
+
+    # How _save writes the final image and the per-iteration metrics log
+    # (see results.py)
+    self.image_format = image_format
+    self.metrics_format = metrics_format
+
+    # Precision of the frozen VGG convolutions. Grams and losses stay float32.
+    if precision == 'bfloat16' and not vgg19.bfloat16_supported():
+      print('bfloat16 convolutions are not supported on this CPU, using float32')
+      precision = 'float32'
+    self.precision = precision
+
+    # Optionally estimate the synthetic image's grams from a subset of spatial
+    # positions: None for exact grams, 'random' for positions drawn uniformly
+    # or 'grid' for a strided grid with a random offset. Resampled each run.
+    if gram_sampling not in (None, 'random', 'grid'):
+      raise ValueError('Unknown gram sampling ' + str(gram_sampling))
+    self.gram_sampling = gram_sampling
+    self.gram_sample_fraction = gram_sample_fraction
+
+    # Recompute VGG activations during backprop instead of storing them.
+    # None stores everything; k keeps only every k-th pool layer's output.
+    self.checkpoint_every = checkpoint_every
+
+    # Optional cache.FeatureCache shared between Transfers, so that a content
+    # image stylized many times only goes through VGG once
+    self.feature_cache = feature_cache
+
+    # Pin the process before the session creates its thread pools
+    if cpu_affinity is not None:
+      placement.set_cpu_affinity(cpu_affinity)
+
+    # Each Transfer owns its graph so that several jobs in one process do
+    # not keep adding nodes to the default graph
+    self.graph = tf.Graph()
+    self.sess = tf.Session(graph = self.graph,
+                           config = placement.session_config(intra_op_threads,
+                                                             inter_op_threads))
+
+    with self.graph.as_default():
+      if artifact is None:
+        self._build_graph()
+      else:
+        # The graph was built, optimized and frozen ahead of time; this also
+        # sets the size and layers it was built for
+        load_artifact(self, artifact)
+
+      self.sess.run(tf.variables_initializer(
+          list(self.target_content_variables.values()) + self.target_gram_variables
+          + [self.style_layer_weights]))
+      self.graph.finalize()
+
+    # Read in style and content images, resize, and load their targets
+    self.synthetic = None
+    if style is not None:
+      self.set_style(style, style_weights, style_layer_weights)
+    if content is not None:
+      self.set_content(content)
+      self.synthetic = self.content
+    if initial is not None:
+      self.set_initial_img(initial)
+
+  def _build_graph(self):
     # Create the 'VGG19' convolutional neural net
     self.image = tf.placeholder('float', [1, self.width, self.height, NUM_CHANNELS])
-    self.vgg = vgg19.Vgg19()
+    self.vgg = backbones.create(self.backbone, self.precision)
     self.vgg.build(self.image)
 
-    # Read in style and content images and then resize
-    style = utils.load_image2(style, self.width, self.height)
-    content = utils.load_image2(content, self.width, self.height)
+    # Create symbolic gram matrices. The exact ones give the style targets,
+    # the synthetic ones (possibly sampled) enter the style loss.
+    self.gram_matrix_functions = self.get_gram_matrices()
+    self.synthetic_gram_functions = self.get_synthetic_gram_matrices()
+
+    # Targets are held in variables so that new content or style images
+    # can be swapped in without rebuilding the graph
+    self.target_content_variables = {}
+    for layer in self.content_layers:
+      shape = self.vgg[layer].get_shape().as_list()[1:]
+      self.target_content_variables[layer] = self._target_variable(
+          shape, 'target_' + layer)
+    self.target_gram_variables = []
+    for G, layer in zip(self.gram_matrix_functions, self.style_layers):
+      shape = G.get_shape().as_list()
+      self.target_gram_variables.append(self._target_variable(
+          shape, 'target_gram_' + layer))
+    self.style_layer_weights = self._target_variable(
+        [len(self.style_layers)], 'style_layer_weights')
+
+    # Build the losses and their gradients once
+    self.alpha = tf.placeholder_with_default(1.0, [], name = 'alpha')
+    self.beta = tf.placeholder_with_default(1.0, [], name = 'beta')
+    self.content_loss = self.get_content_loss_function()
+    self.style_loss = self.get_style_loss_function()
+    self.exact_style_loss = self.style_loss
+    if self.gram_sampling is not None:
+      self.exact_style_loss = style_loss(self.gram_matrix_functions,
+                                         self.target_gram_variables,
+                                         self.style_layer_weights)
+    self.total_loss = self.alpha * self.content_loss + self.beta * self.style_loss
+    self.content_gradient = self._gradient(self.content_loss)
+    self.style_gradient = self._gradient(self.style_loss)
+    self.total_gradient = self._gradient(self.total_loss)
+
+  def objective_tensors(self):
+    '''
+      The inputs and outputs of the objective graph, by role. Used to export
+      and re-import it (see artifact.py).
+    '''
+    return {
+      'image' : self.image,
+      'alpha' : self.alpha,
+      'beta' : self.beta,
+      'content_loss' : self.content_loss,
+      'style_loss' : self.style_loss,
+      'exact_style_loss' : self.exact_style_loss,
+      'total_loss' : self.total_loss,
+      'content_gradient' : self.content_gradient,
+      'style_gradient' : self.style_gradient,
+      'total_gradient' : self.total_gradient
+    }
 
-    # Convert content and style to BGR
-    new_image_shape = (1, self.width, self.height, NUM_CHANNELS)
-    self.style = self.vgg.toBGR(style.reshape(new_image_shape))
-    self.content = self.vgg.toBGR(content.reshape(new_image_shape))
+  def _target_variable(self, shape, name):
+    return tf.Variable(tf.zeros(shape), trainable = False, name = name)
 
-    # Get the feature maps for the style and content we want
-    self.target_content = self.get_content_features(self.content)
-   
-    # Create symbolic gram matrices and target gram matrices for style image
-    self.gram_matrix_functions = self.get_gram_matrices()
-    self.target_gram_matrices = [] 
-    for G in self.gram_matrix_functions:
-      self.target_gram_matrices.append(self.sess.run(G, {self.image : self.style}))
+  def _gradient(self, loss):
+    if self.checkpoint_every is None:
+      return tf.gradients(loss, self.image)[0]
+    return self.vgg.checkpointed_gradient(loss, self.checkpoint_every)
 
-    self.synthetic = self.image
+  def _as_image(self, image):
+    # L-BFGS works on flattened float64 vectors; VGG expects a float32 batch
+    return np.reshape(image, (1, self.width, self.height, NUM_CHANNELS)).astype(np.float32)
 
-  
+  def close(self):
+    self.sess.close()
 
   #############################################################################
   # content representation
   #############################################################################
 
   def get_content_features(self, image):
-    if image.shape != (1, self.width, self.width, NUM_CHANNELS):
-      image = tf.reshape(image, (1, self.width, self.width, NUM_CHANNELS))
-      image = self.sess.run(image, {self.image : self.synthetic})
+    image = self._as_image(image)
+    layers = [self.vgg[layer] for layer in self.content_layers]
+    features = self.sess.run(layers, feed_dict={self.image : image})
     content = {}
-    for layer in self.content_layers:
-      content[layer] = self.sess.run(self.vgg[layer], feed_dict={self.image : image})[0]
+    for layer, feature in zip(self.content_layers, features):
+      content[layer] = feature[0]
     return content 
 
+  def set_content(self, content):
+    self.content = self.vgg.toBGR(self.open_image(content))
+
+    # Get the feature maps for the content we want
+    if self.feature_cache is None:
+      self.target_content = self.get_content_features(self.content)
+    else:
+      key = FeatureCache.key(self.content, self.width, self.height,
+                             self.content_layers, self.precision, self.backbone)
+      self.target_content = self.feature_cache.get_or_compute(
+          key, lambda: self.get_content_features(self.content))
+    for layer in self.content_layers:
+      self.target_content_variables[layer].load(self.target_content[layer], self.sess)
+
   def get_content_loss(self, image):
-    if image.shape != (1, self.width, self.width, NUM_CHANNELS):
-      image = tf.reshape(image, (1, self.width, self.width, NUM_CHANNELS))
-      image = self.sess.run(image, {self.image : self.synthetic})
-    loss = self.get_content_loss_function()
-    return self.sess.run(loss, {self.image : image})
+    return self.sess.run(self.content_loss, {self.image : self._as_image(image)})
 
   def get_content_loss_function(self):
-    content_layer_loss = []
-    for layer in self.content_layers:
-      F_minus_P = self.vgg[layer] - tf.constant(self.target_content[layer])
-      F_minus_P_2 = 0.5 * tf.square(F_minus_P)
-      content_layer_loss.append(tf.reduce_mean(F_minus_P_2))
-    return tf.reduce_mean(content_layer_loss)
+    features = dict((layer, self.vgg[layer]) for layer in self.content_layers)
+    return content_loss(features, self.target_content_variables, self.content_layers)
 
   def get_content_loss_gradient(self, image):
-    if image.shape != (1, self.width, self.width, NUM_CHANNELS):
-      image = tf.reshape(image, (1, self.width, self.width, NUM_CHANNELS))
-      image = self.sess.run(image, {self.image : self.synthetic})
-    loss = self.get_content_loss_function()
-    gr = tf.gradients(loss, self.image)
-    content_gradient = self.sess.run(gr, {self.image : image})[0]
-    content_loss = self.sess.run(loss, {self.image : image})
+    content_gradient, content_loss = self.sess.run(
+        [self.content_gradient, self.content_loss],
+        {self.image : self._as_image(image)})
     return (content_gradient, content_loss)
 
 
@@ -108,84 +332,253 @@ class Transfer:
 
   def get_gram_matrices(self):
     features = self.get_style_features()
-    gram_matrices = []
-    for l in range(len(self.style_layers)):
-      num_feature = self.sess.run(tf.shape(features[l])[3])
-
-      # Using '-1' flattens the tensor. So -1 = 'M_L**2' in this case.
-      A = tf.reshape(features[l], [-1, num_feature])
-      gram_matrices.append(tf.matmul(A, A, transpose_a = True))
-    return gram_matrices
+    return [gram_matrix(F)[0] for F in features]
+
+
+  def get_synthetic_gram_matrices(self):
+    if self.gram_sampling is None:
+      return self.gram_matrix_functions
+    return [sampled_gram_matrix(F, self.gram_sample_fraction, self.gram_sampling)
+            for F in self.get_style_features()]
+
+
+  def get_style_grams(self, style):
+    '''
+      Gram matrices of a style image (BGR batch), one per style layer. Read
+      from the feature cache when there is one.
+    '''
+    compute = lambda: dict(zip(self.style_layers, self.sess.run(
+        self.gram_matrix_functions, {self.image : style})))
+    if self.feature_cache is None:
+      grams = compute()
+    else:
+      key = FeatureCache.key(style, self.width, self.height, self.style_layers,
+                             self.precision, self.backbone, 'gram')
+      grams = self.feature_cache.get_or_compute(key, compute)
+    return [grams[layer] for layer in self.style_layers]
+
+
+  def set_style(self, style, style_weights = None, style_layer_weights = None):
+    '''
+      style is an image or a list of images to blend. style_weights gives
+      one weight per style, and style_layer_weights one weight per style
+      layer, either shared by all styles or as a list per style.
+    '''
+    styles = style if isinstance(style, (list, tuple)) else [style]
+    if style_weights is None:
+      style_weights = [1.0] * len(styles)
+    if style_layer_weights is None:
+      style_layer_weights = [1.0] * len(self.style_layers)
+    if not isinstance(style_layer_weights[0], (list, tuple)):
+      style_layer_weights = [style_layer_weights] * len(styles)
+
+    self.styles = [self.vgg.toBGR(self.open_image(s)) for s in styles]
+    self.style = self.styles[0]
+
+    # Create target gram matrices for each style image and blend them
+    grams = [self.get_style_grams(s) for s in self.styles]
+    self.target_gram_matrices, layer_weights = blend_grams(
+        grams, style_weights, style_layer_weights)
+    for variable, G in zip(self.target_gram_variables, self.target_gram_matrices):
+      variable.load(G, self.sess)
+    self.style_layer_weights.load(layer_weights, self.sess)
 
 
   def get_style_loss(self, image):
-    if image.shape != (1, self.width, self.height, NUM_CHANNELS):
-      image = tf.reshape(image, (1, self.width, self.height, NUM_CHANNELS))
-      image = self.sess.run(image, {self.image : self.synthetic})
-    loss_style = self.get_style_loss_function()
-    return self.sess.run(loss_style, {self.image : image})
+    return self.sess.run(self.style_loss, {self.image : self._as_image(image)})
 
   def get_style_loss_function(self):
-    E = []
-    for l in range(len(self.target_gram_matrices)):
-      E.append(tf.reduce_mean(tf.square(self.gram_matrix_functions[l] - self.target_gram_matrices[l])))
-    return tf.reduce_mean(E)
+    return style_loss(self.synthetic_gram_functions, self.target_gram_variables,
+                      self.style_layer_weights)
 
 
   def get_style_loss_gradient(self, image):
-    if image.shape != (1, self.width, self.height, NUM_CHANNELS):
-      image = tf.reshape(image, (1, self.width, self.height, NUM_CHANNELS))
-      image = self.sess.run(image, {self.image : self.synthetic})
-    loss = self.get_style_loss_function()
-    gr = tf.gradients(loss, self.image)
-    style_gradient = self.sess.run(gr, {self.image : image})[0]
-    style_loss = self.sess.run(loss, {self.image : image})
+    style_gradient, style_loss = self.sess.run(
+        [self.style_gradient, self.style_loss],
+        {self.image : self._as_image(image)})
     return (style_gradient, style_loss)
 
 
+  def loss_and_gradient(self, image, alpha = 1, beta = 1):
+    '''
+      Evaluates the weighted content and style losses and the gradient of
+      their sum in a single session run. Returns (gradient, content_loss,
+      style_loss) where the losses are unweighted.
+    '''
+    gradient, c_loss, s_loss = self.sess.run(
+        [self.total_gradient, self.content_loss, self.style_loss],
+        {self.image : self._as_image(image), self.alpha : alpha, self.beta : beta})
+    return (gradient, c_loss, s_loss)
+
+  def losses(self, image):
+    '''
+      (content_loss, style_loss), unweighted, from a forward pass only.
+    '''
+    return tuple(self.sess.run([self.content_loss, self.style_loss],
+                               {self.image : self._as_image(image)}))
+
+
 
   #############################################################################
   # execute
   #############################################################################
 
-  def transfer_style_to_image(self, out_dir = '.', alpha = 1, beta = 1,
-                              params = {
-                                'type' : 'sgd',
-                                'step_size' : 1.0,
-                                'iters' : 100,
-                                'gamma' : 0.9
-                              }):
-    synthetic = copy.copy(self.synthetic)
+  def style_params(self, name, out_dir, alpha, beta):
+    '''
+      SGD params for the style transfer objective weighted by alpha and
+      beta, starting from the initial image: theta, dJdTheta, J and the
+      save, record and display callbacks. Results are saved to out_dir under
+      name. Shared by the first-order, hybrid and streamed runs, and by
+      callers driving SGD themselves.
+    '''
+    terms = {}
     def loss_gradient(image):
-      c_grad, c_loss = self.get_content_loss_gradient(image)
-      s_grad, s_loss = self.get_style_loss_gradient(image)
-      print('-------------------------')
-      print('Style Loss = {}'.format(beta*s_loss))
-      print('Content Loss = {}'.format(alpha*c_loss))
-      print('Content / Style loss {}'.format((alpha*c_loss) / (beta*s_loss)))
-      return (alpha*c_grad + beta*s_grad, alpha*c_loss + beta*s_loss)
+      grad, c_loss, s_loss = self.loss_and_gradient(image, alpha, beta)
+      terms.update({'content_loss' : float(c_loss), 'style_loss' : float(s_loss)})
+      if self.display:
+        print('-------------------------')
+        print('Style Loss = {}'.format(beta*s_loss))
+        print('Content Loss = {}'.format(alpha*c_loss))
+        print('Content / Style loss {}'.format((alpha*c_loss) / (beta*s_loss)))
+      return (grad, alpha*c_loss + beta*s_loss)
 
     def loss(image):
-      c_loss = self.get_content_loss(image)
-      s_loss = self.get_style_loss(image)
-      
-      return alpha*c_loss + beta*s_loss
+      return self.sess.run(self.total_loss, {self.image : self._as_image(image),
+                                             self.alpha : alpha,
+                                             self.beta : beta})
     
     base_params = {
-      'name' : 'Image Style Transfer',
-      'theta' : synthetic,
+      'name' : name,
+      'theta' : copy.copy(self.synthetic),
       'dJdTheta' : loss_gradient,
       'J' : loss,
-      'init_display' : self._init_display,
-      'update_display' : self._update_display,
       'save' : self._save,
+      'record' : lambda p: terms,
       'out_dir' : out_dir
     }
+    base_params.update(self._display_params())
+    return base_params
+
+  def transfer_style_to_image(self, out_dir = '.', alpha = 1, beta = 1,
+                              params = {
+                                'type' : 'sgd',
+                                'step_size' : 1.0,
+                                'iters' : 100,
+                                'gamma' : 0.9
+                              }):
+    base_params = self.style_params('Image Style Transfer', out_dir, alpha, beta)
     base_params.update(params)
      
     return SGD(base_params).optimize()
 
 
+  # First-order steps from the initial image, then L-BFGS from where they
+  # stopped. See SGD.optimize_phases for the phases.
+  def transfer_style_hybrid(self, out_dir = '.', alpha = 1, beta = 1,
+                            phases = [
+                              {'type' : 'adadelta', 'iters' : 50, 'gamma' : 0.9,
+                               'tol' : 1e-3},
+                              {'type' : 'lbfgs', 'iters' : 200, 'factr' : 1e7}
+                            ], params = {}):
+    base_params = self.style_params('Hybrid Image Style Transfer', out_dir, alpha, beta)
+    base_params.update(params)
+
+    return SGD(base_params).optimize_phases(phases)
+
+
+  def stream(self, alpha = 1, beta = 1, iters = (1, 5, 20, 50, 100), losses = (),
+             params = {
+               'type' : 'adam',
+               'step_size' : 'auto',
+               'iters' : 100
+             }):
+    '''
+      Optimizes in a background thread and yields previews as it goes: at
+      the iteration counts in 'iters', when the loss first drops below each
+      fraction of the initial loss in 'losses', and once at the end.
+
+      Each preview is a dict with the 'iter', 'loss', RGB 'image', synthetic
+      'theta', 'seconds' since the call, 'final' and 'skipped'. The optimizer
+      never waits for the consumer: a slow consumer gets the latest preview
+      and 'skipped' counts the ones it missed. Closing the generator stops
+      the optimizer. The session must not be used elsewhere meanwhile.
+    '''
+    base_params = self.style_params('Streamed Image Style Transfer', None, alpha, beta)
+    base_params['verbose'] = False
+    base_params.update(params)
+    base_params.update({
+      'save' : lambda p: p,
+      'init_display' : lambda p: None,
+      'update_display' : lambda p: update(p)
+    })
+
+    milestones = set(iters)
+    pending = sorted(losses, reverse = True)
+    condition = threading.Condition()
+    stop = threading.Event()
+    slot = {'preview' : None, 'published' : 0, 'done' : False, 'error' : None}
+    start = time.time()
+
+    def publish(p, final = False):
+      preview = {
+        'iter' : p['iter'],
+        'loss' : float(p['loss'][-1]) if p['loss'] else None,
+        'theta' : np.array(p['theta'], copy = True),
+        'seconds' : time.time() - start,
+        'final' : final
+      }
+      with condition:
+        slot['published'] += 1
+        preview['index'] = slot['published']
+        slot['preview'] = preview
+        condition.notify()
+
+    def update(p):
+      if stop.is_set():
+        raise StreamClosed()
+      hit = p['iter'] in milestones
+      while pending and p['loss'][-1] <= pending[0] * p['loss'][0]:
+        pending.pop(0)
+        hit = True
+      if hit:
+        publish(p)
+
+    def optimize():
+      try:
+        publish(SGD(base_params).optimize(), final = True)
+      except StreamClosed:
+        pass
+      except Exception as e:
+        slot['error'] = e
+      finally:
+        with condition:
+          slot['done'] = True
+          condition.notify()
+
+    thread = threading.Thread(target = optimize)
+    thread.daemon = True
+    thread.start()
+
+    seen = 0
+    try:
+      while True:
+        with condition:
+          while slot['published'] == seen and not slot['done']:
+            condition.wait()
+          preview = slot['preview'] if slot['published'] > seen else None
+        if preview is None:
+          break
+        preview = dict(preview, image = self.output_image(preview['theta']),
+                       skipped = preview['index'] - seen - 1)
+        seen = preview['index']
+        yield preview
+    finally:
+      stop.set()
+      thread.join()
+    if slot['error'] is not None:
+      raise slot['error']
+
+
   # note that with the SciPy L-BFGS implementation, the image must be
   # recorded as a vector
   def transfer_style_to_image_lbfgs(self, out_dir = '.', alpha = 1, beta = 1,
@@ -198,58 +591,70 @@ class Transfer:
     synthetic = copy.copy(self.synthetic)
 
     params['loss'] = []
+    params['metrics'] = []
     params['iter'] = 0          # track number of iterations
     params['name'] = 'L-BFGS Image Style Transfer'
 
     def loss_gradient(image):
-      c_grad, c_loss = self.get_content_loss_gradient(image)
-      s_grad, s_loss = self.get_style_loss_gradient(image)
-      print('Style loss = {}'.format(s_loss))
-      print('Content loss = {}'.format(c_loss))
-      print('Content / Style loss {}'.format(c_loss / s_loss))
-      out = alpha * c_grad + beta * s_grad
+      start = time.time()
+      out, c_loss, s_loss = self.loss_and_gradient(image, alpha, beta)
+      # SciPy evaluates the gradient right after the loss at the same point
+      if params['metrics']:
+        params['metrics'][-1].update({
+          'content_loss' : float(c_loss),
+          'style_loss' : float(s_loss),
+          'grad_norm' : float(np.linalg.norm(out)),
+          'seconds' : params['metrics'][-1]['seconds'] + time.time() - start
+        })
+      if self.display:
+        print('Style loss = {}'.format(s_loss))
+        print('Content loss = {}'.format(c_loss))
+        print('Content / Style loss {}'.format(c_loss / s_loss))
       out = out.flatten()
       return np.float64(out)     # convert to float64
 
     def loss(image):
       # update display
-      result = tf.reshape(image, (1, self.width, self.height, NUM_CHANNELS))
-      result = self.sess.run(result, {self.image : self.synthetic})
-      result = self.vgg.toRGB(result)[0]
-      result = np.clip(result, 0, 1)
-      im.set_data(result)
-      skimage.io.imsave(os.path.join(out_dir, 'lbfgs_style_transfer.jpg'), result[0])
-      plt.title('{} (iteration {})'.format(params['name'], params['iter']))
-      plt.pause(PAUSE_LEN)
+      if self.display:
+        result = self.vgg.toRGB(self._as_image(image))[0]
+        result = np.clip(result, 0, 1)
+        im.set_data(result)
+        io.imsave(os.path.join(out_dir, 'lbfgs_style_transfer.jpg'), result)
+        plt.title('{} (iteration {})'.format(params['name'], params['iter']))
+        plt.pause(PAUSE_LEN)
 
       # get loss and compute loss function
-      c_loss = self.get_content_loss(image)
-      s_loss = self.get_style_loss(image)
-
-      loss = alpha*c_loss + beta*s_loss
+      start = time.time()
+      loss = self.sess.run(self.total_loss, {self.image : self._as_image(image),
+                                             self.alpha : alpha,
+                                             self.beta : beta})
 
       params['iter'] += 1
       params['loss'].append(loss)
+      params['metrics'].append({
+        'iter' : params['iter'],
+        'loss' : float(loss),
+        'seconds' : time.time() - start
+      })
       return loss
 
-    plt.ion()
-    plt.title('L-BFGS Image Style Transfer')
-    im = plt.imshow(np.clip(self.vgg.toRGB(synthetic)[0], 0, 1))
-    plt.pause(PAUSE_LEN)
+    if self.display:
+      plt.ion()
+      plt.title('L-BFGS Image Style Transfer')
+      im = plt.imshow(np.clip(self.vgg.toRGB(synthetic)[0], 0, 1))
+      plt.pause(PAUSE_LEN)
 
     self.synthetic = synthetic
-    theta = tf.reshape(synthetic, [-1])      # flatten vector
-    theta = tf.cast(theta, tf.float64)       # convert to tf.float64. necessary for scipy.optimize
-    theta = self.sess.run(theta, {self.image : synthetic})
+    # flatten and convert to float64. necessary for scipy.optimize
+    theta = np.float64(synthetic.flatten())
     base_params = {
       'theta' : theta,
       'dJdTheta' : loss_gradient,
       'J' : loss,
-      'init_display' : self._init_display,
-      'update_display' : self._update_display,
       'save' : self._save,
       'out_dir' : out_dir
     }
+    base_params.update(self._display_params())
     base_params.update(params)
 
     return SGD(base_params).optimize_lbfgs()
@@ -267,11 +672,10 @@ class Transfer:
       'theta' : synthetic,
       'dJdTheta' : self.get_content_loss_gradient,
       'J' : self.get_content_loss,
-      'init_display' : self._init_display,
-      'update_display' : self._update_display,
       'save' : self._save,
       'out_dir' : out_dir
     }
+    base_params.update(self._display_params())
     base_params.update(params)
 
     return SGD(base_params).optimize()
@@ -288,11 +692,10 @@ class Transfer:
       'theta' : synthetic,
       'dJdTheta' : self.get_style_loss_gradient,
       'J' : self.get_style_loss,
-      'init_display' : self._init_display,
-      'update_display' : self._update_display,
       'save' : self._save,
       'out_dir' : out_dir
     }
+    base_params.update(self._display_params())
     base_params.update(params)
     return SGD(base_params).optimize()
 
@@ -301,9 +704,7 @@ class Transfer:
   #############################################################################
 
   def set_initial_img(self, image):
-    image = utils.load_image2(image, self.width, self.height)
-    image = image.reshape((1, self.width, self.height, NUM_CHANNELS))
-    self.synthetic = self.vgg.toBGR(image)
+    self.synthetic = self.vgg.toBGR(self.open_image(image))
 
   def set_random_initial_img(self):
       rand_noise = np.random.rand(self.width, self.height)
@@ -313,13 +714,26 @@ class Transfer:
       self.synthetic = self.vgg.toBGR(white_noise)
 
 
-  def open_image(self, image_path):
-    image = utils.load_image2(image_path, self.width, self.height)
+  # Accepts either a path or an RGB array with values in [0, 1]
+  def open_image(self, image):
+    if isinstance(image, np.ndarray):
+      image = image.reshape(image.shape[-3:])
+      image = transform.resize(image, (self.width, self.height), mode='constant')
+    else:
+      image = utils.load_image2(image, self.width, self.height)
     return image.reshape((1, self.width, self.height, NUM_CHANNELS))
 
 
   # Shared 'lambda' functions used inside of optimize to display images
   # as they are being updated/generated
+  def _display_params(self):
+    if not self.display:
+      return {}
+    return {
+      'init_display' : self._init_display,
+      'update_display' : self._update_display
+    }
+
   def _init_display(self, params):
     plt.title(params['name'])
     plt.ion()
@@ -333,24 +747,52 @@ class Transfer:
     print('Loss on iteration {}: {}'.format(params['iter'], params['loss'][-1]))
 
 
-  def _save(self, params):
-    image = params['theta']
-    if image.shape != (1, self.width, self.width, NUM_CHANNELS):
-        image = tf.reshape(image, (1, self.width, self.width, NUM_CHANNELS))
-        image = self.sess.run(image, {self.image : self.synthetic})
-
-    out = self.vgg.toRGB(image)
-    out = np.clip(out, 0, 1)
-
-    filename = params['type'] + '_' + params['name'] 
-    skimage.io.imsave(os.path.join(params['out_dir'], filename + '.jpg'), out[0])
-    
-    plt.clf()
-    f, ax = plt.subplots(1)
-    ax.set_ylim(bottom=0, top = max(params['loss']))
+  def output_image(self, image):
+    '''
+      The RGB result for a synthetic image, clipped to [0, 1].
+    '''
+    return np.clip(self.vgg.toRGB(self._as_image(image)), 0, 1)
 
-    plt.plot(params['loss'])
-    plt.savefig(os.path.join(params['out_dir'], filename + '_loss.jpg'))
 
-    return out 
+  def _save(self, params):
+    '''
+      Writes the final image and the metrics log. The loss curve is no
+      longer rendered here: run plot_metrics.py on the log instead.
+    '''
+    out = self.output_image(params['theta'])
 
+    filename = params['type'] + '_' + params['name'] 
+    metrics = params.get('metrics') or [{'iter' : i + 1, 'loss' : float(l)}
+                                        for i, l in enumerate(params['loss'])]
+    writer = ResultsWriter(params['out_dir'], filename,
+                           self.image_format, self.metrics_format)
+    writer.write(out[0], metrics)
+
+    # Iterations the last run took, e.g. to report warm start savings
+    self.iterations = len(metrics)
+
+    return out
+
+
+def stream_pyramid(style, content, sizes = (64, 128, 240), iters = (1, 10, 30),
+                   alpha = 1, beta = 1e3, params = None, **transfer_args):
+  '''
+    Coarse-to-fine previews: streams a Transfer at each size in turn, each
+    starting from the previous level's result, and yields their previews
+    with the pyramid 'level' added. The first preview comes from the
+    smallest, cheapest level.
+  '''
+  run_params = {'type' : 'adam', 'step_size' : 'auto', 'iters' : max(iters)}
+  run_params.update(params or {})
+  initial = None
+  for level, size in enumerate(sizes):
+    transfer = Transfer(style, content, size, size, display = False, **transfer_args)
+    try:
+      if initial is not None:
+        transfer.set_initial_img(initial)
+      for preview in transfer.stream(alpha, beta, iters, params = run_params):
+        preview['level'] = level
+        initial = preview['image'][0]
+        yield preview
+    finally:
+      transfer.close()
@@ -0,0 +1,279 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from lazy import lazy_import
+from masked import load_rgb
+from transfer import Transfer
+
+io = lazy_import('skimage.io')
+ndimage = lazy_import('scipy.ndimage')
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+###########################################################
+# Optical flow
+###########################################################
+
+def _gray(image):
+  return np.mean(image, axis=2)
+
+
+def _lucas_kanade(a, b, sigma):
+  # Dense Lucas-Kanade: solve the 2x2 structure tensor system at every pixel
+  # with a gaussian window of width 'sigma'
+  Iy, Ix = np.gradient(a)
+  It = b - a
+  Ixx = ndimage.gaussian_filter(Ix * Ix, sigma)
+  Iyy = ndimage.gaussian_filter(Iy * Iy, sigma)
+  Ixy = ndimage.gaussian_filter(Ix * Iy, sigma)
+  Ixt = ndimage.gaussian_filter(Ix * It, sigma)
+  Iyt = ndimage.gaussian_filter(Iy * It, sigma)
+
+  det = Ixx * Iyy - Ixy ** 2
+  det[np.abs(det) < 1e-9] = np.inf     # flat regions get zero flow
+  u = (-Iyy * Ixt + Ixy * Iyt) / det
+  v = (Ixy * Ixt - Ixx * Iyt) / det
+  return np.stack((v, u), axis=0)
+
+
+def warp(image, flow):
+  '''
+    Samples 'image' at x + flow(x). Works on both gray (H, W) and color
+    (H, W, C) images.
+  '''
+  rows, cols = np.meshgrid(np.arange(flow.shape[1]), np.arange(flow.shape[2]),
+                           indexing='ij')
+  coords = [rows + flow[0], cols + flow[1]]
+  if image.ndim == 2:
+    return ndimage.map_coordinates(image, coords, order=1, mode='nearest')
+  channels = [ndimage.map_coordinates(image[:, :, c], coords, order=1, mode='nearest')
+              for c in range(image.shape[2])]
+  return np.stack(channels, axis=2)
+
+
+def estimate_flow(a, b, levels = 3, sigma = 2.0):
+  '''
+    Cheap coarse-to-fine Lucas-Kanade flow on the CPU. Returns a (2, H, W)
+    array of (row, col) displacements such that b(x + flow(x)) ~ a(x).
+  '''
+  if a.ndim == 3:
+    a, b = _gray(a), _gray(b)
+
+  pyramid = [(a, b)]
+  for _ in range(levels - 1):
+    a, b = pyramid[-1]
+    if min(a.shape) < 16:
+      break
+    pyramid.append((ndimage.zoom(a, 0.5, order=1), ndimage.zoom(b, 0.5, order=1)))
+
+  flow = None
+  for a, b in reversed(pyramid):
+    if flow is None:
+      flow = np.zeros((2,) + a.shape)
+    else:
+      # Upsample the coarser estimate and scale the displacements with it
+      scale = [1.0, float(a.shape[0]) / flow.shape[1], float(a.shape[1]) / flow.shape[2]]
+      flow = ndimage.zoom(flow, scale, order=1)
+      flow[0] *= scale[1]
+      flow[1] *= scale[2]
+    flow += _lucas_kanade(a, warp(b, flow), sigma)
+  return flow
+
+
+###########################################################
+# Frame sources and sinks
+###########################################################
+
+def frame_paths(frame_dir):
+  return [os.path.join(frame_dir, f) for f in sorted(os.listdir(frame_dir))
+          if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def read_frames(frame_dir):
+  # RGB in [0, 1] whatever the bit depth and channels of the files
+  for path in frame_paths(frame_dir):
+    yield load_rgb(path)
+
+
+def write_frames(frames, out_dir, pattern = 'frame_{:05d}.png'):
+  for i, frame in enumerate(frames):
+    io.imsave(os.path.join(out_dir, pattern.format(i)), frame)
+    yield frame
+
+
+###########################################################
+# Video style transfer
+###########################################################
+
+class VideoTransfer:
+  '''
+    Stylizes a sequence of frames with a single Transfer. The session and the
+    style gram targets are shared across frames, and each frame is optimized
+    starting from the previous stylized frame (optionally warped by optical
+    flow) so it converges in a fraction of the iterations.
+
+    params are passed to Transfer.transfer_style_to_image; 'iters' is used
+    for the first frame and 'warm_iters' for every frame after it. 'tol'
+    stops a frame early once its loss has converged.
+  '''
+
+  default_params = {
+    'type' : 'adadelta',
+    'step_size' : 1.0,
+    'iters' : 200,
+    'warm_iters' : 50,
+    'gamma' : 0.9,
+    'eps' : 1e-6,
+    'tol' : 1e-3,
+    'verbose' : False
+  }
+
+  def __init__(self, style, width = 240, height = 240, alpha = 1, beta = 1e3,
+               flow = True, params = {}, **transfer_args):
+    self.style = style
+    self.width = width
+    self.height = height
+    self.alpha = alpha
+    self.beta = beta
+    self.flow = flow
+    self.transfer_args = transfer_args
+
+    self.params = {}
+    self.params.update(VideoTransfer.default_params)
+    self.params.update(params)
+
+    self.transfer = None
+    self.report = []
+    self.baseline_seconds = None
+
+  def stylize(self, frames):
+    '''
+      Generator that takes frames (RGB arrays in [0, 1] or image paths) and
+      yields the stylized RGB frames in order.
+    '''
+    previous = None
+    previous_content = None
+
+    for i, frame in enumerate(frames):
+      start = time.time()
+      frame = load_rgb(frame)
+      if self.transfer is None:
+        self.transfer = Transfer(self.style, frame, self.width, self.height,
+                                 display = False, **self.transfer_args)
+      else:
+        self.transfer.set_content(frame)
+      content = self.transfer.vgg.toRGB(self.transfer.content)[0]
+
+      params = dict(self.params)
+      params['save'] = lambda p: p
+      if previous is None:
+        self.transfer.set_initial_img(content)
+      else:
+        initial = previous
+        if self.flow:
+          initial = warp(previous, estimate_flow(content, previous_content))
+        self.transfer.set_initial_img(np.clip(initial, 0, 1))
+        params['iters'] = params['warm_iters']
+
+      result = self.transfer.transfer_style_to_image(alpha = self.alpha,
+                                                     beta = self.beta,
+                                                     params = params)
+      stylized = np.clip(self.transfer.vgg.toRGB(result['theta'])[0], 0, 1)
+
+      self.report.append({
+        'frame' : i,
+        'iters' : result['iter'],
+        'loss' : result['loss'][-1],
+        'seconds' : time.time() - start
+      })
+      previous = stylized
+      previous_content = content
+      yield stylized
+
+  def run(self, frames, out_dir = None):
+    '''
+      Stylizes every frame, writing them to 'out_dir' if given, and returns
+      the per-frame report.
+    '''
+    if isinstance(frames, str):
+      frames = read_frames(frames)
+    stylized = self.stylize(frames)
+    if out_dir is not None:
+      stylized = write_frames(stylized, out_dir)
+    for _ in stylized:
+      pass
+    return self.report
+
+  def measure_baseline(self, frame):
+    '''
+      Times 'frame' as an independent job would run it: a new Transfer and
+      its targets, then 'iters' iterations from the content. summary() then
+      uses it as the per-frame baseline.
+    '''
+    start = time.time()
+    transfer = Transfer(self.style, frame, self.width, self.height,
+                        display = False, **self.transfer_args)
+    try:
+      transfer.set_initial_img(transfer.vgg.toRGB(transfer.content)[0])
+      transfer.transfer_style_to_image(alpha = self.alpha, beta = self.beta,
+                                       params = dict(self.params, save = lambda p: p))
+    finally:
+      transfer.close()
+    self.baseline_seconds = time.time() - start
+    return self.baseline_seconds
+
+  def summary(self):
+    '''
+      Compares the total time against stylizing each frame independently.
+      The per-frame baseline is the one timed by measure_baseline, or else
+      estimated from the first frame, which is optimized like an independent
+      job but shares nothing with a restart ('baseline_measured' is False).
+    '''
+    total = sum(r['seconds'] for r in self.report)
+    measured = self.baseline_seconds is not None
+    per_frame = self.baseline_seconds if measured else self.report[0]['seconds']
+    baseline = per_frame * len(self.report)
+    return {
+      'frames' : len(self.report),
+      'total_seconds' : total,
+      'baseline_seconds' : baseline,
+      'baseline_measured' : measured,
+      'speedup' : baseline / total if total > 0 else 0
+    }
+
+  def print_report(self):
+    print('{:>6} {:>6} {:>10} {:>14}'.format('frame', 'iters', 'seconds', 'loss'))
+    for r in self.report:
+      print('{:>6} {:>6} {:>10.3f} {:>14.4e}'.format(r['frame'], r['iters'],
+                                                     r['seconds'], r['loss']))
+    s = self.summary()
+    print('Total: {:.2f}s for {} frames, independent baseline {} {:.2f}s, speedup {:.2f}x'.format(
+          s['total_seconds'], s['frames'],
+          'measured' if s['baseline_measured'] else 'estimated from frame 0',
+          s['baseline_seconds'], s['speedup']))
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Stylize a directory of video frames.')
+  parser.add_argument('style', help='style image')
+  parser.add_argument('frames', help='directory of input frames')
+  parser.add_argument('out_dir', help='directory for stylized frames')
+  parser.add_argument('--width', type=int, default=240)
+  parser.add_argument('--height', type=int, default=240)
+  parser.add_argument('--iters', type=int, default=200)
+  parser.add_argument('--warm-iters', type=int, default=50)
+  parser.add_argument('--no-flow', action='store_true')
+  parser.add_argument('--measure-baseline', action='store_true',
+                      help='time the last frame as an independent job for the speedup')
+  args = parser.parse_args()
+
+  video = VideoTransfer(args.style, args.width, args.height, flow = not args.no_flow,
+                        params = {'iters' : args.iters, 'warm_iters' : args.warm_iters})
+  video.run(args.frames, args.out_dir)
+  if args.measure_baseline:
+    video.measure_baseline(frame_paths(args.frames)[-1])
+  video.print_report()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import math
+import os
+import time
+import uuid
+
+import numpy as np
+
+from cache import source_hash
+
+###########################################################
+# Warm starts from earlier results.
+#
+# Reruns of a content / style pair with a slightly different alpha, beta or
+# resolution converge much faster from the earlier synthesis than from
+# noise or the raw content. ResultStore keeps finished syntheses on disk,
+# grouped by (content, style, layers), and initializes a new job from the
+# closest one, resized to the job's size.
+###########################################################
+
+
+def comparable(params):
+  '''
+    Whether a job's alpha / beta ratio can be compared: content-only or
+    style-only jobs (a zero weight) are neither warm started nor used to
+    warm start others.
+  '''
+  return params['alpha'] > 0 and params['beta'] > 0
+
+
+def distance(params, width, height, entry):
+  '''
+    How far a stored result is from a new job. Only the ratio alpha / beta
+    changes the minimizer, so that is compared on a log scale, together with
+    the log ratio of the number of pixels.
+  '''
+  if not (comparable(params) and comparable(entry['params'])):
+    raise ValueError('alpha and beta must be positive to compare jobs, got {} and {}'.format(
+                     params, entry['params']))
+  ratio = math.log(float(params['alpha']) / params['beta'])
+  prior = math.log(float(entry['params']['alpha']) / entry['params']['beta'])
+  pixels = math.log(float(width * height) / (entry['width'] * entry['height']))
+  return abs(ratio - prior) + abs(pixels)
+
+
+class ResultStore:
+  '''
+    Finished syntheses in 'directory', one subdirectory per key with a .npy
+    image (RGB in [0, 1]) and a .json record per result. At most
+    'per_key' results are kept for each key, the oldest are dropped first.
+
+    Each record also carries 'cold_iters', the iterations the cold start it
+    descends from took, so that every warm start can report how many
+    iterations it saved.
+  '''
+
+  def __init__(self, directory, per_key = 8):
+    if per_key < 1:
+      raise ValueError('per_key must be at least 1, got {}'.format(per_key))
+    self.directory = directory
+    self.per_key = per_key
+    self.warm_starts = 0
+    self.cold_starts = 0
+    self.iters_saved = 0
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  @staticmethod
+  def key(content, style, content_layers, style_layers, style_weights = None):
+    '''
+      content and style are paths or arrays; style may be a list of styles
+      blended with style_weights.
+    '''
+    styles = style if isinstance(style, (list, tuple)) else [style]
+    parts = [source_hash(content)] + [source_hash(s) for s in styles]
+    parts += [str(style_weights), ','.join(content_layers), ','.join(style_layers)]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+  def _dir(self, key):
+    return os.path.join(self.directory, key)
+
+  def records(self, key):
+    path = self._dir(key)
+    if not os.path.isdir(path):
+      return []
+    records = []
+    for name in os.listdir(path):
+      if name.endswith('.json'):
+        with open(os.path.join(path, name)) as f:
+          records.append(json.load(f))
+    return sorted(records, key = lambda r: r['time'])
+
+  def nearest(self, key, params, width, height):
+    if not comparable(params):
+      return None
+    records = [r for r in self.records(key) if comparable(r['params'])]
+    if not records:
+      return None
+    return min(records, key = lambda r: distance(params, width, height, r))
+
+  def warm_start(self, transfer, key, params):
+    '''
+      Sets transfer's initial image to the nearest stored result for key,
+      resized to the transfer's size. params holds the job's alpha and beta.
+      Returns the record used, or None if there was none or the job has a
+      zero weight (the initial image is then left alone).
+    '''
+    record = self.nearest(key, params, transfer.width, transfer.height)
+    if record is None:
+      return None
+    image = np.load(os.path.join(self._dir(key), record['id'] + '.npy'))
+    transfer.set_initial_img(image)
+    return record
+
+  def put(self, key, image, params, width, height, iters, start = None):
+    '''
+      Stores a finished result. start is the record returned by warm_start
+      for this job, if any. Returns a report with the iterations this job
+      saved against its cold start (0 for a cold start).
+    '''
+    if start is None:
+      cold_iters = iters
+      self.cold_starts += 1
+    else:
+      cold_iters = start['cold_iters']
+      self.warm_starts += 1
+    saved = max(cold_iters - iters, 0)
+    self.iters_saved += saved
+
+    record = {
+      'id' : uuid.uuid4().hex,
+      'time' : time.time(),
+      'params' : dict((k, params[k]) for k in ('alpha', 'beta')),
+      'width' : width,
+      'height' : height,
+      'iters' : iters,
+      'cold_iters' : cold_iters,
+      'from' : None if start is None else start['id']
+    }
+
+    path = self._dir(key)
+    if not os.path.isdir(path):
+      os.makedirs(path)
+    # The record is written last, so readers never see it without its image
+    np.save(os.path.join(path, record['id'] + '.npy'),
+            np.asarray(image, dtype = np.float32).reshape(np.shape(image)[-3:]))
+    tmp = os.path.join(path, record['id'] + '.json.tmp')
+    with open(tmp, 'w') as f:
+      json.dump(record, f)
+    os.rename(tmp, os.path.join(path, record['id'] + '.json'))
+
+    for old in self.records(key)[:-self.per_key]:
+      for ext in ('.json', '.npy'):
+        os.remove(os.path.join(path, old['id'] + ext))
+
+    return {
+      'warm' : start is not None,
+      'iters' : iters,
+      'cold_iters' : cold_iters,
+      'iters_saved' : saved
+    }
+
+  def stats(self):
+    return {
+      'warm_starts' : self.warm_starts,
+      'cold_starts' : self.cold_starts,
+      'iters_saved' : self.iters_saved
+    }
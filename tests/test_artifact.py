@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from artifact import CONFIG_KEYS, FrozenVgg, _metadata_node
+
+
+def test_frozen_vgg_exposes_only_the_given_layers():
+  vgg = FrozenVgg({'conv4_2' : 'tensor'})
+  assert vgg['conv4_2'] == 'tensor'
+  assert not hasattr(vgg, 'data_dict')
+
+
+def test_config_keys_cover_the_graph_shape():
+  assert {'width', 'height', 'precision', 'backbone'} <= set(CONFIG_KEYS)
+
+
+def test_metadata_round_trips_through_the_graph_def():
+  tf = pytest.importorskip('tensorflow')
+  metadata = {'width' : 120, 'style_layers' : ['conv1_1', 'conv2_1'],
+              'targets' : {'style_layer_weights' : ['weights', [2]]}}
+  graph_def = tf.GraphDef()
+  graph_def.node.extend([_metadata_node(metadata)])
+  graph_def.ParseFromString(graph_def.SerializeToString())
+
+  node = graph_def.node[0]
+  loaded = json.loads(tf.make_ndarray(node.attr['value'].tensor).item().decode())
+  assert loaded == metadata
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from backbones import Vgg16, backbone_class, map_layers, prune_channels
+from ext.tf_vgg import vgg19
+
+
+def conv_weights(layers, depths):
+  # Filter norms grow with the channel index, so the last ones are kept
+  data_dict = {}
+  previous = 3
+  for name, depth in zip(layers, depths):
+    filt = np.ones((3, 3, previous, depth)) * np.arange(1, depth + 1)
+    data_dict[name] = [filt, np.arange(depth, dtype = np.float64)]
+    previous = depth
+  return data_dict
+
+
+def test_pruning_keeps_the_largest_filters():
+  data_dict = conv_weights(['conv1_1', 'conv1_2'], [4, 6])
+  pruned = prune_channels(data_dict, ['conv1_1', 'conv1_2', 'pool1'], 0.5)
+  assert pruned['conv1_1'][0].shape == (3, 3, 3, 2)
+  assert pruned['conv1_1'][1].tolist() == [2, 3]
+  # The next layer loses the matching input channels
+  assert pruned['conv1_2'][0].shape == (3, 3, 2, 3)
+  assert pruned['conv1_2'][1].tolist() == [3, 4, 5]
+  assert data_dict['conv1_1'][0].shape == (3, 3, 3, 4)
+
+
+def test_pruning_keeps_at_least_one_channel():
+  data_dict = conv_weights(['conv1_1'], [4])
+  assert prune_channels(data_dict, ['conv1_1'], 0.01)['conv1_1'][1].tolist() == [3]
+
+
+def test_vgg16_maps_the_last_conv_of_a_block():
+  assert Vgg16.map_layer('conv4_4') == 'conv4_3'
+  assert Vgg16.map_layer('conv4_2') == 'conv4_2'
+  assert map_layers('vgg16', ['conv1_1', 'conv5_4']) == ['conv1_1', 'conv5_3']
+  assert map_layers('vgg19', ['conv5_4']) == ['conv5_4']
+  with pytest.raises(ValueError):
+    Vgg16.map_layer('conv6_1')
+
+
+def test_backbone_class():
+  assert backbone_class('vgg16') is Vgg16
+  assert backbone_class('vgg19_pruned25').layers == vgg19.LAYERS
+  with pytest.raises(ValueError):
+    backbone_class('resnet50')
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from transfer import blend_grams
+
+
+def styles(num_styles = 3, num_layers = 2, size = 4):
+  rng = np.random.RandomState(0)
+  return [[rng.rand(size, size) for _ in range(num_layers)] for _ in range(num_styles)]
+
+
+def test_one_style_is_its_own_target():
+  grams = styles(num_styles = 1)
+  targets, W = blend_grams(grams, [2.0], [[1.0, 0.5]])
+  assert all(np.allclose(t, g) for t, g in zip(targets, grams[0]))
+  assert W == pytest.approx([2.0, 1.0])
+
+
+def test_blended_loss_differs_from_the_sum_by_a_constant():
+  grams = styles()
+  style_weights = [1.0, 2.0, 0.5]
+  layer_weights = [[1.0, 1.0], [0.5, 2.0], [3.0, 1.0]]
+  targets, W = blend_grams(grams, style_weights, layer_weights)
+
+  def gap(G, l):
+    separate = sum(style_weights[s] * layer_weights[s][l] * np.sum((G - grams[s][l]) ** 2)
+                   for s in range(len(grams)))
+    return separate - W[l] * np.sum((G - targets[l]) ** 2)
+
+  rng = np.random.RandomState(1)
+  for l in range(len(targets)):
+    gaps = [gap(rng.rand(4, 4), l) for _ in range(5)]
+    assert gaps == pytest.approx([gaps[0]] * 5, rel = 1e-5)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from cache import FeatureCache, ResultCache, job_fingerprint
+
+
+def test_fingerprint_depends_on_content_and_params():
+  a, b = np.zeros((4, 4, 3)), np.ones((4, 4, 3))
+  key = job_fingerprint(a, b, 4, 4, ['c'], ['s'], params = {'alpha' : 1})
+  assert key == job_fingerprint(a.copy(), b.copy(), 4, 4, ['c'], ['s'], params = {'alpha' : 1})
+  assert key != job_fingerprint(b, b, 4, 4, ['c'], ['s'], params = {'alpha' : 1})
+  assert key != job_fingerprint(a, b, 4, 4, ['c'], ['s'], params = {'alpha' : 10})
+
+
+def test_result_cache_round_trip_and_stats(tmp_path):
+  cache = ResultCache(str(tmp_path))
+  assert cache.get('k') is None
+  cache.put('k', np.arange(3))
+  assert list(cache.get('k')) == [0, 1, 2]
+  stats = cache.stats()
+  assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_peek_does_not_count(tmp_path):
+  cache = ResultCache(str(tmp_path))
+  assert cache.peek('k') is None
+  cache.put('k', np.arange(3))
+  assert cache.peek('k') is not None
+  assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_get_or_compute_counts_a_miss_once(tmp_path):
+  cache = ResultCache(str(tmp_path))
+  calls = []
+  compute = lambda: calls.append(1) or np.ones(2)
+  cache.get_or_compute('k', compute)
+  cache.get_or_compute('k', compute)
+  assert len(calls) == 1
+  assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+  entry = np.zeros(1000)
+  size = os.path.getsize(_saved(tmp_path, entry))
+  cache = ResultCache(str(tmp_path / 'cache'), max_bytes = 2 * size)
+  now = time.time()
+  for age, key in enumerate(['new', 'old']):
+    cache.put(key, entry)
+    os.utime(cache.path(key), (now - 100 * (age + 1), now - 100 * (age + 1)))
+  cache.put('newest', entry)
+  assert cache.peek('old') is None
+  assert cache.peek('new') is not None and cache.peek('newest') is not None
+  assert cache.evictions == 1
+
+
+def test_concurrent_identical_jobs_compute_once(tmp_path):
+  cache = ResultCache(str(tmp_path))
+  calls = []
+  def compute():
+    calls.append(1)
+    time.sleep(0.2)
+    return np.ones(2)
+  threads = [threading.Thread(target = cache.get_or_compute, args = ('k', compute))
+             for _ in range(4)]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  assert len(calls) == 1
+  assert cache.stats()['shared'] == 3
+
+
+def _saved(tmp_path, entry):
+  path = str(tmp_path / 'size.npy')
+  np.save(path, entry)
+  return path
+
+
+def test_feature_cache_spills_and_reads_back(tmp_path):
+  entry = {'conv1_1' : np.arange(100, dtype = np.float32)}
+  cache = FeatureCache(max_bytes = 0, spill_dir = str(tmp_path))
+  cache.put('k', entry)
+  assert 'k' not in cache.entries
+  assert list(cache.get('k')['conv1_1']) == list(entry['conv1_1'])
+  assert not [name for name in os.listdir(str(tmp_path)) if '.tmp' in name]
+
+
+def test_feature_cache_spill_directory_is_capped(tmp_path):
+  entry = {'conv1_1' : np.zeros(1000, dtype = np.float32)}
+  cache = FeatureCache(max_bytes = 0, spill_dir = str(tmp_path), spill_bytes = 13000)
+  now = time.time()
+  for age, key in zip((300, 200, 100), ('a', 'b', 'c')):
+    cache.put(key, entry)
+    os.utime(str(tmp_path / key), (now - age, now - age))
+  cache.get('a')      # most recently used again
+  cache.put('d', entry)
+  assert sorted(os.listdir(str(tmp_path))) == ['a', 'c', 'd']
+
+
+def test_failed_spill_is_not_fatal(tmp_path, monkeypatch):
+  def fail(*args):
+    raise IOError('disk full')
+  monkeypatch.setattr(np, 'save', fail)
+  cache = FeatureCache(spill_dir = str(tmp_path), write_through = True)
+  cache.put('k', {'conv1_1' : np.zeros(10)})
+  assert os.listdir(str(tmp_path)) == []
+  assert cache.get('k') is not None
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from ext.tf_vgg import vgg19
+
+
+def tiny_vgg(channels = 2):
+  # Vgg19 with random weights and a few channels per layer, skipping the
+  # weight file
+  rng = np.random.RandomState(0)
+  vgg = vgg19.Vgg19.__new__(vgg19.Vgg19)
+  vgg.precision = 'float32'
+  vgg.data_dict = {}
+  depth = 3
+  for name in vgg19.LAYERS:
+    if name.startswith('conv'):
+      vgg.data_dict[name] = [rng.randn(3, 3, depth, channels).astype(np.float32),
+                             rng.randn(channels).astype(np.float32)]
+      depth = channels
+  return vgg
+
+
+def test_segments_end_at_pools():
+  vgg = tiny_vgg()
+  assert [s[-1] for s in vgg.segments(1)] == ['pool1', 'pool2', 'pool3', 'pool4', 'pool5']
+  assert [s[-1] for s in vgg.segments(2)] == ['pool2', 'pool4', 'pool5']
+  assert sum(vgg.segments(3), []) == list(vgg19.LAYERS)
+
+
+@pytest.mark.parametrize('checkpoint_every', [1, 2, 5])
+def test_checkpointed_gradient_matches_tf_gradients(checkpoint_every):
+  tf = pytest.importorskip('tensorflow')
+  image = np.random.RandomState(1).rand(1, 16, 16, 3).astype(np.float32)
+  graph = tf.Graph()
+  with graph.as_default():
+    vgg = tiny_vgg()
+    x = tf.constant(image)
+    vgg.build(x)
+    loss = tf.reduce_sum(tf.square(vgg.conv1_2)) + tf.reduce_sum(vgg.conv4_1) \
+           + tf.reduce_sum(tf.square(vgg.conv5_1))
+    expected = tf.gradients(loss, x)[0]
+    checkpointed = vgg.checkpointed_gradient(loss, checkpoint_every)
+    with tf.Session() as sess:
+      expected, checkpointed = sess.run([expected, checkpointed])
+  assert np.allclose(checkpointed, expected, rtol = 1e-4, atol = 1e-5)
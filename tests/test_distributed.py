@@ -0,0 +1,65 @@
+import time
+
+import distributed
+from distributed import DONE, FAILED, QUEUED, RUNNING, SQLiteQueue, Worker, enqueue_grid
+
+
+def test_jobs_are_claimed_once_in_order(tmp_path):
+  queue = SQLiteQueue(str(tmp_path / 'jobs.db'))
+  ids = enqueue_grid(queue, ['c1', 'c2'], ['s1'])
+  first, second = queue.claim('w1'), queue.claim('w2')
+  assert [first[0], second[0]] == ids
+  assert first[1]['content'] == 'c1' and first[1]['width'] == distributed.DEFAULT_JOB['width']
+  assert queue.claim('w3') is None
+
+  queue.complete(first[0], {'ok' : True})
+  queue.fail(second[0], 'boom')
+  assert queue.counts() == {QUEUED : 0, RUNNING : 0, DONE : 1, FAILED : 1}
+  assert queue.results()[0][2] == {'ok' : True}
+
+
+def test_stale_jobs_are_requeued_then_failed(tmp_path):
+  queue = SQLiteQueue(str(tmp_path / 'jobs.db'))
+  queue.enqueue({'content' : 'c'})
+  for attempt in range(3):
+    job_id, _ = queue.claim('w')
+    assert queue.requeue_stale(timeout = 60) == 0     # heartbeat is fresh
+    time.sleep(0.01)
+    assert queue.requeue_stale(timeout = 0, max_attempts = 3) == 1
+  assert queue.counts()[FAILED] == 1
+  assert queue.claim('w') is None
+
+
+def test_heartbeat_keeps_a_job_running(tmp_path):
+  queue = SQLiteQueue(str(tmp_path / 'jobs.db'))
+  queue.enqueue({'content' : 'c'})
+  job_id, _ = queue.claim('w')
+  time.sleep(0.05)
+  queue.heartbeat('w', job_id)
+  assert queue.requeue_stale(timeout = 0.04) == 0
+  assert queue.counts()[RUNNING] == 1
+
+
+class Engine:
+  built = []
+
+  def __init__(self, style, content, width, height, **kwargs):
+    self.closed = False
+    Engine.built.append((width, height))
+
+  def close(self):
+    self.closed = True
+
+
+def test_worker_evicts_the_least_recently_used_engine(tmp_path, monkeypatch):
+  monkeypatch.setattr(distributed, 'Transfer', Engine)
+  Engine.built = []
+  worker = Worker(SQLiteQueue(str(tmp_path / 'jobs.db')), str(tmp_path), max_engines = 2)
+  small = worker.engine(100, 100)
+  for _ in range(3):
+    worker.engine(800, 800)
+    worker.engine(100, 100)
+    worker.engine(600, 600)      # evicts 800, the least recently used
+    worker.engine(100, 100)
+  assert not small.closed
+  assert Engine.built.count((100, 100)) == 1
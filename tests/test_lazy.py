@@ -0,0 +1,20 @@
+import sys
+
+from lazy import LazyModule, lazy_import
+
+
+def test_import_is_deferred_until_first_use():
+  sys.modules.pop('colorsys', None)
+  colorsys = lazy_import('colorsys')
+  assert isinstance(colorsys, LazyModule)
+  assert 'colorsys' not in sys.modules
+
+  assert colorsys.rgb_to_hsv(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+  assert 'colorsys' in sys.modules
+
+
+def test_attributes_are_copied_after_loading():
+  json = lazy_import('json')
+  json.dumps
+  assert 'dumps' in json.__dict__
+  assert json.loads('[1]') == [1]
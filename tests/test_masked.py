@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from ext.tf_vgg import vgg19
+from masked import bounding_box, load_mask, load_rgb, receptive_pad
+
+
+def test_load_rgb_repeats_grayscale_and_drops_alpha():
+  gray = np.full((4, 5), 51, dtype = np.uint8)
+  assert load_rgb(gray).shape == (4, 5, 3)
+  rgba = np.zeros((4, 5, 4), dtype = np.uint8)
+  assert load_rgb(rgba).shape == (4, 5, 3)
+
+
+def test_load_rgb_scales_by_dtype_not_by_value():
+  dark = np.ones((4, 5, 3), dtype = np.uint8)     # max 1, still 8-bit
+  assert load_rgb(dark).max() == pytest.approx(1 / 255.0)
+  unit = np.full((4, 5, 3), 0.5)
+  assert load_rgb(unit).max() == pytest.approx(0.5)
+
+
+def test_load_mask_scales_8_bit_masks():
+  assert load_mask(np.full((3, 3), 255, dtype = np.uint8)).max() == pytest.approx(1.0)
+  assert load_mask(np.ones((3, 3, 3), dtype = np.uint8)).max() == pytest.approx(1 / 255.0)
+
+
+def test_bounding_box_is_padded_and_clipped():
+  mask = np.zeros((10, 12))
+  mask[4:6, 1:3] = 1
+  assert bounding_box(mask, 0) == (4, 6, 1, 3)
+  assert bounding_box(mask, 2) == (2, 8, 0, 5)
+  assert bounding_box(mask, 20) == (0, 10, 0, 12)
+
+
+def test_bounding_box_of_an_empty_mask():
+  with pytest.raises(ValueError):
+    bounding_box(np.zeros((4, 4)), 1)
+
+
+def test_receptive_field_grows_through_the_layers():
+  sizes = [vgg19.receptive_field(layer) for layer in ('conv1_1', 'conv1_2', 'pool1', 'conv2_1')]
+  assert sizes == [3, 5, 6, 10]
+  assert vgg19.receptive_field('conv4_2') == 84
+  with pytest.raises(ValueError):
+    vgg19.receptive_field('fc6')
+
+
+def test_receptive_pad_covers_the_deepest_layer():
+  assert receptive_pad(['conv1_1', 'conv4_2']) == 42
+  assert receptive_pad(['conv1_1']) == 1
@@ -0,0 +1,144 @@
+import numpy as np
+import pytest
+
+from optimize import SGD
+
+TARGET = np.array([3.0, -2.0, 0.5])
+
+
+def quadratic(**params):
+  # Loss |theta - TARGET|^2 from theta = 0
+  base = {
+    'theta' : np.zeros(3),
+    'dJdTheta' : lambda t: (2 * (t - TARGET), float(np.sum(np.square(t - TARGET)))),
+    'J' : lambda t: float(np.sum(np.square(t - TARGET))),
+    'verbose' : False,
+    'save' : lambda p: p
+  }
+  base.update(params)
+  return SGD(base)
+
+
+def test_cosine_schedule_anneals_to_lr_min():
+  sgd = quadratic(lr_schedule = 'cosine', lr_min = 0.1)
+  assert sgd.schedule(sgd.params, 1, 11) == pytest.approx(1.0)
+  assert sgd.schedule(sgd.params, 6, 11) == pytest.approx(0.55)
+  assert sgd.schedule(sgd.params, 11, 11) == pytest.approx(0.1)
+  assert sgd.schedule(sgd.params, 20, 11) == pytest.approx(0.1)
+
+
+def test_step_schedule_decays_every_decay_every():
+  sgd = quadratic(lr_schedule = 'step', decay = 0.5, decay_every = 10)
+  assert [sgd.schedule(sgd.params, i, 0) for i in (1, 10, 11, 21)] == [1, 1, 0.5, 0.25]
+
+
+def test_unknown_schedule_raises():
+  sgd = quadratic(lr_schedule = 'linear')
+  with pytest.raises(ValueError):
+    sgd.schedule(sgd.params, 1, 10)
+
+
+def test_search_step_size_lowers_the_loss_within_budget():
+  sgd = quadratic(type = 'sgd', search_evals = 6)
+  step = sgd.search_step_size(sgd.params)
+  start = sgd.params['J'](sgd.params['theta'])
+  grad, _ = sgd.params['dJdTheta'](sgd.params['theta'])
+  assert sgd.params['J'](sgd.params['theta'] - step * grad) < start
+  assert sgd.state['search_evals'] <= 6
+
+
+def test_search_step_size_shrinks_a_step_that_overshoots():
+  # The first trial moves the largest entry by 1, past a minimum at 0.3
+  target = 0.1 * TARGET
+  J = lambda t: float(np.sum(np.square(t - target)))
+  sgd = quadratic(type = 'sgd', J = J, dJdTheta = lambda t: (2 * (t - target), J(t)))
+  step = sgd.search_step_size(sgd.params)
+  assert step < 1.0 / (2 * np.max(np.abs(target)))
+  assert J(2 * step * target) < J(np.zeros(3))
+
+
+@pytest.mark.parametrize('params', [
+  {'type' : 'sgd', 'step_size' : 0.1},
+  {'type' : 'momentum', 'step_size' : 0.05, 'gamma' : 0.9},
+  {'type' : 'adam', 'step_size' : 'auto'},
+  {'type' : 'adam', 'step_size' : 0.1, 'lr_schedule' : 'cosine'}
+])
+def test_first_order_types_converge_on_a_quadratic(params):
+  result = quadratic(iters = 300, **params).optimize()
+  assert result['loss'][-1] < 1e-2 * result['loss'][0]
+  assert len(result['metrics']) == 300
+
+
+def test_optimize_resumes_where_it_stopped():
+  sgd = quadratic(type = 'sgd', step_size = 0.1, iters = 5)
+  sgd.optimize()
+  result = sgd.optimize()
+  assert result['iter'] == 10
+  assert [row['iter'] for row in result['metrics']] == list(range(1, 11))
+
+
+def test_resumed_runs_follow_one_schedule():
+  steps = lambda sgd: [row['step_size'] for row in sgd.state['metrics']]
+  whole = quadratic(type = 'adam', step_size = 0.1, lr_schedule = 'cosine',
+                    schedule_iters = 20, iters = 20)
+  whole.optimize()
+  resumed = quadratic(type = 'adam', step_size = 0.1, lr_schedule = 'cosine',
+                      schedule_iters = 20, iters = 8)
+  resumed.optimize()
+  resumed.params['iters'] = 12
+  resumed.optimize()
+  assert steps(resumed) == pytest.approx(steps(whole))
+
+
+def test_resuming_does_not_stretch_the_schedule():
+  # Without schedule_iters the schedule ends with the first call
+  sgd = quadratic(type = 'adam', step_size = 0.1, lr_schedule = 'cosine', lr_min = 0.1,
+                  iters = 10)
+  sgd.optimize()
+  sgd.params['iters'] = 5
+  sgd.optimize()
+  assert [row['step_size'] for row in sgd.state['metrics'][10:]] == pytest.approx([0.01] * 5)
+
+
+def test_unknown_type_raises():
+  with pytest.raises(ValueError):
+    quadratic(type = 'rmsprop').optimize()
+
+
+def test_first_adam_step_after_a_phase_is_full_size():
+  # Bias correction restarts with the moments, so the first Adam step of a
+  # later phase is as large as from a fresh start
+  fresh = quadratic(type = 'adam', step_size = 0.1, iters = 1)
+  fresh.optimize()
+  fresh_step = np.abs(fresh.state['update'])
+
+  sgd = quadratic(iters = 1)
+  sgd.optimize_phases([{'type' : 'sgd', 'step_size' : 1e-4, 'iters' : 30},
+                       {'type' : 'adam', 'step_size' : 0.1}])
+  assert np.abs(sgd.state['update']) == pytest.approx(fresh_step, rel = 1e-3)
+
+
+def test_interrupting_a_phase_ends_the_schedule():
+  sgd = quadratic(iters = 10)
+  gradient = sgd.params['dJdTheta']
+  def interrupt(theta):
+    if sgd.state['iter'] == 3:
+      raise KeyboardInterrupt
+    return gradient(theta)
+  sgd.params['dJdTheta'] = interrupt
+  result = sgd.optimize_phases([{'type' : 'sgd', 'step_size' : 0.1},
+                                {'type' : 'adam', 'step_size' : 0.1}])
+  assert [p['iters'] for p in result['phases']] == [3]
+  assert sgd.state['interrupted']
+
+
+def test_empty_phase_schedule_raises():
+  with pytest.raises(ValueError):
+    quadratic().optimize_phases([])
+
+
+def test_lr_schedule_skips_adadelta():
+  result = quadratic(type = 'adadelta', step_size = 'auto', lr_schedule = 'cosine',
+                     gamma = 0.9, iters = 5).optimize()
+  assert len(result['loss']) == 5
+  assert 'step_size' not in result['metrics'][-1]
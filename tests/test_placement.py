@@ -0,0 +1,26 @@
+import pytest
+
+from placement import partition_cores
+
+
+def test_cores_are_split_contiguously():
+  placements = partition_cores(3, cpus = list(range(8)))
+  assert [p['cpu_affinity'] for p in placements] == [[0, 1, 2], [3, 4, 5], [6, 7]]
+  assert [p['intra_op_threads'] for p in placements] == [3, 3, 2]
+  assert all(p['inter_op_threads'] == 1 for p in placements)
+
+
+def test_every_core_is_used_once():
+  cpus = [2, 3, 5, 7, 11]
+  placements = partition_cores(2, cpus = cpus)
+  assert sum((p['cpu_affinity'] for p in placements), []) == cpus
+
+
+@pytest.mark.parametrize('num_workers', [0, 5])
+def test_impossible_splits_are_rejected(num_workers):
+  with pytest.raises(ValueError):
+    partition_cores(num_workers, cpus = [0, 1, 2, 3])
+
+
+def test_defaults_to_the_available_cores():
+  assert len(partition_cores(1)) == 1
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from planner import Controller, CostModel, convergence_tau, plan, simulate
+
+
+def samples(a = 0.01, b = 1e-6, setup = 2.0, tau = 20):
+  # Synthetic calibration runs of two optimizers at three sizes
+  loss = list(1 + 9 * np.exp(-np.arange(100) / float(tau)))
+  return [{'optimizer' : optimizer, 'threads' : None, 'pixels' : size * size,
+           'seconds_per_iter' : a + b * size * size, 'setup_seconds' : setup,
+           'loss' : loss}
+          for optimizer in ('adam', 'adadelta') for size in (120, 240, 360)]
+
+
+@pytest.fixture
+def model():
+  return CostModel().fit(samples())
+
+
+def test_fit_recovers_a_linear_cost(model):
+  assert model.fits['adam/None'] == pytest.approx([0.01, 1e-6])
+  assert model.setup == pytest.approx([2.0, 0.0], abs = 1e-9)
+  assert model.seconds_per_iter('adam', 100 * 100) == pytest.approx(0.02)
+
+
+def test_convergence_tau():
+  assert convergence_tau(10 * np.exp(-np.arange(200) / 20.0)) == pytest.approx(21, abs = 1)
+  assert convergence_tau([1.0, 1.0]) == 2
+
+
+def test_thread_counts_scale_from_the_nearest_calibrated_one():
+  model = CostModel(fits = {'adam/4' : [0.0, 1e-6]}, convergence = {'adam' : 10})
+  assert model.seconds_per_iter('adam', 1e6, threads = 8) == pytest.approx(0.5)
+
+
+def test_save_and_load(model, tmp_path):
+  path = str(tmp_path / 'model.json')
+  model.save(path)
+  loaded = CostModel.load(path)
+  assert loaded.fits == model.fits and loaded.convergence == model.convergence
+
+
+def test_plan_fits_the_deadline_and_keeps_the_aspect_ratio(model):
+  p = plan(model, 30, 480, 240)
+  assert p['predicted_seconds'] <= 30 * 0.9 + 1e-9
+  width, height, iters = p['levels'][-1]
+  assert width <= 480 and height <= 240
+  assert width == pytest.approx(2 * height, abs = 1)
+  assert iters >= 1
+
+
+def test_longer_deadlines_plan_better_quality(model):
+  qualities = [plan(model, d, 480, 480)['quality'] for d in (5, 20, 80, 320)]
+  assert qualities == sorted(qualities)
+
+
+def test_impossible_deadline_falls_back_to_the_smallest_plan(model):
+  p = plan(model, 0.5, 480, 480)
+  assert p['levels'] == [[120, 120, 1]]
+
+
+def test_controller_stretches_the_last_level_on_a_fast_node(model):
+  p = plan(model, 30, 240, 240)
+  controller = Controller(model, p, 30)
+  level = len(p['levels']) - 1
+  per_iter = 0.5 * model.seconds_per_iter(p['optimizer'], p['levels'][level][0] * p['levels'][level][1])
+  elapsed, done = 0.0, 0
+  while True:
+    n = controller.next_chunk(level, elapsed)
+    if n == 0:
+      break
+    elapsed += n * per_iter
+    controller.record(level, n, n * per_iter)
+    done += n
+  assert done > p['levels'][level][2]
+  assert elapsed <= 30 * 0.9
+
+
+def test_controller_stops_at_the_deadline():
+  model = CostModel(fits = {'adam/None' : [1.0, 0.0]}, convergence = {'adam' : 10})
+  controller = Controller(model, {'optimizer' : 'adam', 'levels' : [[64, 64, 100]]}, 10,
+                          margin = 0)
+  assert controller.next_chunk(0, elapsed = 9.5) == 0
+  assert controller.next_chunk(0, elapsed = 0, chunk = 5) == 5
+
+
+def test_adjusting_mid_run_raises_the_hit_rate(model):
+  fixed = simulate(model, jobs = 300, noise = 0.4, adjust = False)
+  adjusted = simulate(model, jobs = 300, noise = 0.4, adjust = True)
+  assert adjusted['hit_rate'] > fixed['hit_rate']
+  assert adjusted['hit_rate'] > 0.9
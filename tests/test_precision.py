@@ -0,0 +1,17 @@
+import pytest
+
+from ext.tf_vgg import vgg19
+
+
+def test_int8_is_not_offered():
+  assert vgg19.PRECISIONS == ('float32', 'bfloat16')
+
+
+def test_unknown_precision_is_rejected_before_loading_weights(tmp_path):
+  with pytest.raises(ValueError):
+    vgg19.Vgg19(str(tmp_path / 'missing.npy'), precision = 'int8')
+
+
+def test_bfloat16_probe_returns_a_bool():
+  pytest.importorskip('tensorflow')
+  assert vgg19.bfloat16_supported() in (True, False)
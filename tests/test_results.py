@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pytest
+
+from results import ResultsWriter, read_metrics
+
+METRICS = [{'iter' : 1, 'loss' : 10.0, 'step_size' : 0.5},
+           {'iter' : 2, 'loss' : 7.5}]
+
+
+@pytest.mark.parametrize('metrics_format', ['jsonl', 'csv'])
+def test_metrics_round_trip(tmp_path, metrics_format):
+  writer = ResultsWriter(str(tmp_path), 'run', metrics_format = metrics_format)
+  path = writer.write_metrics(METRICS)
+  assert path == str(tmp_path / 'run_metrics.{}'.format(metrics_format))
+  assert read_metrics(path) == METRICS
+  assert os.listdir(str(tmp_path)) == [os.path.basename(path)]
+
+
+def test_no_metrics(tmp_path):
+  writer = ResultsWriter(str(tmp_path), 'run', metrics_format = 'none')
+  assert writer.write_metrics(METRICS) is None
+  assert os.listdir(str(tmp_path)) == []
+
+
+def test_unknown_formats_are_rejected(tmp_path):
+  with pytest.raises(ValueError):
+    ResultsWriter(str(tmp_path), 'run', image_format = 'gif')
+  with pytest.raises(ValueError):
+    ResultsWriter(str(tmp_path), 'run', metrics_format = 'xml')
+
+
+def test_image_is_clipped_and_scaled(tmp_path):
+  io = pytest.importorskip('skimage.io')
+  writer = ResultsWriter(str(tmp_path), 'run', image_format = 'png')
+  path = writer.write_image(np.array([[[-0.5, 0.5, 1.5]]]))
+  assert io.imread(path).tolist() == [[[0, 128, 255]]]
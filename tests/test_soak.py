@@ -0,0 +1,43 @@
+import pytest
+
+from soak import Soak, slope
+
+
+def soak(rss, nodes = None, figures = None):
+  # Samples as run() records them, one per job
+  s = Soak()
+  s.samples = [{'job' : i, 'seconds' : float(i), 'rss_mb' : r,
+                'graph_nodes' : (nodes or [100] * len(rss))[i],
+                'figures' : (figures or [0] * len(rss))[i]}
+               for i, r in enumerate(rss)]
+  return s
+
+
+def test_slope():
+  assert slope([5.0, 7.0, 9.0, 11.0]) == pytest.approx(2.0)
+  assert slope([3.0]) == 0.0
+
+
+def test_steady_run_passes():
+  # Allocators warm up over the first jobs, then memory stays flat
+  assert soak([100, 150, 180, 190, 195, 200, 200.5, 200, 200.5, 200]).check() == []
+
+
+def test_growing_memory_fails():
+  failures = soak([100 + 3 * i for i in range(10)]).check()
+  assert len(failures) == 1 and 'RSS' in failures[0]
+
+
+def test_graph_growth_after_warmup_fails():
+  nodes = [50, 80, 100, 100, 100, 100, 101, 102, 103, 104]
+  failures = soak([100] * 10, nodes = nodes).check()
+  assert len(failures) == 1 and '4 nodes' in failures[0]
+
+
+def test_open_figures_fail_even_during_warmup():
+  failures = soak([100] * 10, figures = [1] + [0] * 9).check()
+  assert len(failures) == 1 and 'figures' in failures[0]
+
+
+def test_short_runs_check_every_sample():
+  assert soak([100, 110, 120]).check(warmup = 5)
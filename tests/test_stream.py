@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from transfer import Transfer
+
+TARGET = np.array([3.0, -2.0, 0.5])
+
+
+class QuadraticTransfer:
+  # Just what Transfer.stream needs, with loss |theta - TARGET|^2
+  def style_params(self, name, out_dir, alpha, beta):
+    return {
+      'name' : name,
+      'theta' : np.zeros(3),
+      'dJdTheta' : lambda t: (2 * (t - TARGET), float(np.sum(np.square(t - TARGET)))),
+      'J' : lambda t: float(np.sum(np.square(t - TARGET)))
+    }
+
+  def output_image(self, theta):
+    return theta[None]
+
+
+def stream(**kwargs):
+  kwargs.setdefault('params', {'type' : 'sgd', 'step_size' : 0.1, 'iters' : 20})
+  return Transfer.stream(QuadraticTransfer(), **kwargs)
+
+
+def test_previews_end_with_the_final_result():
+  previews = list(stream(iters = (1, 5)))
+  assert previews[-1]['final'] and previews[-1]['iter'] == 20
+  assert previews[-1]['theta'] == pytest.approx(TARGET, rel = 0.05)
+  assert not any(p['final'] for p in previews[:-1])
+  assert [p['iter'] for p in previews] == sorted(p['iter'] for p in previews)
+  # Every published preview is either seen or counted as skipped
+  assert len(previews) + sum(p['skipped'] for p in previews) == previews[-1]['index'] == 3
+
+
+def test_loss_fractions_trigger_previews():
+  # The optimizer does not wait for the consumer, so count what it published:
+  # one preview per fraction crossed plus the final one
+  previews = list(stream(iters = (), losses = (0.5, 0.01, 1e-9)))
+  assert previews[-1]['index'] == 3
+
+
+def test_images_are_rendered_for_the_consumer():
+  preview = next(stream(iters = (1,)))
+  assert preview['image'].shape == (1, 3)
+
+
+def test_closing_the_generator_stops_the_optimizer():
+  previews = stream(iters = (1,), params = {'type' : 'sgd', 'step_size' : 0.01, 'iters' : 10 ** 6})
+  next(previews)
+  previews.close()      # joins the optimizer thread, which would run for minutes
+
+
+def test_optimizer_errors_reach_the_consumer():
+  with pytest.raises(ValueError):
+    list(stream(params = {'type' : 'rmsprop', 'step_size' : 0.1, 'iters' : 5}))
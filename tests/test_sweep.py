@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from sweep import DEFAULT_CONFIG, Sweep, grid
+
+TARGET = np.array([3.0, -2.0, 0.5])
+
+
+class QuadraticTransfer:
+  # Stands in for Transfer: content and style loss both pull towards TARGET
+  def __init__(self):
+    self.synthetic = np.zeros(3)
+
+  def losses(self, image):
+    c_loss = float(np.sum(np.square(image - TARGET)))
+    return c_loss, 1e-3 * c_loss
+
+  def loss_and_gradient(self, image, alpha, beta):
+    c_loss, s_loss = self.losses(image)
+    grad = (alpha + 1e-3 * beta) * 2 * (image - TARGET)
+    return grad, c_loss, s_loss
+
+
+def test_grid_fills_in_the_defaults():
+  configs = grid(alpha = [1, 10])
+  assert [c['alpha'] for c in configs] == [1, 10]
+  assert all(c['beta'] == DEFAULT_CONFIG['beta'] for c in configs)
+
+
+def test_grid_drops_parameters_the_optimizer_ignores():
+  configs = grid(type = ['sgd', 'adadelta'], step_size = [0.1, 1.0], gamma = [0.5, 0.9])
+  assert len(configs) == 4
+  assert sorted(c['step_size'] for c in configs if c['type'] == 'sgd') == [0.1, 1.0]
+  assert sorted(c['gamma'] for c in configs if c['type'] == 'adadelta') == [0.5, 0.9]
+  assert not any('gamma' in c for c in configs if c['type'] == 'sgd')
+  assert not any('step_size' in c for c in configs if c['type'] == 'adadelta')
+
+
+@pytest.fixture
+def sweep():
+  configs = grid(type = ['sgd'], step_size = [0.001, 0.01, 0.1, 0.6])
+  return Sweep(QuadraticTransfer(), configs, metric = 'loss', eta = 2,
+               min_iters = 5, max_iters = 20)
+
+
+def test_halving_keeps_the_best_configuration(sweep):
+  ranking = sweep.run()
+  assert sweep.rungs == [(5, 4), (10, 2), (20, 1)]
+  assert ranking[0].config['step_size'] == 0.1
+  assert ranking[0].iters == 20
+  # Diverged runs rank last
+  assert ranking[-1].config['step_size'] == 0.6
+
+
+def test_compute_counts_iterations_actually_run(sweep):
+  sweep.run()
+  assert sweep.compute() == (20 + 10 + 5 + 5, 4 * 20)
+
+
+def test_schedules_span_the_whole_budget(sweep):
+  sweep.run()
+  assert all(c.optimizer.params['schedule_iters'] == 20 for c in sweep.ranking)
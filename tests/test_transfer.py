@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from transfer import GRAM_SAMPLING_MIN_POSITIONS, gram_matrix, sampled_gram_matrix
+
+
+def estimates(features, fraction, mode, runs = 200):
+  graph = tf.Graph()
+  with graph.as_default():
+    F = tf.constant(features)
+    exact = gram_matrix(F)[0]
+    sampled = sampled_gram_matrix(F, fraction, mode)
+    with tf.Session() as sess:
+      return sess.run(exact), [sess.run(sampled) for _ in range(runs)]
+
+
+@pytest.mark.parametrize('mode', ['random', 'grid'])
+def test_sampled_gram_is_unbiased(mode):
+  features = np.random.RandomState(0).rand(1, 64, 64, 4).astype(np.float32)
+  exact, sampled = estimates(features, 0.25, mode)
+  assert np.mean(sampled, axis = 0) == pytest.approx(exact, rel = 0.02)
+
+
+def test_small_layers_stay_exact():
+  side = int(np.sqrt(GRAM_SAMPLING_MIN_POSITIONS)) // 2
+  features = np.random.RandomState(0).rand(1, side, side, 4).astype(np.float32)
+  exact, sampled = estimates(features, 0.1, 'random', runs = 2)
+  assert np.allclose(sampled[0], exact)
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+skimage_io = pytest.importorskip('skimage.io')
+
+from video import read_frames
+
+
+@pytest.mark.parametrize('frame', [
+  np.full((8, 10), 200, dtype = np.uint8),
+  np.full((8, 10, 4), 200, dtype = np.uint8),
+  np.full((8, 10, 3), 200, dtype = np.uint8)
+])
+def test_frames_are_read_as_rgb_in_unit_range(tmp_path, frame):
+  skimage_io.imsave(str(tmp_path / 'frame_00000.png'), frame)
+  read = list(read_frames(str(tmp_path)))
+  assert read[0].shape == (8, 10, 3)
+  assert read[0].max() == pytest.approx(200 / 255.0)
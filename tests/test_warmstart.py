@@ -0,0 +1,69 @@
+import math
+import os
+
+import numpy as np
+import pytest
+
+from warmstart import ResultStore, distance
+
+JOB = {'alpha' : 1, 'beta' : 1e3}
+
+
+def entry(alpha, beta, width = 100, height = 100):
+  return {'params' : {'alpha' : alpha, 'beta' : beta}, 'width' : width, 'height' : height}
+
+
+def test_distance_compares_weight_ratio_and_pixels():
+  assert distance(JOB, 100, 100, entry(10, 1e4)) == pytest.approx(0)
+  assert distance(JOB, 100, 100, entry(1, 1e2)) == pytest.approx(math.log(10))
+  assert distance(JOB, 200, 100, entry(1, 1e3)) == pytest.approx(math.log(2))
+
+
+@pytest.mark.parametrize('weights', [{'alpha' : 0, 'beta' : 1}, {'alpha' : 1, 'beta' : 0}])
+def test_distance_rejects_zero_weights(weights):
+  with pytest.raises(ValueError):
+    distance(weights, 100, 100, entry(1, 1e3))
+
+
+def test_per_key_must_be_positive(tmp_path):
+  with pytest.raises(ValueError):
+    ResultStore(str(tmp_path), per_key = 0)
+
+
+class Target:
+  # The part of Transfer that warm_start uses
+  width = height = 8
+
+  def set_initial_img(self, image):
+    self.initial = image
+
+
+def test_nearest_result_warm_starts_and_reports_saved_iterations(tmp_path):
+  store = ResultStore(str(tmp_path))
+  cold = store.put('k', np.zeros((8, 8, 3)), {'alpha' : 1, 'beta' : 1e2}, 8, 8, iters = 100)
+  store.put('k', np.ones((8, 8, 3)), {'alpha' : 1, 'beta' : 1e5}, 8, 8, iters = 100)
+  assert not cold['warm']
+
+  target = Target()
+  record = store.warm_start(target, 'k', JOB)
+  assert record['params']['beta'] == 1e2
+  assert target.initial.max() == 0
+
+  report = store.put('k', np.zeros((8, 8, 3)), JOB, 8, 8, iters = 30, start = record)
+  assert report == {'warm' : True, 'iters' : 30, 'cold_iters' : 100, 'iters_saved' : 70}
+
+
+def test_zero_weight_jobs_are_not_warm_started(tmp_path):
+  store = ResultStore(str(tmp_path))
+  store.put('k', np.zeros((8, 8, 3)), {'alpha' : 0, 'beta' : 1}, 8, 8, iters = 10)
+  assert store.warm_start(Target(), 'k', JOB) is None
+  store.put('k', np.zeros((8, 8, 3)), JOB, 8, 8, iters = 10)
+  assert store.warm_start(Target(), 'k', {'alpha' : 0, 'beta' : 1}) is None
+
+
+def test_only_the_newest_results_are_kept(tmp_path):
+  store = ResultStore(str(tmp_path), per_key = 2)
+  for iters in (1, 2, 3):
+    store.put('k', np.zeros((8, 8, 3)), JOB, 8, 8, iters = iters)
+  assert [r['iters'] for r in store.records('k')] == [2, 3]
+  assert len(os.listdir(str(tmp_path / 'k'))) == 4